@@ -120,6 +120,15 @@ def setup_logging(conf):
 def get_supported_metrics():
     return logging.get_supported_metrics()
 
+def get_metric_intervals(supported_metrics):
+    return logging.get_metric_intervals(supported_metrics)
+
+def get_collector_deadlines():
+    return logging.get_collector_deadlines()
+
+def get_process_groups():
+    return logging.get_process_groups()
+
 def get_monitor_time_range():
     return logging.get_monitor_time_range()
 
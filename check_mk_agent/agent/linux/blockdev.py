@@ -0,0 +1,106 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""/proc/diskstats indexed by device number.
+
+Rows are looked up by (major, minor).  Partitions are resolved to their
+parent disk through a map built from /sys/class/block/*/partition, which
+is only rebuilt when a block device is added or removed.
+"""
+
+import os
+import re
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+SYS_CLASS_BLOCK = '/sys/class/block'
+
+# Devices whose statistics are collected.
+DISK_NAME_RE = re.compile('x?[shv]d[a-z]*|cciss/c[0-9]+d[0-9]+|emcpower[a-z]+'
+                          '|dm-[0-9]+|VxVM.*')
+
+# A row is [major, minor, name] followed by the first 11 statistics.
+NUM_STAT_FIELDS = 11
+
+
+def read_partition_parents(sys_class_block=SYS_CLASS_BLOCK):
+    """Return {partition name: parent disk name}.
+
+    sysfs spells the "/" of names like cciss/c0d0p1 as "!".
+    """
+    parents = {}
+    for sys_name in os.listdir(sys_class_block):
+        path = os.path.join(sys_class_block, sys_name)
+        if not os.path.exists(os.path.join(path, 'partition')):
+            continue
+        parent = os.path.basename(os.path.dirname(os.path.realpath(path)))
+        parents[sys_name.replace('!', '/')] = parent.replace('!', '/')
+    return parents
+
+
+class DiskStats(object):
+    """Index of the last /proc/diskstats sample."""
+
+    def __init__(self):
+        self.rows = {}
+        self.devnums = {}
+        self.parents = {}
+        self.disks = frozenset()
+        self._layout = None
+
+    def refresh(self, lines):
+        rows = {}
+        for line in lines:
+            v = line.split()
+            devnum = (int(v[0]), int(v[1]))
+            row = [devnum[0], devnum[1], v[2]]
+            row.extend(int(x) for x in v[3:3 + NUM_STAT_FIELDS])
+            rows[devnum] = row
+        self.rows = rows
+
+        layout = frozenset(rows)
+        if layout != self._layout:
+            self._layout = layout
+            self.devnums = dict((row[2], devnum)
+                                for devnum, row in rows.items())
+            self.disks = frozenset(devnum for devnum, row in rows.items()
+                                   if DISK_NAME_RE.search(row[2]))
+            self.parents = read_partition_parents()
+            LOG.info(_("Block devices changed, %(count)d devices, "
+                       "%(parts)d partitions"),
+                     {'count': len(rows), 'parts': len(self.parents)})
+
+    def get(self, major, minor):
+        return self.rows.get((major, minor))
+
+    def get_by_name(self, name):
+        devnum = self.devnums.get(name)
+        return devnum and self.rows.get(devnum)
+
+    def get_disk_row(self, major, minor):
+        """Row of a collected device, or of its parent for a partition.
+
+        Returns None if the device is not one whose statistics are
+        collected.
+        """
+        devnum = (major, minor)
+        if devnum not in self.disks:
+            return None
+        row = self.rows[devnum]
+        parent = self.parents.get(row[2])
+        if parent is not None:
+            return self.get_by_name(parent) or row
+        return row
+
+
+_STATS = None
+
+
+def get_disk_stats():
+    """Get the shared DiskStats index."""
+    global _STATS
+    if _STATS is None:
+        _STATS = DiskStats()
+    return _STATS
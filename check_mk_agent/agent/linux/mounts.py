@@ -0,0 +1,168 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Mount table and filesystem capacity without running `df`.
+
+The table is parsed from /proc/self/mountinfo and kept until the kernel
+signals a change of the mount namespace: /proc/self/mounts then reports
+POLLPRI (and POLLERR) to poll().  Capacity is read with os.statvfs.
+"""
+
+import os
+import select
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+MOUNTS_PATH = '/proc/self/mounts'
+SYS_DEV_BLOCK = '/sys/dev/block/%d:%d'
+
+# Same list as the -x options the disk collector used to give to df.
+EXCLUDED_FSTYPES = frozenset(['smbfs', 'tmpfs', 'devtmpfs', 'cifs', 'iso9660',
+                              'udf', 'nfsv4', 'nfs', 'mvfs', 'zfs'])
+# df -l: network filesystems are never local, whatever their source.
+REMOTE_FSTYPES = frozenset(['nfs', 'nfs4', 'nfsv4', 'cifs', 'smbfs', 'smb3',
+                            'ncpfs', 'afs', 'coda', '9p', 'ceph', 'glusterfs',
+                            'fuse.glusterfs', 'fuse.sshfs', 'lustre'])
+# Pseudo filesystems df leaves out without calling statfs on them; statfs
+# on an autofs mount point would trigger the automount.
+DUMMY_FSTYPES = frozenset(['autofs', 'proc', 'subfs', 'debugfs', 'devpts',
+                           'fusectl', 'mqueue', 'rpc_pipefs', 'sysfs', 'devfs',
+                           'kernfs', 'ignore', 'binfmt_misc', 'tracefs',
+                           'securityfs', 'cgroup', 'cgroup2', 'pstore', 'bpf',
+                           'configfs', 'hugetlbfs', 'nsfs', 'efivarfs',
+                           'selinuxfs'])
+
+MB = 1024 * 1024
+
+
+def _unescape(field):
+    """Undo the octal escaping (e.g. \\040 for space) of mountinfo."""
+    if '\\' not in field:
+        return field
+    parts = field.split('\\')
+    chars = [parts[0]]
+    for part in parts[1:]:
+        if len(part) >= 3 and part[:3].isdigit():
+            chars.append(chr(int(part[:3], 8)) + part[3:])
+        else:
+            chars.append('\\' + part)
+    return ''.join(chars)
+
+
+def _device_name(major, minor, source):
+    """Kernel name of a block device, e.g. dm-0 for /dev/mapper/vg-root."""
+    if major:
+        try:
+            return os.path.basename(os.readlink(SYS_DEV_BLOCK % (major, minor)))
+        except OSError:
+            pass
+    if os.path.islink(source):
+        source = os.path.realpath(source)
+    return os.path.basename(source)
+
+
+def _is_remote(fstype, source):
+    return (fstype in REMOTE_FSTYPES or ':' in source or
+            source.startswith('//'))
+
+
+class Mount(object):
+
+    def __init__(self, major, minor, mountpoint, fstype, source):
+        self.major = major
+        self.minor = minor
+        self.mountpoint = mountpoint
+        self.fstype = fstype
+        self.source = source
+        self.name = _device_name(major, minor, source)
+
+    def __repr__(self):
+        return "<Mount %s %s on %s type %s>" % (self.name, self.source,
+                                                self.mountpoint, self.fstype)
+
+
+def parse_mountinfo(lines):
+    """Parse /proc/self/mountinfo lines into local, non-excluded Mounts.
+
+    A device mounted several times (bind mounts, btrfs subvolumes) is
+    listed once, at its first mount point, as df does.
+    """
+    mounts = []
+    seen = set()
+    for line in lines:
+        fields = line.split()
+        try:
+            sep = fields.index('-', 6)
+        except ValueError:
+            continue
+        fstype = fields[sep + 1]
+        source = _unescape(fields[sep + 2])
+        if (fstype in EXCLUDED_FSTYPES or fstype in DUMMY_FSTYPES or
+                _is_remote(fstype, source)):
+            continue
+        major, minor = [int(x) for x in fields[2].split(':')]
+        if (major, minor) in seen:
+            continue
+        seen.add((major, minor))
+        mounts.append(Mount(major, minor, _unescape(fields[4]), fstype,
+                            source))
+    return mounts
+
+
+class MountTable(object):
+    """Cached mount table, re-parsed only when the mounts change."""
+
+    def __init__(self):
+        self._mounts_file = open(MOUNTS_PATH)
+        self._poll = select.poll()
+        self._poll.register(self._mounts_file.fileno(),
+                            select.POLLPRI | select.POLLERR)
+        self.mounts = None
+
+    def changed(self):
+        if not self._poll.poll(0):
+            return False
+        # Reading the file acknowledges the event.
+        self._mounts_file.seek(0)
+        self._mounts_file.read()
+        return True
+
+    def get_mounts(self):
+        if self.mounts is None or self.changed():
+            self.mounts = parse_mountinfo(procfs.read_lines(MOUNTINFO_PATH))
+            LOG.debug(_("Mount table: %s"), self.mounts)
+        return self.mounts
+
+
+def get_capacity(mount):
+    """Capacity of a mounted filesystem, as df -Pm reports it.
+
+    Returns (size, used, available) in MB, rounded up, and the used
+    percentage as an int, or None for pseudo filesystems without blocks.
+    """
+    st = os.statvfs(mount.mountpoint)
+    if not st.f_blocks:
+        return None
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    avail = st.f_bavail * st.f_frsize
+    total = used + avail
+    percent = (used * 100 + total - 1) // total if total else 0
+    return ((st.f_blocks * st.f_frsize + MB - 1) // MB,
+            (used + MB - 1) // MB,
+            (avail + MB - 1) // MB,
+            percent)
+
+
+_TABLE = None
+
+
+def get_mounts():
+    """Get the local mounts through the shared MountTable."""
+    global _TABLE
+    if _TABLE is None:
+        _TABLE = MountTable()
+    return _TABLE.get_mounts()
@@ -0,0 +1,97 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Batched reader of network interface attributes in sysfs.
+
+carrier is read on every refresh through the cached procfs descriptors,
+which stay open while a link is down and carrier fails with EINVAL;
+operstate, speed and mtu rarely change, so they are only re-read every
+slow_interval seconds and their files are not kept open.  Descriptors of
+interfaces that went away are closed.
+"""
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.common import utils as cutils
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+SYS_CLASS_NET = '/sys/class/net/%s/'
+
+
+class InterfaceAttrs(object):
+    """carrier, operstate, speed and mtu of a set of interfaces."""
+
+    def __init__(self, slow_interval=30):
+        self.slow_interval = slow_interval
+        self.attrs = {}
+        self._slow_refreshed_at = None
+
+    def _read(self, name, attr, cached=False):
+        path = SYS_CLASS_NET % name + attr
+        try:
+            if cached:
+                return procfs.read_file(path).strip()
+            return procfs.read_once(path).strip()
+        except (IOError, OSError):
+            # e.g. carrier and speed give EINVAL while the link is down.
+            return None
+
+    def _read_int(self, name, attr, default, cached=False):
+        value = self._read(name, attr, cached)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def refresh(self, names, read_carrier=True):
+        """Refresh the attributes of names and return {name: attrs}.
+
+        read_carrier=False leaves carrier out, for callers that already
+        got it another way.
+        """
+        for name in set(self.attrs) - set(names):
+            del self.attrs[name]
+            procfs.release_prefix(SYS_CLASS_NET % name)
+
+        now = cutils.monotonic()
+        refresh_slow = (self._slow_refreshed_at is None or
+                        now - self._slow_refreshed_at >= self.slow_interval)
+        if refresh_slow:
+            self._slow_refreshed_at = now
+
+        for name in names:
+            attrs = self.attrs.get(name)
+            if attrs is None:
+                attrs = self.attrs[name] = {}
+                self._refresh_slow(name, attrs)
+            elif refresh_slow:
+                self._refresh_slow(name, attrs)
+            if read_carrier:
+                attrs['carrier'] = self._read_int(name, 'carrier', 0,
+                                                  cached=True)
+        return self.attrs
+
+    def _refresh_slow(self, name, attrs):
+        attrs['operstate'] = self._read(name, 'operstate') or 'unknown'
+        # speed is in Mbits/sec, -1 when unknown.
+        attrs['speed'] = self._read_int(name, 'speed', -1)
+        attrs['mtu'] = self._read_int(name, 'mtu', 0)
+
+
+_ATTRS = None
+
+
+def get_interface_attrs(slow_interval=30):
+    """Get the shared InterfaceAttrs reader.
+
+    Raises ValueError if it was created with another slow_interval.
+    """
+    global _ATTRS
+    if _ATTRS is None:
+        _ATTRS = InterfaceAttrs(slow_interval)
+    elif _ATTRS.slow_interval != slow_interval:
+        raise ValueError("the interface attributes are already read every "
+                         "%s sec, not %s" % (_ATTRS.slow_interval,
+                                             slow_interval))
+    return _ATTRS
@@ -0,0 +1,99 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Per NUMA node memory, numastat and hugepage counters from sysfs.
+
+All files are read through the cached procfs descriptors.  The hugepage
+sizes of a node are listed once, the files of a node that goes offline
+are closed.
+"""
+
+import os
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+NODE_ROOT = '/sys/devices/system/node'
+NODE_ONLINE_PATH = NODE_ROOT + '/online'
+NODE_PATH = NODE_ROOT + '/node%d/'
+HUGEPAGE_COUNTERS = ('nr_hugepages', 'free_hugepages', 'surplus_hugepages')
+
+
+def parse_range_list(content):
+    """Parse a sysfs list such as "0-1,4" into [0, 1, 4]."""
+    items = []
+    for part in content.strip().split(','):
+        if not part:
+            continue
+        first, _sep, last = part.partition('-')
+        items.extend(range(int(first), int(last or first) + 1))
+    return items
+
+
+def parse_node_meminfo(lines):
+    """Parse "Node 0 MemTotal:  4685560 kB" lines into {key: value}."""
+    meminfo = {}
+    for line in lines:
+        fields = line.split()
+        meminfo[fields[2][:-1]] = int(fields[3])
+    return meminfo
+
+
+def parse_numastat(lines):
+    return dict((key, int(value))
+                for key, value in (line.split() for line in lines))
+
+
+class NodeReader(object):
+    """Reader of the memory counters of the online NUMA nodes."""
+
+    def __init__(self):
+        self.nodes = []
+        self._hugepage_sizes = {}
+
+    def get_nodes(self):
+        """Return the online node numbers, closing the files of nodes that
+        went offline."""
+        try:
+            nodes = parse_range_list(procfs.read_file(NODE_ONLINE_PATH))
+        except (IOError, OSError):
+            # No NUMA support in the kernel.
+            nodes = []
+        for node in set(self.nodes) - set(nodes):
+            procfs.release_prefix(NODE_PATH % node)
+            self._hugepage_sizes.pop(node, None)
+        self.nodes = nodes
+        return nodes
+
+    def get_hugepage_sizes(self, node):
+        """Return the hugepage directories of a node, e.g.
+        ['hugepages-2048kB']."""
+        sizes = self._hugepage_sizes.get(node)
+        if sizes is None:
+            try:
+                sizes = sorted(os.listdir(NODE_PATH % node + 'hugepages'))
+            except OSError:
+                sizes = []
+            self._hugepage_sizes[node] = sizes
+        return sizes
+
+    def read_meminfo(self, node):
+        return parse_node_meminfo(
+            procfs.read_lines(NODE_PATH % node + 'meminfo'))
+
+    def read_numastat(self, node):
+        return parse_numastat(
+            procfs.read_lines(NODE_PATH % node + 'numastat'))
+
+    def read_hugepages(self, node):
+        """Return {size: {counter: pages}}, e.g. {'2048kB': {...}}."""
+        hugepages = {}
+        for size in self.get_hugepage_sizes(node):
+            path = NODE_PATH % node + 'hugepages/%s/' % size
+            counters = {}
+            for counter in HUGEPAGE_COUNTERS:
+                counters[counter] = int(procfs.read_file(path + counter))
+            hugepages[size.split('-', 1)[1]] = counters
+        return hugepages
@@ -0,0 +1,267 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""perf_event_open(2) counters of a process through ctypes.
+
+Like `perf stat -p`, every thread of the process gets its own group of
+counters; the groups are opened as threads appear and closed when they
+exit.  A group is read with one read(2) of its leader, using
+PERF_FORMAT_GROUP with TOTAL_TIME_ENABLED/RUNNING, and the deltas are
+scaled by enabled/running to account for counter multiplexing.
+
+Hardware events are used when the cpu exposes a PMU; otherwise, e.g. in
+most VMs, software events are counted instead.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import struct
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+
+PERF_COUNT_HW_CPU_CYCLES = 0
+PERF_COUNT_HW_INSTRUCTIONS = 1
+PERF_COUNT_HW_CACHE_REFERENCES = 2
+PERF_COUNT_HW_CACHE_MISSES = 3
+
+PERF_COUNT_SW_TASK_CLOCK = 1
+PERF_COUNT_SW_PAGE_FAULTS = 2
+PERF_COUNT_SW_CONTEXT_SWITCHES = 3
+PERF_COUNT_SW_CPU_MIGRATIONS = 4
+
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_GROUP = 1 << 3
+READ_FORMAT = (PERF_FORMAT_TOTAL_TIME_ENABLED |
+               PERF_FORMAT_TOTAL_TIME_RUNNING | PERF_FORMAT_GROUP)
+
+PERF_FLAG_FD_CLOEXEC = 1 << 3
+
+# (name, type, config) of the counted events, the first one leads the group.
+HARDWARE_EVENTS = (
+    ('cycles', PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES),
+    ('instructions', PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS),
+    ('cache_references', PERF_TYPE_HARDWARE, PERF_COUNT_HW_CACHE_REFERENCES),
+    ('cache_misses', PERF_TYPE_HARDWARE, PERF_COUNT_HW_CACHE_MISSES),
+)
+SOFTWARE_EVENTS = (
+    ('task_clock', PERF_TYPE_SOFTWARE, PERF_COUNT_SW_TASK_CLOCK),
+    ('context_switches', PERF_TYPE_SOFTWARE, PERF_COUNT_SW_CONTEXT_SWITCHES),
+    ('cpu_migrations', PERF_TYPE_SOFTWARE, PERF_COUNT_SW_CPU_MIGRATIONS),
+    ('page_faults', PERF_TYPE_SOFTWARE, PERF_COUNT_SW_PAGE_FAULTS),
+)
+EVENT_SETS = {'hardware': HARDWARE_EVENTS, 'software': SOFTWARE_EVENTS}
+
+# Errors of perf_event_open when the cpu has no such hardware event.
+NO_HARDWARE_ERRNOS = (errno.ENOENT, errno.EOPNOTSUPP, errno.ENODEV)
+# Not allowed to count the process: not root and perf_event_paranoid too
+# high, or another user's process.
+NO_PERMISSION_ERRNOS = (errno.EACCES, errno.EPERM)
+
+# __NR_perf_event_open of each architecture.
+SYSCALL_NUMBERS = {
+    'x86_64': 298,
+    'i386': 336,
+    'i686': 336,
+    'aarch64': 241,
+    'armv7l': 364,
+    'ppc64': 319,
+    'ppc64le': 319,
+    's390x': 331,
+}
+
+
+class PerfEventAttr(ctypes.Structure):
+    """struct perf_event_attr up to config1 (PERF_ATTR_SIZE_VER0)."""
+
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('size', ctypes.c_uint32),
+        ('config', ctypes.c_uint64),
+        ('sample_period', ctypes.c_uint64),
+        ('sample_type', ctypes.c_uint64),
+        ('read_format', ctypes.c_uint64),
+        ('flags', ctypes.c_uint64),
+        ('wakeup_events', ctypes.c_uint32),
+        ('bp_type', ctypes.c_uint32),
+        ('config1', ctypes.c_uint64),
+    ]
+
+
+_syscall = None
+
+
+def _get_syscall():
+    global _syscall
+    if _syscall is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        _syscall = libc.syscall
+        _syscall.restype = ctypes.c_long
+    return _syscall
+
+
+def perf_event_open(event_type, config, pid, cpu=-1, group_fd=-1):
+    """Open a counting event and return its fd; raises OSError."""
+    nr = SYSCALL_NUMBERS.get(platform.machine())
+    if nr is None:
+        raise OSError(errno.ENOSYS, "perf_event_open is not known on %s" %
+                      platform.machine())
+    attr = PerfEventAttr()
+    attr.type = event_type
+    attr.size = ctypes.sizeof(PerfEventAttr)
+    attr.config = config
+    attr.read_format = READ_FORMAT
+    fd = _get_syscall()(ctypes.c_long(nr), ctypes.byref(attr),
+                        ctypes.c_int(int(pid)), ctypes.c_int(cpu),
+                        ctypes.c_int(group_fd),
+                        ctypes.c_ulong(PERF_FLAG_FD_CLOEXEC))
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+class CounterGroup(object):
+    """A group of counters on one thread, read through its leader."""
+
+    def __init__(self, tid, events):
+        self.tid = tid
+        self.fds = []
+        self._format = struct.Struct('=%dQ' % (3 + len(events)))
+        self.last = None
+        try:
+            for _name, event_type, config in events:
+                leader = self.fds[0] if self.fds else -1
+                self.fds.append(perf_event_open(event_type, config, tid,
+                                                group_fd=leader))
+        except OSError:
+            self.close()
+            raise
+
+    def read(self):
+        """Return (time enabled, time running, [counts])."""
+        values = self._format.unpack(os.read(self.fds[0],
+                                             self._format.size))
+        # values[0] is the number of counters of the group.
+        return values[1], values[2], values[3:]
+
+    def delta(self):
+        """Read the group and return the counts since the previous read,
+        scaled for multiplexing, with the fraction of time the group was
+        on the PMU; None on the first read or if it never ran."""
+        enabled, running, counts = self.read()
+        last, self.last = self.last, (enabled, running, counts)
+        if last is None:
+            return None
+        enabled_delta = enabled - last[0]
+        running_delta = running - last[1]
+        if running_delta <= 0:
+            return None
+        scale = float(enabled_delta) / running_delta
+        return ([(count - last_count) * scale
+                 for count, last_count in zip(counts, last[2])],
+                float(running_delta) / enabled_delta)
+
+    def close(self):
+        for fd in reversed(self.fds):
+            os.close(fd)
+        self.fds = []
+
+
+class ProcessCounters(object):
+    """Counters summed over every thread of a process.
+
+    :param event_set: 'hardware', 'software' or 'auto', which falls back
+        to software events when the hardware ones can not be opened.
+    """
+
+    def __init__(self, pid, event_set='auto'):
+        self.pid = pid
+        self.event_set = event_set
+        self.events = EVENT_SETS.get(event_set, HARDWARE_EVENTS)
+        self.task_dir = '/proc/%s/task' % pid
+        self.groups = {}
+        self.denied = False
+        self._sampled = False
+
+    @property
+    def names(self):
+        return [name for name, _type, _config in self.events]
+
+    def _open(self, tid):
+        try:
+            try:
+                self.groups[tid] = CounterGroup(tid, self.events)
+            except OSError as e:
+                if (self.event_set != 'auto' or
+                        self.events is not HARDWARE_EVENTS or
+                        e.errno not in NO_HARDWARE_ERRNOS):
+                    raise
+                LOG.warning(_("Hardware perf events are not available "
+                              "(%s), counting software events"), e)
+                self.close()
+                self.events = SOFTWARE_EVENTS
+                self.groups[tid] = CounterGroup(tid, self.events)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                # The thread exited meanwhile.
+                return
+            if e.errno in NO_PERMISSION_ERRNOS:
+                # The thread is left out; logged once, not for every
+                # thread and sample.
+                if not self.denied:
+                    LOG.warning(_("Not allowed to count perf events of "
+                                  "%(pid)s: %(err)s"),
+                                {'pid': self.pid, 'err': e})
+                self.denied = True
+                return
+            raise
+
+    def sample(self):
+        """Return ({event name: count}, running fraction) since the
+        previous sample.
+
+        Counts are None for the first sample.  The running fraction is the
+        lowest share of time a group was counting, below 1.0 when counters
+        were multiplexed.
+        """
+        try:
+            tids = set(os.listdir(self.task_dir))
+        except OSError:
+            tids = set()
+        for tid in set(self.groups) - tids:
+            self.groups.pop(tid).close()
+        for tid in sorted(tids - set(self.groups)):
+            self._open(tid)
+
+        totals = [0.0] * len(self.events)
+        running = 1.0
+        for tid, group in list(self.groups.items()):
+            try:
+                delta = group.delta()
+            except OSError:
+                self.groups.pop(tid).close()
+                continue
+            if delta is None:
+                continue
+            counts, group_running = delta
+            totals = [total + count for total, count in zip(totals, counts)]
+            running = min(running, group_running)
+        sampled, self._sampled = self._sampled, True
+        if not sampled:
+            return None, running
+        return dict(zip(self.names, totals)), running
+
+    def close(self):
+        for group in self.groups.values():
+            group.close()
+        self.groups = {}
@@ -0,0 +1,189 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Top symbols of a perf record file from its `perf script` output.
+
+The samples are streamed from `perf script -F comm,tid,period,event,sym,dso`,
+or from a file holding such output, one line per sample:
+
+    ovs-vswitchd  1234     250000 cycles:  dp_netdev_input__ (/usr/sbin/ovs-vswitchd)
+
+and weighted by their period.  Memory stays bounded whatever the length
+of the record: the top symbols of every event and of every thread, and
+the threads themselves, are tracked with the Space-Saving algorithm
+(Metwally et al.), which keeps a fixed number of counters and reports the
+heavy hitters with an upper bound of the error of each count.
+"""
+
+import re
+
+from eventlet.green import subprocess
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+PERF_SCRIPT_FIELDS = 'comm,tid,period,event,sym,dso'
+
+# comm may contain blanks (e.g. "CPU 0/KVM"), the tid is the first number
+# standing alone after it.  Samples without a resolved symbol show
+# "[unknown]".
+SAMPLE_RE = re.compile(r'^\s*(?P<comm>\S.*?)\s+(?P<tid>\d+)\s+'
+                       r'(?P<period>\d+)\s+(?P<event>\S+?):?\s+'
+                       r'(?P<sym>.*?)\s+\((?P<dso>[^()]*)\)\s*$')
+
+
+def parse_sample(line):
+    """Parse a perf script line into (comm, tid, period, event, symbol);
+    None for lines that are not samples."""
+    match = SAMPLE_RE.match(line)
+    if match is None:
+        return None
+    sym = match.group('sym') or '[unknown]'
+    if sym == '[unknown]':
+        # Keep the dso at least, e.g. [unknown] (/usr/lib64/libc.so.6).
+        sym = '[unknown] %s' % match.group('dso')
+    # Events are printed with their modifiers, e.g. cycles:ppp.
+    event = match.group('event').split(':')[0]
+    return (match.group('comm'), int(match.group('tid')),
+            int(match.group('period')), event, sym)
+
+
+class SpaceSaving(object):
+    """Approximate heavy hitters of a weighted stream in capacity
+    counters."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+
+    def add(self, key, weight=1):
+        """Count weight for key, return the key that was evicted to make
+        room for it, if any."""
+        self.total += weight
+        if key in self.counts:
+            self.counts[key] += weight
+            return None
+        evicted = None
+        error = 0
+        if len(self.counts) >= self.capacity:
+            # The new key takes over the smallest counter, whose count
+            # bounds how much of the new key was missed.
+            evicted = min(self.counts, key=self.counts.get)
+            error = self.counts.pop(evicted)
+            del self.errors[evicted]
+        self.counts[key] = error + weight
+        self.errors[key] = error
+        return evicted
+
+    def top(self, size=None):
+        """Return [(key, count, error)] by decreasing count."""
+        keys = sorted(self.counts, key=self.counts.get, reverse=True)
+        return [(key, self.counts[key], self.errors[key])
+                for key in keys[:size]]
+
+
+class PerfTop(object):
+    """Top symbols per event and per thread of perf samples.
+
+    :param top_size: symbols tracked for every event and thread.
+    :param max_threads: threads tracked; the symbols of a thread that is
+        evicted are dropped.
+    """
+
+    def __init__(self, top_size=20, max_threads=32):
+        self.top_size = top_size
+        self.max_threads = max_threads
+        self.events = {}
+        self.threads = SpaceSaving(max_threads)
+        self.thread_symbols = {}
+        self.samples = 0
+
+    def add(self, comm, tid, period, event, sym):
+        self.samples += 1
+        event_top = self.events.get(event)
+        if event_top is None:
+            event_top = self.events[event] = SpaceSaving(self.top_size)
+        event_top.add(sym, period)
+
+        thread = '%s-%d' % (comm, tid)
+        evicted = self.threads.add(thread, period)
+        if evicted is not None:
+            self.thread_symbols.pop(evicted, None)
+        symbols = self.thread_symbols.get(thread)
+        if symbols is None:
+            symbols = self.thread_symbols[thread] = SpaceSaving(
+                self.top_size)
+        symbols.add((event, sym), period)
+
+    def feed(self, lines):
+        """Add the samples of perf script output lines."""
+        for line in lines:
+            sample = parse_sample(line)
+            if sample is not None:
+                self.add(*sample)
+        return self
+
+    @staticmethod
+    def _entries(top, total, describe):
+        entries = []
+        for key, count, error in top:
+            entry = describe(key)
+            entry['period'] = count
+            entry['percent'] = round(100.0 * count / total, 2) if total else 0
+            if error:
+                entry['error'] = error
+            entries.append(entry)
+        return entries
+
+    def get_summary(self):
+        """Return {'samples', 'events': {event: [symbol entries]},
+        'threads': {thread: {'period', 'symbols': [...]}}}.
+
+        Percentages are of the total period of the event or thread; error
+        is the upper bound of the overcount of an entry, only set when its
+        counter was taken over from an evicted key.
+        """
+        events = {}
+        for event, top in self.events.items():
+            events[event] = self._entries(top.top(), top.total,
+                                          lambda sym: {'symbol': sym})
+        threads = {}
+        for thread, period, _error in self.threads.top():
+            symbols = self.thread_symbols.get(thread)
+            if symbols is None:
+                continue
+            threads[thread] = {
+                'period': period,
+                'symbols': self._entries(
+                    symbols.top(), symbols.total,
+                    lambda key: {'event': key[0], 'symbol': key[1]}),
+            }
+        return {'samples': self.samples, 'events': events,
+                'threads': threads}
+
+
+def summarize_record(record_file, top_size=20, max_threads=32):
+    """Stream `sudo perf script` of record_file into a PerfTop summary."""
+    cmd = ['sudo', 'perf', 'script', '-i', record_file,
+           '-F', PERF_SCRIPT_FIELDS]
+    LOG.info(_("Running %s"), ' '.join(cmd))
+    # perf warnings go to our stderr, a pipe that nobody reads while the
+    # samples are streamed could fill up and stall perf.
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True,
+                               universal_newlines=True)
+    perf_top = PerfTop(top_size, max_threads)
+    perf_top.feed(iter(process.stdout.readline, ''))
+    rc = process.wait()
+    if rc:
+        LOG.error(_("perf script of %(file)s exited with %(rc)d"),
+                  {'file': record_file, 'rc': rc})
+    return perf_top.get_summary()
+
+
+def summarize_script_output(script_file, top_size=20, max_threads=32):
+    """Summarize a file holding saved perf script output."""
+    with open(script_file) as lines:
+        return PerfTop(top_size, max_threads).feed(lines).get_summary()
@@ -0,0 +1,139 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Interval samples of a `perf stat -I <ms> -x,` child process.
+
+In interval mode perf prints, every <ms> milliseconds, one CSV line per
+event to stderr:
+
+    1.000305237,2061424,,cycles,1000223041,100.00,,
+
+i.e. the seconds since perf started, the count of the interval (already
+scaled for multiplexing), the unit, the event, the time counted in
+nanoseconds and the percentage of it the event was on the PMU.  Events
+that could not be counted have "<not counted>" or "<not supported>" as
+count.
+
+The output is read line by line from the pipe in a green thread and cut
+into intervals, each stamped with the wall clock time it ended at so it
+can be merged with the samples of the agent loop.
+"""
+
+import collections
+import time
+
+from eventlet.green import subprocess
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+# Intervals kept while nobody pops them, e.g. when the loop is stalled.
+MAX_PENDING_INTERVALS = 600
+
+
+def parse_interval_line(line):
+    """Parse a CSV line into (relative time, event, count, running %).
+
+    count and running are None when the event was not counted; None is
+    returned for lines that are not interval counts, such as comments.
+    """
+    fields = line.strip().split(',')
+    if len(fields) < 4 or line.startswith('#'):
+        return None
+    try:
+        relative_time = float(fields[0])
+    except ValueError:
+        return None
+    try:
+        count = float(fields[1])
+    except ValueError:
+        # <not counted> or <not supported>
+        count = None
+    try:
+        running = float(fields[5])
+    except (IndexError, ValueError):
+        running = None
+    return relative_time, fields[3], count, running
+
+
+class PerfStatStream(object):
+    """A perf stat child in interval mode and the intervals it printed.
+
+    :param events: the perf event names, e.g. ['cycles', 'instructions'].
+    :param interval: milliseconds between two intervals.
+    """
+
+    def __init__(self, pid, events, interval=1000):
+        self.pid = pid
+        self.events = list(events)
+        self.interval = interval
+        self.process = None
+        self.started_at = None
+        self.intervals = collections.deque(maxlen=MAX_PENDING_INTERVALS)
+        self._current = None
+
+    def get_cmd(self):
+        return ['sudo', 'perf', 'stat', '-I', str(self.interval), '-x,',
+                '-e', ','.join(self.events), '-p', str(self.pid)]
+
+    def start(self):
+        cmd = self.get_cmd()
+        LOG.info(_("Running %s"), ' '.join(cmd))
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        close_fds=True,
+                                        universal_newlines=True)
+        # perf counts its interval times from its start.
+        self.started_at = time.time()
+
+    def run(self):
+        """Start perf and read its output until it exits; meant to be
+        run in a green thread."""
+        self.start()
+        for line in iter(self.process.stderr.readline, ''):
+            self.feed(line)
+        self._flush()
+        rc = self.process.wait()
+        if rc:
+            LOG.error(_("perf stat exited with %d"), rc)
+
+    def feed(self, line):
+        """Add a line of perf output, ending the current interval when the
+        line belongs to the next one or completes it."""
+        parsed = parse_interval_line(line)
+        if parsed is None:
+            return
+        relative_time, event, count, running = parsed
+        if self._current and self._current[0] != relative_time:
+            self._flush()
+        if self._current is None:
+            self._current = (relative_time, {'running': None})
+        counts = self._current[1]
+        counts[event] = count
+        if running is not None:
+            counts['running'] = (running if counts['running'] is None
+                                 else min(counts['running'], running))
+        if len(counts) > len(self.events):
+            self._flush()
+
+    def _flush(self):
+        if self._current is None:
+            return
+        relative_time, counts = self._current
+        self._current = None
+        self.intervals.append((self.started_at + relative_time, counts))
+
+    def pop_intervals(self, until=None):
+        """Return {timestamp: counts} of the intervals that ended until the
+        wall clock time until, or all of them, and forget them."""
+        intervals = {}
+        while self.intervals and (until is None or
+                                  self.intervals[0][0] <= until):
+            timestamp, counts = self.intervals.popleft()
+            intervals['%.3f' % timestamp] = counts
+        return intervals
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
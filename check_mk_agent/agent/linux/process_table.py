@@ -0,0 +1,114 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Process table built from a single scan of /proc.
+
+It replaces running `pgrep` for every group of processes the agent
+monitors.  Only /proc/<pid>/stat is read, for its comm and start time: a
+pid keeps the group it was sorted into until it goes away or is reused by
+a process with another start time.
+"""
+
+import os
+import re
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+PROC_DIR = '/proc'
+# Index of starttime in the /proc/<pid>/stat fields that follow "(comm)".
+STAT_STARTTIME = 19
+
+# Group name and the regex searched in comm, as `pgrep <regex>` would do.
+DEFAULT_GROUPS = [
+    ('qemu', 'qemu-system'),
+    ('vhost', 'vhost'),
+    ('ksoftirqd', 'ksoftirqd'),
+]
+
+
+class ProcessTable(object):
+    """Sort the pids of /proc into named groups."""
+
+    def __init__(self, groups=None, proc_dir=PROC_DIR):
+        self.proc_dir = proc_dir
+        self.groups = []
+        self._comms = {}
+        self._starttimes = {}
+        self._members = {}
+        for name, pattern in DEFAULT_GROUPS + list(groups or []):
+            self.add_group(name, pattern)
+
+    def add_group(self, name, pattern):
+        """Add or replace a group; existing pids are sorted into it."""
+        regex = re.compile(pattern)
+        self.groups = [(n, r) for n, r in self.groups if n != name]
+        self.groups.append((name, regex))
+        self._members[name] = set(pid for pid, comm in self._comms.items()
+                                  if regex.search(comm))
+
+    def _read_stat(self, pid):
+        """Return (comm, starttime) of pid, None if it has exited."""
+        try:
+            with open(os.path.join(self.proc_dir, pid, 'stat')) as f:
+                content = f.read()
+        except (IOError, OSError):
+            # The process exited between listdir() and open().
+            return None
+        # comm may contain spaces and parentheses.
+        end = content.rindex(')')
+        comm = content[content.index('(') + 1:end]
+        return comm, content[end + 2:].split()[STAT_STARTTIME]
+
+    def refresh(self):
+        """Scan /proc once.
+
+        Returns two dicts (added, removed) mapping every group name to the
+        set of pids that joined or left the group since the last refresh.
+        """
+        stats = {}
+        for pid in os.listdir(self.proc_dir):
+            if pid.isdigit():
+                stat = self._read_stat(pid)
+                if stat is not None:
+                    stats[pid] = stat
+
+        # A reused pid leaves the groups of its predecessor.
+        gone = set(pid for pid, starttime in self._starttimes.items()
+                   if stats.get(pid, (None, None))[1] != starttime)
+        for pid in gone:
+            del self._comms[pid]
+            del self._starttimes[pid]
+
+        new = {}
+        for pid, (comm, starttime) in stats.items():
+            if pid not in self._comms:
+                new[pid] = comm
+                self._starttimes[pid] = starttime
+        self._comms.update(new)
+
+        added = {}
+        removed = {}
+        for name, regex in self.groups:
+            members = self._members[name]
+            removed[name] = members & gone
+            added[name] = set(pid for pid, comm in new.items()
+                              if regex.search(comm))
+            # A new set is swapped in, never changed in place: collectors
+            # running in other threads may be iterating the old one.
+            self._members[name] = (members - removed[name]) | added[name]
+            if added[name] or removed[name]:
+                LOG.info(_("Process group %(name)s added %(added)s, "
+                           "removed %(removed)s"),
+                         {'name': name, 'added': sorted(added[name]),
+                          'removed': sorted(removed[name])})
+        return added, removed
+
+    def get_pids(self, name):
+        """Return the pids of a group as a sorted list of strings; safe to
+        call from other threads while refresh() runs."""
+        return sorted(self._members.get(name, ()), key=int)
+
+    def get_group_names(self):
+        return [name for name, _regex in self.groups]
@@ -0,0 +1,248 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""In-process readers for procfs and sysfs files.
+
+Collectors sample the same handful of pseudo files every tick.  Instead of
+spawning `cat` for each of them, a ProcFile keeps the file descriptor open
+and re-reads it with seek(0)/readinto() into a buffer that is reused from
+one tick to the next.  The shared reader may be used by collectors
+running in threads: its cache is guarded by a lock that is not held while
+a file is read, so a read that blocks (e.g. sysfs of a hung device) holds
+up only the readers of that same file.
+"""
+
+import collections
+import errno
+import io
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import six
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 4096
+# Initial bound of descriptors kept open by a reader; the least recently
+# read one is closed first when more files are read.  The bound grows when
+# files that were closed are read again, i.e. when the files read every
+# tick do not fit, up to half of RLIMIT_NOFILE.
+MAX_OPEN_FILES = 512
+# Errors of a read that leave the file itself valid, e.g. carrier of a link
+# that is down; its descriptor is kept.
+TRANSIENT_ERRNOS = (errno.EINVAL,)
+
+if six.PY3:
+    def _to_str(data):
+        return data.decode('latin-1')
+else:
+    _to_str = bytes
+
+
+class ProcFile(object):
+    """A pseudo file that is kept open and re-read on demand."""
+
+    def __init__(self, path, bufsize=DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self._fd = io.open(path, 'rb', buffering=0)
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        # The buffer is reused, so the file is read by one thread at a
+        # time.  A close() while it is read is left to the reader.
+        self._read_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._reading = False
+        self._close_pending = False
+        self._closed = False
+
+    def read(self):
+        """Return the current content of the file."""
+        with self._read_lock:
+            with self._state_lock:
+                if self._closed:
+                    raise IOError(errno.EBADF, "%s was closed" % self.path)
+                self._reading = True
+            try:
+                return self._read()
+            finally:
+                with self._state_lock:
+                    self._reading = False
+                    if self._close_pending:
+                        self._close()
+
+    def _read(self):
+        self._fd.seek(0)
+        size = 0
+        while True:
+            if size == len(self._buf):
+                # Pseudo files report a zero st_size, so the
+                # buffer is grown on demand and kept for the next tick.
+                self._view = None
+                self._buf.extend(bytearray(len(self._buf)))
+                self._view = memoryview(self._buf)
+            count = self._fd.readinto(self._view[size:])
+            if not count:
+                break
+            size += count
+        return _to_str(self._buf[:size])
+
+    def close(self):
+        with self._state_lock:
+            if self._reading:
+                self._close_pending = True
+            elif not self._closed:
+                self._close()
+
+    def _close(self):
+        self._closed = True
+        self._view = None
+        self._fd.close()
+
+
+def get_open_files_limit(default):
+    """Half of the soft RLIMIT_NOFILE, at least default."""
+    if resource is None:
+        return default
+    soft, _hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return max(default, 65536)
+    return max(default, soft // 2)
+
+
+class ProcReader(object):
+    """LRU cache of open ProcFile objects keyed by path."""
+
+    def __init__(self, max_files=MAX_OPEN_FILES, files_limit=None):
+        self.max_files = max_files
+        self.files_limit = (files_limit if files_limit is not None
+                            else get_open_files_limit(max_files))
+        self._files = collections.OrderedDict()
+        # Paths closed to make room, to notice when the cache is too
+        # small for the files read every tick.
+        self._evicted = set()
+        # Guards the cache; files are read outside of it.
+        self._lock = threading.RLock()
+
+    def read(self, path):
+        """Read path, opening it on first use.
+
+        A cached descriptor whose target has gone away (e.g. an exited pid)
+        is closed and the file is opened once more, so a reused pid is never
+        read through the descriptor of its predecessor.  A read that fails
+        with EINVAL (e.g. carrier of a link that is down) keeps the
+        descriptor.
+        """
+        for retry in (False, True):
+            proc_file, opened = self._get(path)
+            try:
+                return proc_file.read()
+            except (IOError, OSError) as e:
+                if e.errno in TRANSIENT_ERRNOS:
+                    raise
+                self._discard(path, proc_file)
+                if opened or retry:
+                    raise
+
+    def _get(self, path):
+        """Return the ProcFile of path, opened and cached if it was not,
+        and whether it was just opened."""
+        with self._lock:
+            proc_file = self._files.pop(path, None)
+            if proc_file is not None:
+                # Most recently read last.
+                self._files[path] = proc_file
+                return proc_file, False
+            if path in self._evicted:
+                self._grow()
+            proc_file = ProcFile(path)
+            self._add(path, proc_file)
+            return proc_file, True
+
+    def _discard(self, path, proc_file):
+        """Close proc_file and drop it from the cache unless another
+        thread has replaced it already."""
+        with self._lock:
+            if self._files.get(path) is proc_file:
+                del self._files[path]
+        proc_file.close()
+
+    def _add(self, path, proc_file):
+        while len(self._files) >= self.max_files:
+            evicted = next(iter(self._files))
+            self.release(evicted)
+            if len(self._evicted) >= self.max_files:
+                self._evicted.clear()
+            self._evicted.add(evicted)
+        self._evicted.discard(path)
+        self._files[path] = proc_file
+
+    def _grow(self):
+        """Double the bound, the working set does not fit in it."""
+        if self.max_files >= self.files_limit:
+            return
+        self.max_files = min(self.max_files * 2, self.files_limit)
+        self._evicted.clear()
+        LOG.info(_("Keeping up to %d procfs files open"), self.max_files)
+
+    def read_lines(self, path):
+        return [line for line in self.read(path).split('\n') if line]
+
+    def release(self, path):
+        """Close the cached descriptor of path if there is one."""
+        with self._lock:
+            proc_file = self._files.pop(path, None)
+        if proc_file is not None:
+            try:
+                proc_file.close()
+            except (IOError, OSError) as e:
+                if e.errno != errno.EBADF:
+                    LOG.debug(_("Failed to close %(path)s: %(err)s"),
+                              {'path': path, 'err': e})
+
+    def release_prefix(self, prefix):
+        """Close every cached descriptor below prefix."""
+        with self._lock:
+            for path in list(self._files):
+                if path.startswith(prefix):
+                    self.release(path)
+
+    def close(self):
+        with self._lock:
+            for path in list(self._files):
+                self.release(path)
+
+    def __len__(self):
+        return len(self._files)
+
+
+_READER = ProcReader()
+
+
+def read_file(path):
+    """Read a procfs/sysfs file through the shared reader."""
+    return _READER.read(path)
+
+
+def read_lines(path):
+    """Read the non-empty lines of a procfs/sysfs file."""
+    return _READER.read_lines(path)
+
+
+def read_once(path):
+    """Read a file that is not worth keeping open."""
+    with io.open(path, 'rb') as f:
+        return _to_str(f.read())
+
+
+def release(path):
+    _READER.release(path)
+
+
+def release_prefix(prefix):
+    _READER.release_prefix(prefix)
@@ -0,0 +1,135 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Pressure stall information of the host and of cgroups.
+
+/proc/pressure/<resource> and the <resource>.pressure files of cgroup v2
+hold a "some" line (at least one task stalled) and a "full" line (all
+non-idle tasks stalled):
+
+    some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+
+avgN are the percentages of time stalled over the last N seconds and
+total the stall time in microseconds since boot, or since the cgroup was
+created.
+"""
+
+import os
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+PRESSURE_PATH = '/proc/pressure/%s'
+RESOURCES = ('cpu', 'memory', 'io')
+
+# Where the cgroup v2 hierarchy is mounted, alone or next to v1 ones.
+CGROUP2_MOUNTS = ('/sys/fs/cgroup', '/sys/fs/cgroup/unified')
+CGROUP_PRESSURE_PATH = '%s%s/%s.pressure'
+
+
+def parse_pressure(lines):
+    """Return {'some': (avg10, avg60, total), 'full': ...}."""
+    pressure = {}
+    for line in lines:
+        fields = line.split()
+        values = dict(field.split('=', 1) for field in fields[1:])
+        pressure[fields[0]] = (float(values['avg10']),
+                               float(values['avg60']),
+                               int(values['total']))
+    return pressure
+
+
+def get_cgroup2_mount():
+    """The mount point of cgroup v2, or None."""
+    for mount in CGROUP2_MOUNTS:
+        if os.path.exists(os.path.join(mount, 'cgroup.controllers')):
+            return mount
+    return None
+
+
+def get_process_cgroup(pid):
+    """The cgroup v2 path of pid, e.g. /machine.slice/..., or None.
+
+    For a process in a systemd scope, such as a libvirt qemu in
+    machine-qemu-1-instance.scope/libvirt/emulator, the scope is
+    returned, as its pressure covers all threads of the guest.  None is
+    returned for the root cgroup, whose pressure is the host's.
+    """
+    try:
+        content = procfs.read_once('/proc/%s/cgroup' % pid)
+    except (IOError, OSError):
+        return None
+    for line in content.splitlines():
+        if not line.startswith('0::'):
+            continue
+        cgroup = line[3:]
+        parts = cgroup.split('/')
+        for index, part in enumerate(parts):
+            if part.endswith('.scope'):
+                return '/'.join(parts[:index + 1])
+        return cgroup if cgroup != '/' else None
+    return None
+
+
+class PressureReader(object):
+    """Pressure of the host and of cgroups with the stall time since the
+    previous read."""
+
+    def __init__(self):
+        self.cgroup_mount = get_cgroup2_mount()
+        self._totals = {}
+        self._read_paths = set()
+
+    def read(self, path):
+        """Read a pressure file.
+
+        Returns {'some_avg10', 'some_avg60', 'some_stall', 'full_...'} with
+        stall the microseconds stalled since the previous read of path, 0
+        the first time; None if the file can not be read.
+        """
+        try:
+            pressure = parse_pressure(procfs.read_lines(path))
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        self._read_paths.add(path)
+        info = {}
+        for kind, (avg10, avg60, total) in pressure.items():
+            key = (path, kind)
+            last = self._totals.get(key, total)
+            self._totals[key] = total
+            info[kind + '_avg10'] = avg10
+            info[kind + '_avg60'] = avg60
+            info[kind + '_stall'] = max(total - last, 0)
+        return info
+
+    def read_host(self):
+        """Return {resource: pressure info} of the host."""
+        host = {}
+        for resource in RESOURCES:
+            info = self.read(PRESSURE_PATH % resource)
+            if info is not None:
+                host[resource] = info
+        return host
+
+    def read_cgroup(self, cgroup):
+        """Return {resource: pressure info} of a cgroup v2 path."""
+        infos = {}
+        if self.cgroup_mount is None:
+            return infos
+        for resource in RESOURCES:
+            info = self.read(CGROUP_PRESSURE_PATH % (self.cgroup_mount,
+                                                     cgroup, resource))
+            if info is not None:
+                infos[resource] = info
+        return infos
+
+    def sweep(self):
+        """Forget the files that were not read since the previous sweep,
+        e.g. of cgroups that went away."""
+        for key in list(self._totals):
+            if key[0] not in self._read_paths:
+                del self._totals[key]
+                procfs.release(key[0])
+        self._read_paths = set()
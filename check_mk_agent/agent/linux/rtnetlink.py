@@ -0,0 +1,294 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Interface statistics from rtnetlink dumps.
+
+Every sample is a single RTM_GETSTATS dump filtered to IFLA_STATS_LINK_64,
+which returns one small message per link holding only its ifindex and
+64-bit counters.  Names, carrier, operstate and mtu come from a full
+RTM_GETLINK dump that is only repeated when the kernel announces a link
+change on the RTMGRP_LINK multicast group.  Kernels without RTM_GETSTATS
+(before 4.7) get the RTM_GETLINK dump on every sample.  Only socket and
+struct are used.
+"""
+
+import errno
+import os
+import socket
+import struct
+
+import six
+
+from check_mk_agent.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWSTATS = 92
+RTM_GETSTATS = 94
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_OPERSTATE = 16
+IFLA_STATS64 = 23
+IFLA_CARRIER = 33
+
+IFF_UP = 0x1
+
+IFLA_STATS_LINK_64 = 1
+IFLA_STATS_FILTER_LINK_64 = 1 << (IFLA_STATS_LINK_64 - 1)
+
+# The attributes of a link message that are parsed.  The kernel puts the
+# large ones (VF info, AF_SPEC, ...) after IFLA_STATS64, so parsing stops
+# as soon as all of these were seen.
+WANTED_ATTRS = frozenset([IFLA_IFNAME, IFLA_MTU, IFLA_OPERSTATE,
+                          IFLA_STATS64, IFLA_CARRIER])
+
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+IF_STATS_MSG = struct.Struct('=BBHiI')
+RTATTR = struct.Struct('=HH')
+NLMSGERR = struct.Struct('=i')
+U8 = struct.Struct('=B')
+U32 = struct.Struct('=I')
+# The 23 counters of struct rtnl_link_stats64 every kernel provides.
+STATS64 = struct.Struct('=23Q')
+
+OPERSTATES = ('unknown', 'notpresent', 'down', 'lowerlayerdown', 'testing',
+              'dormant', 'up')
+
+RECV_BUFFER_SIZE = 65536
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def stats64_to_net_dev(s):
+    """Fold rtnl_link_stats64 into the 16 columns of /proc/net/dev.
+
+    The kernel sums the detailed error counters the same way when it
+    prints /proc/net/dev.
+    """
+    return [
+        # receive: bytes packets errs drop fifo frame compressed multicast
+        s[2], s[0], s[4], s[6] + s[15], s[14],
+        s[10] + s[11] + s[12] + s[13], s[21], s[8],
+        # transmit: bytes packets errs drop fifo colls carrier compressed
+        s[3], s[1], s[5], s[7], s[18], s[9],
+        s[17] + s[16] + s[20] + s[19], s[22],
+    ]
+
+
+def parse_link(buf, offset, msg_len):
+    """Parse an RTM_NEWLINK message into (ifindex, name, link).
+
+    carrier is None when the kernel does not send IFLA_CARRIER, and 0 for
+    links that are administratively down: the kernel reports the carrier
+    of the device even then, while sysfs gives no carrier.
+    """
+    end = offset + msg_len
+    _family, _type, ifindex, flags, _change = IFINFOMSG.unpack_from(
+        buf, offset + NLMSGHDR.size)
+    offset += NLMSGHDR.size + IFINFOMSG.size
+    name = None
+    link = {'stats': None, 'carrier': None, 'operstate': 'unknown',
+            'mtu': 0}
+    wanted = WANTED_ATTRS
+    unpack_rtattr = RTATTR.unpack_from
+    while wanted and offset + RTATTR.size <= end:
+        rta_len, rta_type = unpack_rtattr(buf, offset)
+        if rta_len < RTATTR.size:
+            break
+        if rta_type in wanted:
+            wanted = wanted - set([rta_type])
+            data = offset + RTATTR.size
+            if rta_type == IFLA_IFNAME:
+                name = bytes(buf[data:offset + rta_len]).rstrip(b'\0')
+                if six.PY3:
+                    name = name.decode('ascii')
+            elif rta_type == IFLA_STATS64:
+                link['stats'] = stats64_to_net_dev(
+                    STATS64.unpack_from(buf, data))
+            elif rta_type == IFLA_CARRIER:
+                link['carrier'] = (U8.unpack_from(buf, data)[0]
+                                   if flags & IFF_UP else 0)
+            elif rta_type == IFLA_OPERSTATE:
+                state = U8.unpack_from(buf, data)[0]
+                if state < len(OPERSTATES):
+                    link['operstate'] = OPERSTATES[state]
+            elif rta_type == IFLA_MTU:
+                link['mtu'] = U32.unpack_from(buf, data)[0]
+        offset += _align(rta_len)
+    return ifindex, name, link
+
+
+def parse_stats(buf, offset):
+    """Parse an RTM_NEWSTATS message into (ifindex, /proc/net/dev stats).
+
+    The dump is filtered to IFLA_STATS_LINK_64, so that is the only
+    attribute.
+    """
+    ifindex = IF_STATS_MSG.unpack_from(buf, offset + NLMSGHDR.size)[3]
+    offset += NLMSGHDR.size + IF_STATS_MSG.size
+    _rta_len, rta_type = RTATTR.unpack_from(buf, offset)
+    if rta_type != IFLA_STATS_LINK_64:
+        return ifindex, None
+    return ifindex, stats64_to_net_dev(
+        STATS64.unpack_from(buf, offset + RTATTR.size))
+
+
+class LinkDumper(object):
+    """Dump the statistics of all links of the current network namespace."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        # Link notifications tell when the RTM_GETLINK dump is stale.
+        self.events = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                    NETLINK_ROUTE)
+        self.events.bind((0, RTMGRP_LINK))
+        self.events.setblocking(False)
+        self.seq = 0
+        self.use_getstats = True
+        self.links = None
+        self._buf = bytearray(RECV_BUFFER_SIZE)
+        self._link_request = bytearray(NLMSGHDR.size + IFINFOMSG.size)
+        IFINFOMSG.pack_into(self._link_request, NLMSGHDR.size,
+                            socket.AF_UNSPEC, 0, 0, 0, 0)
+        self._stats_request = bytearray(NLMSGHDR.size + IF_STATS_MSG.size)
+        IF_STATS_MSG.pack_into(self._stats_request, NLMSGHDR.size,
+                               socket.AF_UNSPEC, 0, 0, 0,
+                               IFLA_STATS_FILTER_LINK_64)
+
+    def close(self):
+        self.sock.close()
+        self.events.close()
+
+    def links_changed(self):
+        """Drain pending link notifications, True if there were any."""
+        changed = False
+        while True:
+            try:
+                self.events.recv_into(self._buf)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return changed
+                # ENOBUFS: notifications were lost, resync anyway.
+                if e.errno != errno.ENOBUFS:
+                    raise
+            changed = True
+
+    def _dump(self, request, request_type, reply_type, handle):
+        """Send a dump request and call handle(buf, offset, msg_len) on
+        every reply of reply_type."""
+        self.seq += 1
+        NLMSGHDR.pack_into(request, 0, len(request), request_type,
+                           NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+        self.sock.send(request)
+        buf = self._buf
+        while True:
+            size = self.sock.recv_into(buf)
+            offset = 0
+            while offset + NLMSGHDR.size <= size:
+                (msg_len, msg_type, _flags, seq,
+                 _pid) = NLMSGHDR.unpack_from(buf, offset)
+                if msg_len < NLMSGHDR.size:
+                    raise IOError("truncated netlink message")
+                # Replies to an older, abandoned request are skipped.
+                if seq == self.seq:
+                    if msg_type == NLMSG_DONE:
+                        return
+                    elif msg_type == NLMSG_ERROR:
+                        error, = NLMSGERR.unpack_from(buf,
+                                                      offset + NLMSGHDR.size)
+                        if error:
+                            raise OSError(-error, os.strerror(-error))
+                    elif msg_type == reply_type:
+                        handle(buf, offset, msg_len)
+                offset += _align(msg_len)
+
+    def dump_links(self):
+        """Full RTM_GETLINK dump, returns {ifindex: (name, link)}."""
+        links = {}
+
+        def handle(buf, offset, msg_len):
+            ifindex, name, link = parse_link(buf, offset, msg_len)
+            if name is not None and link['stats'] is not None:
+                links[ifindex] = (name, link)
+
+        self._dump(self._link_request, RTM_GETLINK, RTM_NEWLINK, handle)
+        return links
+
+    def dump_stats(self):
+        """RTM_GETSTATS dump, returns {ifindex: stats}."""
+        stats = {}
+
+        def handle(buf, offset, msg_len):
+            ifindex, link_stats = parse_stats(buf, offset)
+            if link_stats is not None:
+                stats[ifindex] = link_stats
+
+        self._dump(self._stats_request, RTM_GETSTATS, RTM_NEWSTATS, handle)
+        return stats
+
+    def _update_stats(self):
+        """Refresh the counters of self.links, False if a full dump is
+        needed instead."""
+        if not self.use_getstats:
+            return False
+        try:
+            stats = self.dump_stats()
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+            LOG.info(_("RTM_GETSTATS is not supported, dumping all link "
+                       "attributes on every sample"))
+            self.use_getstats = False
+            return False
+        if len(stats) != len(self.links) or any(
+                ifindex not in self.links for ifindex in stats):
+            # A link came or went before its notification was read.
+            return False
+        for ifindex, (_name, link) in self.links.items():
+            link['stats'] = stats[ifindex]
+        return True
+
+    def dump(self):
+        """Return {ifname: link} for every link.
+
+        A link is a dict with 'stats' (the /proc/net/dev columns),
+        'carrier', 'operstate' and 'mtu'.  Kernels older than 3.x do not
+        send IFLA_CARRIER, carrier is then None.
+        """
+        if (self.links_changed() or self.links is None or
+                not self._update_stats()):
+            self.links = self.dump_links()
+        return dict(self.links.values())
+
+
+_DUMPER = None
+
+
+def get_link_dumper():
+    """Get the shared LinkDumper, None if rtnetlink can not be used."""
+    global _DUMPER
+    if _DUMPER is None:
+        try:
+            _DUMPER = LinkDumper()
+        except (socket.error, AttributeError) as e:
+            # AttributeError: no AF_NETLINK on this platform.
+            LOG.warning(_("rtnetlink is not available, reading "
+                          "/proc/net/dev instead: %s"), e)
+            _DUMPER = False
+    return _DUMPER or None
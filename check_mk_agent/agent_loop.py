@@ -20,14 +20,19 @@ import eventlet
 import json
 import logging
 import os
+import signal
 import sys
 import time
 
 sys.path.append(".")
 from oslo_config import cfg
 from check_mk_agent.agent.common import config
+from check_mk_agent.agent.linux import perf_stat
+from check_mk_agent.agent.linux import process_table
 from check_mk_agent.agent.linux import utils
+from check_mk_agent.common import scheduler
 from check_mk_agent.common import utils as cutils
+from check_mk_agent.devices import burst
 from check_mk_agent.devices import devices
 
 LOG = logging.getLogger(__name__)
@@ -38,11 +43,13 @@ default_argv = ['--config-file', CONFIG_PATH]
 
 worker_pool = eventlet.GreenPool(10)
 
+PERF_STAT_EVENTS = "cycles,instructions,cache-references,cache-misses,bus-cycles,L1-dcache-loads,L1-dcache-load-misses,L1-dcache-stores,dTLB-loads,dTLB-load-misses,dTLB-stores,dTLB-store-misses,iTLB-loads,iTLB-load-misses,LLC-loads,LLC-load-misses,LLC-stores,LLC-store-misses,LLC-prefetches"
+
 def start_perf_stat(dp_pid):
     rm_file_cmd = "rm -rf /tmp/perf-stat.out"
     cutils.run_cmd_with_result(rm_file_cmd)
 
-    start_perf_cmd = "sudo perf stat -e cycles,instructions,cache-references,cache-misses,bus-cycles,L1-dcache-loads,L1-dcache-load-misses,L1-dcache-stores,dTLB-loads,dTLB-load-misses,dTLB-stores,dTLB-store-misses,iTLB-loads,iTLB-load-misses,LLC-loads,LLC-load-misses,LLC-stores,LLC-store-misses,LLC-prefetches -p %s -o /tmp/perf-stat.out" % dp_pid
+    start_perf_cmd = "sudo perf stat -e %s -p %s -o /tmp/perf-stat.out" % (PERF_STAT_EVENTS, dp_pid)
     cutils.run_cmd_with_result(start_perf_cmd)
 
 def start_perf_stat_in_worker(dp_pid):
@@ -59,6 +66,57 @@ def start_perf_record_in_worker(dp_pid):
     worker_pool.spawn_n(start_perf_record, dp_pid)
     
 
+class BurstTrigger(object):
+    """Start a burst of cpu samples, or end the running one."""
+
+    def __init__(self, dp_pid):
+        self.dp_pid = dp_pid
+        self.sampler = None
+
+    def toggle(self, *args):
+        if self.sampler and self.sampler.is_running():
+            self.sampler.stop()
+            return
+        try:
+            self.sampler = burst.BurstSampler(
+                self.dp_pid, interval=cfg.CONF.burst_interval / 1000.0,
+                duration=cfg.CONF.burst_duration,
+                samples=cfg.CONF.burst_samples,
+                output_dir=cfg.CONF.burst_dir)
+        except (IOError, OSError) as e:
+            LOG.error("Failed to start a burst: %s", e)
+            return
+        self.sampler.start()
+
+
+def split_patterns(value):
+    """Split a comma separated option into its non-empty items."""
+    return [pattern.strip() for pattern in value.split(",")
+            if pattern.strip()]
+
+
+def is_threshold_crossed(host, cpu_has_baseline=True):
+    """Whether a sample crosses the thresholds of the adaptive rate: a
+    core less idle than mute_idlecpu, or the dp process busier than
+    adaptive_dp_cpu.
+
+    The cores are not watched when cpu_has_baseline is False: the cpu
+    usage of a tick that re-baselined, e.g. on cpu hotplug, is all zeros.
+    """
+    mute_idlecpu = float(cfg.CONF.mute_idlecpu)
+    cpuinfos = host.get('cpu') if cpu_has_baseline else None
+    for cpu_key, cpu_value in (cpuinfos or {}).items():
+        if (cpu_key != 'cpu' and isinstance(cpu_value, dict) and
+                cpu_value.get('idle', 100) < mute_idlecpu):
+            return True
+    dp_process_cpu = (host.get('dp-cpu') or {}).get('dp_process_cpu')
+    if cfg.CONF.adaptive_dp_cpu and dp_process_cpu:
+        if (dp_process_cpu['user'] + dp_process_cpu['system'] >
+                cfg.CONF.adaptive_dp_cpu):
+            return True
+    return False
+
+
 def main():
     # the configuration will be read into the cfg.CONF global data structure
     config.parse(sys.argv[1:])
@@ -79,98 +137,223 @@ def main():
                   "with error: %s", out_file, str(e))
         raise e
 
+    perf_stat_stream = None
+    perf = None
     if "perf" in supported_metrics:
         dp_pid = cfg.CONF.dp_pid
         if not dp_pid:
             LOG.error("ERROR: dp pid is MUST for perf monitor")
             sys.exit(_("ERROR: dp pid is MUST for perf monitor"))
-        eventlet.spawn_n(start_perf_stat_in_worker, dp_pid)
+        perf_backend = cfg.CONF.perf_backend
+        if perf_backend == 'events':
+            perf = devices.Perf(dp_pid, event_set=cfg.CONF.perf_events)
+            if not perf.counters.groups:
+                # e.g. the agent does not run as root: perf stat under
+                # sudo can still count.
+                LOG.warning(_("No perf counter of %s could be opened, "
+                              "using the interval perf backend"), dp_pid)
+                perf.counters.close()
+                perf = None
+                perf_backend = 'interval'
+        if perf_backend == 'perf':
+            eventlet.spawn_n(start_perf_stat_in_worker, dp_pid)
+        elif perf_backend == 'interval':
+            perf_stat_stream = perf_stat.PerfStatStream(
+                dp_pid, PERF_STAT_EVENTS.split(","),
+                interval=cfg.CONF.perf_stat_interval)
+            worker_pool.spawn_n(perf_stat_stream.run)
         eventlet.spawn_n(start_perf_record_in_worker, dp_pid)
 
     monitor_qemu = cfg.CONF.monitor_qemu
     monitor_ovs_kernel = cfg.CONF.monitor_ovs_kernel
     dp_pid = cfg.CONF.dp_pid
 
+    dp_thread_groups = split_patterns(cfg.CONF.dp_thread_groups)
+    process_groups = config.get_process_groups()
+    processes = None
     ksoftirqd_pids = []
     vhost_pids = []
-    if monitor_ovs_kernel:
-        ksoftirqd_get_cmds = "pgrep ksoftirqd"
-        rc, stdout = cutils.run_cmd_with_result(ksoftirqd_get_cmds, is_quite=True)
-        if not rc:
-            ksoftirqd_pids = [line.strip() for line in stdout.split("\n")
-                              if line.strip()]
-            LOG.info("Ksoftirqds process pids: %s", ksoftirqd_pids)
-
-        vhost_get_cmds = "pgrep vhost"
-        rc, stdout = cutils.run_cmd_with_result(vhost_get_cmds, is_quite=True)
-        if not rc:
-            vhost_pids = [line.strip() for line in stdout.split("\n")
-                          if line.strip()]
-            LOG.info("vhost process pids: %s", vhost_pids)
-
-
     qemu_pids = []
+    if (monitor_qemu or monitor_ovs_kernel or process_groups or
+            'pressure' in supported_metrics):
+        processes = process_table.ProcessTable(process_groups)
+        processes.refresh()
+    if monitor_ovs_kernel:
+        ksoftirqd_pids = processes.get_pids('ksoftirqd')
+        LOG.info("Ksoftirqds process pids: %s", ksoftirqd_pids)
+        vhost_pids = processes.get_pids('vhost')
+        LOG.info("vhost process pids: %s", vhost_pids)
     if monitor_qemu:
-        qemu_get_cmds = "pgrep qemu-system"
-        rc, stdout = cutils.run_cmd_with_result(qemu_get_cmds, is_quite=True)
-        if not rc:
-            qemu_pids = [line.strip() for line in stdout.split("\n")
-                         if line.strip()]
-            LOG.info("Qemu process pids: %s", qemu_pids)
+        qemu_pids = processes.get_pids('qemu')
+        LOG.info("Qemu process pids: %s", qemu_pids)
 
     if dp_pid:
-        cpu = devices.Cpu(dp_pid, qemu_pids=qemu_pids, ksoftirqd_pids=ksoftirqd_pids, vhost_pids=vhost_pids)
+        cpu = devices.Cpu(dp_pid, qemu_pids=qemu_pids, ksoftirqd_pids=ksoftirqd_pids, vhost_pids=vhost_pids,
+                          freq_interval=cfg.CONF.cpu_freq_interval)
     else:
-        cpu = devices.Cpu(qemu_pids=qemu_pids, ksoftirqd_pids=ksoftirqd_pids, vhost_pids=vhost_pids)
-    time.sleep(1)
-    while True:
+        cpu = devices.Cpu(qemu_pids=qemu_pids, ksoftirqd_pids=ksoftirqd_pids, vhost_pids=vhost_pids,
+                          freq_interval=cfg.CONF.cpu_freq_interval)
+    # The collectors are built once, their first sample is the baseline of
+    # the rates.
+    collectors = {'cpu': cpu}
+    if "mem" in supported_metrics:
+        memory = devices.Memory()
+        collectors['mem'] = memory
+    if 'system' in supported_metrics:
+        system = devices.System()
+        collectors['system'] = system
+    if 'disks' in supported_metrics:
+        disks = devices.Disks()
+        collectors['disks'] = disks
+    if 'nets' in supported_metrics:
+        nets = devices.Nets(attr_interval=cfg.CONF.net_attr_interval,
+                            backend=cfg.CONF.nets_backend)
+        collectors['nets'] = nets
+    if 'softirqs' in supported_metrics:
+        softirqs = devices.Softirqs(
+            patterns=split_patterns(cfg.CONF.softirq_names))
+        collectors['softirqs'] = softirqs
+    if 'interrupts' in supported_metrics:
+        interrupts = devices.Interrupts(
+            patterns=split_patterns(cfg.CONF.irq_names))
+        collectors['interrupts'] = interrupts
+    if 'pressure' in supported_metrics:
+        pressure = devices.Pressure(qemu_pids=processes.get_pids('qemu'))
+        collectors['pressure'] = pressure
+    if 'numa' in supported_metrics:
+        numa = devices.Numa()
+        collectors['numa'] = numa
+    if perf:
+        collectors['perf'] = perf
+
+    # Bursts sample /proc/stat and the dp process at a high rate in a
+    # thread of their own, next to the loop.
+    burst_trigger = BurstTrigger(dp_pid)
+    signal.signal(signal.SIGUSR1, burst_trigger.toggle)
+    if cfg.CONF.burst_on_start:
+        burst_trigger.toggle()
+
+    # A collect function takes the sample of a metric and returns the
+    # sections it fills.
+    def collect_cpu():
+        cpu.refresh()
+        sections = {'cpu': cpu.get_device_dict()}
+        if dp_pid:
+            # LOG.info("Jiffies interval: %f", cpu.get_jiffies_interval())
+            sections['dp-cpu'] = cpu.get_dp_cpu_now()
+            if cfg.CONF.monitor_dp_threads:
+                sections['dp-thread-cpu'] = cpu.get_dp_thread_cpu_now(
+                    dp_thread_groups)
+        if monitor_qemu:
+            sections['qemu-cpu'] = cpu.get_qemu_cpu_now(
+                processes.get_pids('qemu'))
+        if monitor_ovs_kernel:
+            sections['ovs-kernel-cpu'] = cpu.get_ovs_kernel_cpu_now(
+                processes.get_pids('ksoftirqd'),
+                processes.get_pids('vhost'))
+        if process_groups:
+            sections['process-cpu'] = cpu.get_process_cpu_now(
+                dict((name, processes.get_pids(name))
+                     for name, pattern in process_groups))
+        return sections
+
+    def collect_pressure():
+        pressure.set_qemu_pids(processes.get_pids('qemu'))
+        pressure.refresh()
+        return {'pressure': pressure.get_device_dict()}
+
+    def collect_device(metric):
+        collector = collectors[metric]
+
+        def collect():
+            collector.refresh()
+            return {metric: collector.get_device_dict()}
+        return collect
+
+    collect_functions = dict((metric, collect_device(metric))
+                             for metric in collectors)
+    collect_functions['cpu'] = collect_cpu
+    if 'pressure' in collectors:
+        collect_functions['pressure'] = collect_pressure
+
+    def sample():
         timestamp = time.time()
         host_with_timestamp = {timestamp: {}}
         host = host_with_timestamp[timestamp]
-        if "mem" in supported_metrics:
-            memory = devices.Memory()
-            host['mem'] = memory.get_device_dict()
-        if 'cpu' in supported_metrics:
-            host['cpu'] = cpu.get_cpu_now()
-            if dp_pid:
-                # LOG.info("Jiffies interval: %f", cpu.get_jiffies_interval())
-                host['dp-cpu'] = cpu.get_dp_cpu_now()
-            if cfg.CONF.monitor_qemu:
-                qemu_get_cmds = "pgrep qemu-system"
-                rc, stdout = cutils.run_cmd_with_result(qemu_get_cmds, is_quite=True)
-                if not rc:
-                    qemu_pids = [line.strip() for line in stdout.split("\n")
-                                 if line.strip()]
-                    host['qemu-cpu'] = cpu.get_qemu_cpu_now(qemu_pids)
-            if monitor_ovs_kernel:
-                ksoftirqd_pids = []
-                vhost_pids = []
-                ksoftirqd_get_cmds = "pgrep ksoftirqd"
-                rc, stdout = cutils.run_cmd_with_result(ksoftirqd_get_cmds, is_quite=True)
-                if not rc:
-                    ksoftirqd_pids = [line.strip() for line in stdout.split("\n")
-                                      if line.strip()]
-
-                vhost_get_cmds = "pgrep vhost"
-                rc, stdout = cutils.run_cmd_with_result(vhost_get_cmds, is_quite=True)
-                if not rc:
-                    vhost_pids = [line.strip() for line in stdout.split("\n")
-                                  if line.strip()]
-                host['ovs-kernel-cpu'] = cpu.get_ovs_kernel_cpu_now(ksoftirqd_pids, vhost_pids)
-
-        if 'system' in supported_metrics:
-            system = devices.System()
-            host['system'] = system.get_device_dict()
-        if 'disks' in supported_metrics:
-            disks = devices.Disks()
-            host['disks'] = disks.get_device_dict()
-        if 'nets' in supported_metrics:
-            nets = devices.Nets()
-            host['nets'] = nets.get_device_dict()
+        # The metrics whose interval is up are sampled in this tick.
+        due = schedule.due(cutils.monotonic())
+        if processes and ('cpu' in due or 'pressure' in due):
+            processes.refresh()
+        calls = [(metric, collect_functions[metric]) for metric in due
+                 if metric in collect_functions]
+        if runner:
+            # The tick interval changes with the adaptive rate.
+            results, stale = runner.run(calls, schedule.tick_interval)
+        else:
+            results = dict((metric, function()) for metric, function in calls)
+            stale = {}
+        for sections in results.values():
+            host.update(sections)
+        if stale:
+            # The metrics missing from the sample: timeout, error or still
+            # running since an earlier tick.
+            host['stale'] = stale
+        if perf_stat_stream and 'perf' in due:
+            # The perf stat intervals that ended since the previous tick,
+            # keyed by their own timestamp.
+            host['perf-stat'] = perf_stat_stream.pop_intervals(timestamp)
+        if adaptive:
+            # Applies from the next tick on.
+            host['adaptive'] = {
+                'intervals': adaptive.update(
+                    is_threshold_crossed(host, cpu.has_baseline),
+                    cutils.monotonic()),
+            }
+            host['adaptive']['active'] = adaptive.is_active()
+            sampler.interval = schedule.tick_interval
+        # Lateness of the tick and the overruns and skipped ticks so far.
+        host['scheduler'] = dict(sampler.stats, interval=sampler.interval)
+        # Seconds every collector of the tick spent taking its sample, and
+        # the time it was taken at.
+        sampled = [collectors[metric] for metric in results
+                   if metric in collectors]
+        host['refresh-time'] = dict(
+            (collector.name, collector.refresh_time)
+            for collector in sampled
+            if collector.refresh_time is not None)
+        host['sample-time'] = dict(
+            (collector.name, collector.sample_time)
+            for collector in sampled
+            if collector.sample_time is not None)
         result = json.dumps(host_with_timestamp, indent=4)
         out_file.write("\n" + result)
         out_file.flush()
-        time.sleep(1)
+
+    # The deadlines are on the monotonic clock so the period does not
+    # drift by the collection time; the green threads, e.g. the perf
+    # readers, run while the loop waits.  The loop ticks at the shortest
+    # metric interval, the first tick waits an interval for the baseline
+    # of the rates.
+    schedule = scheduler.MetricSchedule(
+        config.get_metric_intervals(supported_metrics))
+    interval = schedule.tick_interval
+    # Collectors run in threads so a hung one, e.g. statvfs of a dead NFS
+    # mount, does not hold the tick past its deadline.
+    runner = None
+    if cfg.CONF.concurrent_collectors:
+        runner = scheduler.CollectorRunner(config.get_collector_deadlines())
+    # The rate of the adaptive metrics is raised while a threshold is
+    # crossed and decays back afterwards.
+    adaptive = None
+    adaptive_metrics = [metric for metric in
+                        split_patterns(cfg.CONF.adaptive_metrics)
+                        if metric in supported_metrics]
+    if adaptive_metrics:
+        adaptive = scheduler.AdaptiveRate(
+            schedule, adaptive_metrics, cfg.CONF.adaptive_interval,
+            hold=cfg.CONF.adaptive_hold, decay=cfg.CONF.adaptive_decay)
+    sampler = scheduler.FixedRateLoopingCall(sample)
+    sampler.start(interval, initial_delay=interval).wait()
 
 
 if __name__ == "__main__":
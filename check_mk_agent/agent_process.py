@@ -29,6 +29,7 @@ sys.path.append(".")
 from oslo_config import cfg
 
 from check_mk_agent.agent.common import config
+from check_mk_agent.agent.linux import perf_script
 from check_mk_agent.agent.linux import utils
 from check_mk_agent.common import utils as cutils
 from check_mk_agent.devices import devices
@@ -48,6 +49,56 @@ def np_process_array(value):
         'std': round(np.std(np_array), 2)
     }
 
+def merge_cpu_data(cpu_infos, cpu_data):
+    for cpu_key, cpu_value in cpu_data.items():
+        if cpu_key not in cpu_infos:
+            cpu_infos[cpu_key] = {}
+        cpu_info = cpu_infos[cpu_key]
+        for key, value in cpu_value.items():
+            if key not in cpu_info:
+                cpu_info[key] = [value]
+            else:
+                cpu_info[key].append(value)
+
+def read_samples(out_file, start_time, stop_time):
+    """Yield (timestamp, host sample) of the agent output file, limited to
+    the monitor time range."""
+    json_block = []
+    for line in out_file:
+        json_block.append(line)
+        if line.startswith('}'):
+            json_dict = json.loads(''.join(json_block))
+            json_block = []
+            time_stamp_key = list(json_dict.keys())[0]
+            time_stamp = float(time_stamp_key)
+            if start_time and time_stamp < start_time:
+                continue
+            if stop_time and time_stamp > stop_time:
+                continue
+            yield time_stamp, json_dict[time_stamp_key]
+
+def get_perf_samples(raw_data):
+    """The perf samples of a host sample: one with the events backend,
+    the perf stat intervals that ended in the tick with the interval one."""
+    if "perf-stat" in raw_data:
+        return raw_data["perf-stat"].values()
+    if raw_data.get("perf"):
+        return [raw_data["perf"]]
+    return []
+
+def process_perf_infos(out_file, start_time, stop_time):
+    """Summarize the perf samples of the events and interval backends per
+    counter."""
+    perf_infos = {}
+    for time_stamp, raw_data in read_samples(out_file, start_time,
+                                             stop_time):
+        for perf_data in get_perf_samples(raw_data):
+            for key, value in perf_data.items():
+                if value is not None:
+                    perf_infos.setdefault(key, []).append(value)
+    return dict((key, np_process_array(values))
+                for key, values in perf_infos.items())
+
 def process_cpu_infos(cpu_infos):
     cpu_fields = cfg.CONF.cpu_fields.split(",")
     LOG.info("cpu_fields: %s", cpu_fields)
@@ -98,73 +149,37 @@ def main():
         (start_time, stop_time) = config.get_monitor_time_range()
         LOG.info(_("Process start time: %f, stop_time: %f"), start_time, stop_time)
 
-        json_block = []
         cpu_infos = {}
         count = 0;
-        for line in out_file:
-            json_block.append(line)
-            if line.startswith('}'):
-                json_dict = json.loads(''.join(json_block))
-                json_block = []
-                time_stamp_key = json_dict.keys()[0]
-                time_stamp = float(time_stamp_key)
-                if start_time and time_stamp < start_time:
-                    continue
-                if stop_time and time_stamp > stop_time:
-                    continue
-                raw_data = json_dict[time_stamp_key]
-                LOG.debug("raw_data: %s", raw_data)
-                cpu_data = raw_data.get("cpu")
-                if cpu_data:
-                    count += 1
-                    for cpu_key,cpu_value in cpu_data.items():
-                        if cpu_key not in cpu_infos:
-                            cpu_infos[cpu_key] = {}
-                        cpu_info = cpu_infos[cpu_key]
-                        for key, value in cpu_value.items():
-                            if key not in cpu_info:
-                                cpu_info[key] = [value]
-                            else:
-                                cpu_info[key].append(value)
-                if dp_pid:
-                    dp_cpu_data = raw_data.get("dp-cpu")
-                    LOG.info("dp_cpu info: %s", dp_cpu_data)
-                    if dp_cpu_data:
-                        for cpu_key,cpu_value in dp_cpu_data.items():
-                            if cpu_key not in cpu_infos:
-                                cpu_infos[cpu_key] = {}
-                            cpu_info = cpu_infos[cpu_key]
-                            for key, value in cpu_value.items():
-                                if key not in cpu_info:
-                                    cpu_info[key] = [value]
-                                else:
-                                    cpu_info[key].append(value)
-                if monitor_qemu:
-                    qemu_cpu_data = raw_data.get("qemu-cpu")
-                    if qemu_cpu_data:
-                        for cpu_key,cpu_value in qemu_cpu_data.items():
-                            if cpu_key not in cpu_infos:
-                                cpu_infos[cpu_key] = {}
-                            cpu_info = cpu_infos[cpu_key]
-                            for key, value in cpu_value.items():
-                                if key not in cpu_info:
-                                    cpu_info[key] = [value]
-                                else:
-                                    cpu_info[key].append(value)
-
-                if monitor_ovs_kernel:
-                    ovs_kernel_cpu_data = raw_data.get("ovs-kernel-cpu")
-                    LOG.info("kernel info: %s", ovs_kernel_cpu_data)
-                    if ovs_kernel_cpu_data:
-                        for cpu_key,cpu_value in ovs_kernel_cpu_data.items():
-                            if cpu_key not in cpu_infos:
-                                cpu_infos[cpu_key] = {}
-                            cpu_info = cpu_infos[cpu_key]
-                            for key, value in cpu_value.items():
-                                if key not in cpu_info:
-                                    cpu_info[key] = [value]
-                                else:
-                                    cpu_info[key].append(value)
+        for time_stamp, raw_data in read_samples(out_file, start_time,
+                                                 stop_time):
+            LOG.debug("raw_data: %s", raw_data)
+            cpu_data = raw_data.get("cpu")
+            if cpu_data:
+                count += 1
+                merge_cpu_data(cpu_infos, cpu_data)
+            if dp_pid:
+                dp_cpu_data = raw_data.get("dp-cpu")
+                LOG.info("dp_cpu info: %s", dp_cpu_data)
+                if dp_cpu_data:
+                    merge_cpu_data(cpu_infos, dp_cpu_data)
+                dp_thread_cpu_data = raw_data.get("dp-thread-cpu")
+                if dp_thread_cpu_data:
+                    merge_cpu_data(cpu_infos, dp_thread_cpu_data)
+            if monitor_qemu:
+                qemu_cpu_data = raw_data.get("qemu-cpu")
+                if qemu_cpu_data:
+                    merge_cpu_data(cpu_infos, qemu_cpu_data)
+
+            if monitor_ovs_kernel:
+                ovs_kernel_cpu_data = raw_data.get("ovs-kernel-cpu")
+                LOG.info("kernel info: %s", ovs_kernel_cpu_data)
+                if ovs_kernel_cpu_data:
+                    merge_cpu_data(cpu_infos, ovs_kernel_cpu_data)
+
+            process_cpu_data = raw_data.get("process-cpu")
+            if process_cpu_data:
+                merge_cpu_data(cpu_infos, process_cpu_data)
         LOG.info(_("Total valid item number: %d, Raw cpu infos: ..."), count)
         np_cpu_infos = process_cpu_infos(cpu_infos)
         result_dict["CPU_STAT"] = np_cpu_infos
@@ -175,11 +190,36 @@ def main():
         else:
             print json.dumps({"CPU_STAT": np_cpu_infos}, indent=4)
             #print "CPU_STAT:\n %s" % json.dumps(np_cpu_infos, indent=4)
-    if "perf" in supported_metrics:
+    if "perf" in supported_metrics and cfg.CONF.perf_backend in ('events',
+                                                                'interval'):
+        raw_data_file = os.path.join("/tmp", "check_mk_agent.out")
+        (start_time, stop_time) = config.get_monitor_time_range()
+        with open(raw_data_file, "r") as out_file:
+            perf_infos = process_perf_infos(out_file, start_time, stop_time)
+        result_dict["PERF_STAT"] = perf_infos
+        if not cfg.CONF.pprint:
+            print json.dumps({"PERF_STAT": perf_infos})
+        else:
+            print json.dumps({"PERF_STAT": perf_infos}, indent=4)
+    elif "perf" in supported_metrics:
         rc, stdout = cutils.run_cmd_with_result("cat /tmp/perf-stat.out")
         result_dict["PERF_STAT"] = stdout
         #print "PERF_STAT:\n %s" % stdout
         print json.dumps({"PERF_STAT": stdout})
+    if "perf" in supported_metrics:
+        if cfg.CONF.perf_script_file:
+            perf_top = perf_script.summarize_script_output(
+                cfg.CONF.perf_script_file, cfg.CONF.perf_top_size,
+                cfg.CONF.perf_top_threads)
+        else:
+            perf_top = perf_script.summarize_record(
+                "/tmp/perf-record.out", cfg.CONF.perf_top_size,
+                cfg.CONF.perf_top_threads)
+        result_dict["PERF_TOP"] = perf_top
+        if not cfg.CONF.pprint:
+            print json.dumps({"PERF_TOP": perf_top})
+        else:
+            print json.dumps({"PERF_TOP": perf_top}, indent=4)
 
 if __name__ == "__main__":
     main()
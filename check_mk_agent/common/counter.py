@@ -43,3 +43,55 @@ def save_counters(hostname):
     if not os.path.exists(COUNTER_DIR):
         os.makedirs(COUNTER_DIR)
     file(filename, "w").write("%r\n" % g_counters)
+
+
+COUNTER32_MAX = 2 ** 32
+COUNTER64_MAX = 2 ** 64
+
+
+def counter_delta(old, new):
+    """Increase of a counter from old to new.
+
+    A counter that went back either wrapped, at 2**32 if old still fits in
+    32 bits or else at 2**64, or was reset (driver reload, device
+    re-created); then it counted up from 0 and the delta is new.
+    """
+    if new >= old:
+        return new - old
+    wrap = COUNTER32_MAX if old < COUNTER32_MAX else COUNTER64_MAX
+    delta = new + wrap - old
+    # A wrap can not add more than half of the range within one sample.
+    if delta > wrap // 2:
+        return new
+    return delta
+
+
+class CounterRate(object):
+    """Per-second rates of cumulative counters.
+
+    The last sample of every series (a disk, an interface ...) is kept
+    with the monotonic time it was taken at.
+    """
+
+    def __init__(self):
+        self._samples = {}
+
+    def rates(self, key, values, now):
+        """Store values as the sample of key at now and return the rate of
+        every value since the previous sample, or None for a new series.
+        """
+        last = self._samples.get(key)
+        self._samples[key] = (now, values)
+        if last is None:
+            return None
+        then, old_values = last
+        elapsed = now - then
+        if elapsed <= 0:
+            return None
+        return [counter_delta(old, new) / elapsed
+                for old, new in zip(old_values, values)]
+
+    def retain(self, keys):
+        """Forget the series that are not in keys."""
+        for key in set(self._samples) - set(keys):
+            del self._samples[key]
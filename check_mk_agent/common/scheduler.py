@@ -0,0 +1,251 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Drift-free fixed rate looping call.
+
+FixedIntervalLoopingCall sleeps `interval - run time` after every call,
+measured on the wall clock, so each period is stretched by whatever the
+sleep overshoots and jumps with NTP steps.  Here every tick has a
+deadline on the monotonic clock, deadline N being start + N * interval,
+so errors do not accumulate.  A call that outlasts its period is an
+overrun; the deadlines it went past are skipped instead of being run back
+to back, and both are counted in the stats.
+"""
+
+import sys
+
+import eventlet
+from eventlet import event
+from eventlet import greenthread
+from eventlet import tpool
+
+from check_mk_agent.common import utils as cutils
+from check_mk_agent.openstack.common import log as logging
+from check_mk_agent.openstack.common import loopingcall
+
+
+LOG = logging.getLogger(__name__)
+
+
+class FixedRateLoopingCall(loopingcall.LoopingCallBase):
+    """A looping call run at fixed deadlines of the monotonic clock.
+
+    stats holds the 'ticks' run, the 'overruns' and 'skipped' ticks so
+    far, the 'lateness' of the current tick (seconds it started after its
+    deadline) and the 'run_time' of the previous one.  interval may be
+    changed by the called function, it applies from the next deadline.
+    """
+
+    def __init__(self, f=None, *args, **kw):
+        super(FixedRateLoopingCall, self).__init__(f, *args, **kw)
+        self.interval = None
+        self.stats = {'ticks': 0, 'overruns': 0, 'skipped': 0,
+                      'lateness': 0.0, 'run_time': None}
+
+    def _next_deadline(self, deadline, interval, now):
+        """Return the first deadline after now, counting the ones that
+        were missed."""
+        deadline += interval
+        if now > deadline:
+            late = now - deadline
+            missed = int(late // interval) + 1
+            self.stats['overruns'] += 1
+            self.stats['skipped'] += missed
+            LOG.warn(_('task run outlasted interval by %(late).3f sec, '
+                       'skipping %(missed)d ticks'),
+                     {'late': late, 'missed': missed})
+            deadline += missed * interval
+        return deadline
+
+    def start(self, interval, initial_delay=None):
+        self._running = True
+        self.interval = interval
+        done = event.Event()
+
+        def _inner():
+            deadline = cutils.monotonic() + (initial_delay or 0)
+            try:
+                while self._running:
+                    delay = deadline - cutils.monotonic()
+                    if delay > 0:
+                        greenthread.sleep(delay)
+                    start = cutils.monotonic()
+                    self.stats['lateness'] = round(start - deadline, 6)
+                    self.stats['ticks'] += 1
+                    self.f(*self.args, **self.kw)
+                    end = cutils.monotonic()
+                    self.stats['run_time'] = round(end - start, 6)
+                    if not self._running:
+                        break
+                    deadline = self._next_deadline(deadline, self.interval,
+                                                   end)
+            except loopingcall.LoopingCallDone as e:
+                self.stop()
+                done.send(e.retvalue)
+            except Exception:
+                LOG.exception(_('in fixed rate looping call'))
+                done.send_exception(*sys.exc_info())
+                return
+            else:
+                done.send(True)
+
+        self.done = done
+
+        greenthread.spawn_n(_inner)
+        return self.done
+
+
+class MetricSchedule(object):
+    """Deadlines of metrics sampled at their own intervals.
+
+    Every metric is due at start + N * its interval of the monotonic
+    clock.  The looping call ticks at the shortest interval and samples
+    all metrics that are due at that tick together.
+
+    :param intervals: {metric: seconds}.
+    """
+
+    def __init__(self, intervals):
+        self.intervals = dict(intervals)
+        self.tick_interval = min(self.intervals.values())
+        self.deadlines = None
+
+    def set_interval(self, metric, interval, now):
+        """Change the interval of a metric at monotonic time now; a metric
+        that is sped up is due within its new interval."""
+        self.intervals[metric] = interval
+        self.tick_interval = min(self.intervals.values())
+        if self.deadlines and self.deadlines[metric] > now + interval:
+            self.deadlines[metric] = now + interval
+
+    def due(self, now):
+        """Return the metrics due at monotonic time now and move their
+        deadlines past it."""
+        if self.deadlines is None:
+            self.deadlines = dict((metric, now) for metric in self.intervals)
+        # Deadlines of slower metrics and ticks are sums of different
+        # floats; half a tick of slack keeps them from missing each other.
+        now += self.tick_interval / 2
+        due = []
+        for metric, deadline in self.deadlines.items():
+            if deadline > now:
+                continue
+            interval = self.intervals[metric]
+            deadline += interval
+            if now > deadline:
+                deadline += (int((now - deadline) // interval) + 1) * interval
+            self.deadlines[metric] = deadline
+            due.append(metric)
+        return due
+
+
+class CollectorRunner(object):
+    """Run the collectors of a tick concurrently, each with a deadline.
+
+    Collectors block in syscalls (procfs reads, statvfs of a hung mount,
+    netlink), so each runs in a native thread of eventlet.tpool, waited
+    for by a green thread of pool.  A collector that misses its deadline
+    keeps running in its thread; it is not started again before it has
+    returned, its sections are reported stale meanwhile and the result it
+    eventually returns is dropped.
+
+    :param deadlines: {name: seconds} allowed from the start of the tick.
+    """
+
+    def __init__(self, deadlines, pool=None):
+        self.deadlines = dict(deadlines)
+        self.pool = pool or eventlet.GreenPool()
+        self.running = {}
+
+    def _finished(self, gt, name):
+        self.running.pop(name, None)
+
+    def run(self, calls, default_deadline):
+        """Run calls, [(name, function)], and return ({name: result},
+        {name: reason}) with reason 'timeout', 'running' (still busy
+        since an earlier tick) or 'error' for the calls without result.
+
+        The calls not in deadlines get default_deadline seconds, e.g. the
+        current tick interval.
+        """
+        start = cutils.monotonic()
+        started = []
+        stale = {}
+        for name, function in calls:
+            if name in self.running:
+                stale[name] = 'running'
+                continue
+            gt = self.pool.spawn(tpool.execute, function)
+            self.running[name] = gt
+            gt.link(self._finished, name)
+            started.append((name, gt))
+
+        results = {}
+        for name, gt in started:
+            deadline = self.deadlines.get(name, default_deadline)
+            timeout = start + deadline - cutils.monotonic()
+            try:
+                with eventlet.Timeout(max(timeout, 0)):
+                    results[name] = gt.wait()
+            except eventlet.Timeout:
+                LOG.warn(_('collector %(name)s missed its deadline of '
+                           '%(deadline).3f sec'),
+                         {'name': name, 'deadline': deadline})
+                stale[name] = 'timeout'
+            except Exception:
+                LOG.exception(_('collector %s failed'), name)
+                stale[name] = 'error'
+        return results, stale
+
+
+class AdaptiveRate(object):
+    """Raise the sampling rate of metrics while a watched value is over
+    its threshold.
+
+    When the watch triggers, the metrics are sampled every fast_interval.
+    Once it has not triggered for hold seconds, their interval is
+    multiplied by decay at every update until it is back to normal.
+
+    :param schedule: the MetricSchedule of the metrics.
+    :param metrics: the metrics whose rate is raised.
+    """
+
+    def __init__(self, schedule, metrics, fast_interval, hold=10.0,
+                 decay=2.0):
+        self.schedule = schedule
+        self.normal = dict((metric, schedule.intervals[metric])
+                           for metric in metrics
+                           if metric in schedule.intervals)
+        self.fast_interval = fast_interval
+        self.hold = hold
+        self.decay = max(decay, 1.0 + 1e-3)
+        self.triggered_at = None
+
+    def update(self, triggered, now):
+        """Apply the state of the watch at monotonic time now and return
+        {metric: current interval}."""
+        if triggered:
+            if self.triggered_at is None:
+                LOG.info(_('sampling %(metrics)s every %(interval).3f sec'),
+                         {'metrics': ','.join(sorted(self.normal)),
+                          'interval': self.fast_interval})
+            self.triggered_at = now
+            for metric, normal in self.normal.items():
+                self.schedule.set_interval(
+                    metric, min(self.fast_interval, normal), now)
+        elif (self.triggered_at is not None and
+                now - self.triggered_at >= self.hold):
+            back_to_normal = True
+            for metric, normal in self.normal.items():
+                interval = min(self.schedule.intervals[metric] * self.decay,
+                               normal)
+                self.schedule.set_interval(metric, interval, now)
+                back_to_normal = back_to_normal and interval == normal
+            if back_to_normal:
+                LOG.info(_('sampling %s at the normal rate again'),
+                         ','.join(sorted(self.normal)))
+                self.triggered_at = None
+        return dict((metric, self.schedule.intervals[metric])
+                    for metric in self.normal)
+
+    def is_active(self):
+        return self.triggered_at is not None
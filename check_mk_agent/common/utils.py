@@ -21,14 +21,50 @@
 
 """Utilities and helper functions."""
 
+import ctypes
+import ctypes.util
 import logging
+import os
 import signal
 import socket
+import time
 
 from eventlet.green import subprocess
 
 LOG = logging.getLogger(__name__)
 
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _clock_gettime_monotonic():
+    """time.monotonic for Python 2, through clock_gettime(2)."""
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    clock_gettime = libc.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        # Not shared, collectors may run in threads.
+        ts = _timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)):
+            errno_ = ctypes.get_errno()
+            raise OSError(errno_, os.strerror(errno_))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+# monotonic() returns seconds of a clock that never goes back, to measure
+# intervals: unlike time.time() it is not moved by NTP steps or by setting
+# the date.
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = _clock_gettime_monotonic()
+
 def get_hostname():
     return socket.gethostname()
 
@@ -7,6 +7,7 @@ import time
 import six
 
 from check_mk_agent.agent.linux import utils
+from check_mk_agent.common import utils as cutils
 
 DATA_BASE_DIR = os.path.join(os.path.dirname(__file__),'../../var/data')
 
@@ -17,9 +18,16 @@ class AbstractDevice(object):
 
     Real Devices including cpu,memmory,disk...etc should implement its some
     functions.
+
+    A collector is built once and takes the following samples with
+    refresh(), keeping its state (open files, previous samples) in between.
     """
     name = 'abstract_device'
     def __init__(self, device_dict=None):
+        # Seconds the last refresh() took and the wall clock time it
+        # started at.
+        self.refresh_time = None
+        self.sample_time = None
         #TODO(berlin): Here exists problems that None device_dict collected,
         #Server must first check the output before initializing a device.
         if not device_dict:
@@ -28,6 +36,19 @@ class AbstractDevice(object):
         else:
             self.init_device(device_dict)
 
+    def update(self):
+        """Take a new sample of the device."""
+        plain_info = self.get_plain_info()
+        self.parse_plain_info(plain_info)
+
+    def refresh(self):
+        """Take a new sample and return how many seconds it took."""
+        self.sample_time = time.time()
+        start = cutils.monotonic()
+        self.update()
+        self.refresh_time = cutils.monotonic() - start
+        return self.refresh_time
+
     @abc.abstractmethod
     def get_plain_info(self):
         """Get the plain info of device through calling shell commands."""
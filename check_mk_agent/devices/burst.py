@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""High rate cpu sampling of short windows, e.g. to catch PMD microbursts.
+
+A burst samples the cpu lines of /proc/stat and the user/system time of
+the datapath process and of each of its threads every few milliseconds,
+in a thread of its own.  The raw jiffies go straight into NumPy arrays
+that are allocated when the burst starts and used as a ring buffer: no
+dict, percentage or JSON is made per sample.  When the window ends the
+buffer is written with np.savez_compressed, oldest sample first, and
+usage is worked out offline from the differences of consecutive rows.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.common import utils as cutils
+from check_mk_agent.devices import cpustat
+
+LOG = logging.getLogger(__name__)
+
+PROC_STAT_PATH = '/proc/stat'
+# Start of the burst in milliseconds and a sequence number, so bursts
+# toggled within the same millisecond do not overwrite each other.
+BURST_FILE = 'check_mk_agent-burst-%d-%d.npz'
+
+_SEQUENCE = itertools.count()
+
+
+def read_cpu_lines(content):
+    """Return the cpu lines of /proc/stat content, "cpu" row first."""
+    lines = []
+    for line in content.split('\n'):
+        if not line.startswith('cpu'):
+            break
+        lines.append(line)
+    return lines
+
+
+def parse_cpu_lines(lines):
+    """Return the jiffies of cpu lines as [[int] * NUM_FIELDS], padded
+    with 0 like CpuStatEngine for kernels with fewer columns.
+
+    Raises ValueError for a line that is not all numbers.
+    """
+    rows = []
+    for line in lines:
+        fields = line.split()[1:cpustat.NUM_FIELDS + 1]
+        fields += ['0'] * (cpustat.NUM_FIELDS - len(fields))
+        rows.append([int(field) for field in fields])
+    return rows
+
+
+class BurstSampler(object):
+    """Samples of one burst window in preallocated ring buffers.
+
+    :param dp_pid: the datapath process, or None for /proc/stat only.
+    :param interval: seconds between two samples.
+    :param duration: seconds the window lasts; 0 runs until stop().
+    :param samples: size of the ring, the last samples are kept when the
+        window holds more.
+    """
+
+    def __init__(self, dp_pid=None, interval=0.01, duration=10,
+                 samples=1000, output_dir='/tmp'):
+        self.dp_pid = dp_pid
+        self.interval = interval
+        self.duration = duration
+        self.samples = samples
+        self.output_dir = output_dir
+        self.count = 0
+        self.sequence = next(_SEQUENCE)
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._stat = procfs.ProcFile(PROC_STAT_PATH)
+        self.cpu_names = [line.split()[0] for line in
+                          read_cpu_lines(self._stat.read())]
+        self.tids = []
+        self.thread_names = []
+        self._task_files = []
+        self._dp_file = None
+        if dp_pid:
+            self._open_dp(dp_pid)
+
+        self.times = np.zeros(samples, dtype=np.float64)
+        self.cpu = np.zeros((samples, len(self.cpu_names),
+                             cpustat.NUM_FIELDS), dtype=np.int64)
+        self.dp = np.zeros((samples, 2), dtype=np.int64)
+        # -1 once a thread has exited.
+        self.dp_threads = np.zeros((samples, len(self.tids), 2),
+                                   dtype=np.int64)
+
+    def _open_dp(self, dp_pid):
+        """Open the stat files of the process and of the threads it has
+        when the burst starts; threads started later are not followed."""
+        self._dp_file = procfs.ProcFile('/proc/%s/stat' % dp_pid)
+        task_dir = '/proc/%s/task' % dp_pid
+        for tid in sorted(os.listdir(task_dir), key=int):
+            try:
+                task_file = procfs.ProcFile('%s/%s/stat' % (task_dir, tid))
+                name = cpustat.parse_pid_stat(task_file.read())[0]
+            except (IOError, OSError):
+                continue
+            self.tids.append(int(tid))
+            self.thread_names.append(name)
+            self._task_files.append(task_file)
+
+    @staticmethod
+    def _read_times(proc_file, out):
+        """Load utime and stime of a stat file into out, -1 if it is
+        gone."""
+        try:
+            fields = cpustat.parse_pid_stat(proc_file.read())[1]
+        except (IOError, OSError, ValueError):
+            out[:] = -1
+            return
+        out[0] = int(fields[cpustat.STAT_UTIME])
+        out[1] = int(fields[cpustat.STAT_STIME])
+
+    def sample(self):
+        """Take one sample into the next row of the ring."""
+        row = self.count % self.samples
+        self.times[row] = time.time()
+        lines = read_cpu_lines(self._stat.read())
+        try:
+            if len(lines) != len(self.cpu_names):
+                # A cpu went on or offline.
+                raise ValueError(len(lines))
+            self.cpu[row] = parse_cpu_lines(lines)
+        except ValueError:
+            # The row is marked invalid, the burst goes on.
+            self.cpu[row] = -1
+        if self._dp_file is not None:
+            self._read_times(self._dp_file, self.dp[row])
+            for index, task_file in enumerate(self._task_files):
+                self._read_times(task_file, self.dp_threads[row, index])
+        self.count += 1
+
+    def run(self):
+        """Sample at fixed deadlines until the window ends or stop()."""
+        start = cutils.monotonic()
+        deadline = start
+        end = start + self.duration if self.duration else None
+        LOG.info(_("Burst sampling every %(interval).3f sec started"),
+                 {'interval': self.interval})
+        try:
+            try:
+                while not self._stop.is_set():
+                    now = cutils.monotonic()
+                    if end is not None and now >= end:
+                        break
+                    if deadline > now:
+                        self._stop.wait(deadline - now)
+                        continue
+                    self.sample()
+                    deadline += self.interval
+                    if deadline < now:
+                        # Missed deadlines are skipped, not made up for.
+                        missed = (now - deadline) // self.interval + 1
+                        deadline += missed * self.interval
+            except Exception:
+                # The samples taken so far are still dumped.
+                LOG.exception(_("Burst sampling failed"))
+            self.dump()
+        finally:
+            self.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run,
+                                        name='burst-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """End the window early; the buffer is dumped by the thread."""
+        self._stop.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def get_rows(self):
+        """Indexes of the filled rows of the ring, oldest first."""
+        if self.count <= self.samples:
+            return np.arange(self.count)
+        first = self.count % self.samples
+        return np.roll(np.arange(self.samples), -first)
+
+    def dump(self):
+        """Write the samples to output_dir and return the file name."""
+        rows = self.get_rows()
+        start = self.times[rows[0]] if len(rows) else time.time()
+        path = os.path.join(self.output_dir,
+                            BURST_FILE % (int(start * 1000), self.sequence))
+        np.savez_compressed(
+            path,
+            times=self.times[rows],
+            cpu_names=np.array(self.cpu_names),
+            cpu_fields=np.array(cpustat.FIELDS),
+            cpu=self.cpu[rows],
+            dp_pid=np.array(int(self.dp_pid or 0)),
+            dp=self.dp[rows],
+            dp_tids=np.array(self.tids, dtype=np.int64),
+            dp_thread_names=np.array(self.thread_names),
+            dp_threads=self.dp_threads[rows],
+            clk_tck=np.array(os.sysconf('SC_CLK_TCK')),
+            interval=np.array(self.interval))
+        LOG.info(_("Burst of %(count)d samples written to %(path)s"),
+                 {'count': len(rows), 'path': path})
+        return path
+
+    def close(self):
+        for proc_file in [self._stat, self._dp_file] + self._task_files:
+            if proc_file is not None:
+                proc_file.close()
+        self._task_files = []
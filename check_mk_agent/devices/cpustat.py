@@ -0,0 +1,432 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Cpu accounting from /proc/stat and /proc/<pid>/stat.
+
+The cpu lines of /proc/stat are parsed into a (ncpu x fields) int64 matrix
+that is allocated once.  Deltas and percentages of every core are computed
+in one NumPy step and turned into dicts only when the result is returned.
+"""
+
+import fnmatch
+import logging
+import os
+
+import numpy as np
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.common import utils as cutils
+
+LOG = logging.getLogger(__name__)
+
+# Output names of the first eight /proc/stat columns, in kernel order.
+FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'hardirq', 'softirq',
+          'steal')
+NUM_FIELDS = len(FIELDS)
+# The total jiffies of a core are the sum of user..softirq; steal is not
+# part of it.
+NUM_TOTAL_FIELDS = 7
+
+# Indexes into the /proc/<pid>/stat fields that follow "(comm)", i.e.
+# field N of proc(5) is at index N - 3.
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_CUTIME = 13
+STAT_CSTIME = 14
+STAT_STARTTIME = 19
+STAT_PROCESSOR = 36
+
+SCHEDSTAT_PATH = '/proc/%s/task/%s/schedstat'
+TASK_COMM_PATH = '/proc/%s/task/%s/comm'
+# qemu names the thread of vCPU n "CPU n/KVM".
+VCPU_THREAD_PATTERN = 'CPU */KVM'
+
+CPUFREQ_PATH = '/sys/devices/system/cpu/%s/cpufreq/scaling_cur_freq'
+CPUINFO_PATH = '/proc/cpuinfo'
+CPUINFO_PROCESSOR = 'processor'
+CPUINFO_SPEED = 'cpu MHz'
+
+
+def get_percent(num, total):
+    if total == 0:
+        return 0
+    rc = float(num) / float(total) * 100
+    return round(rc, 2)
+
+
+def release_unused(baselines, keys, path):
+    """Close the procfs files of the keys that no group of baselines
+    ({group: {key: baseline}}) samples any more."""
+    for key in keys:
+        if not any(key in group for group in baselines.values()):
+            procfs.release(path % key)
+
+
+def parse_pid_stat(content):
+    """Split /proc/<pid>/stat into comm and the fields that follow it.
+
+    comm may contain spaces and parentheses, so it is delimited by the
+    first "(" and the last ")".
+    """
+    start = content.index('(')
+    end = content.rindex(')')
+    return content[start + 1:end], content[end + 2:].split()
+
+
+class CpuStatEngine(object):
+    """Per-core cpu usage from two consecutive /proc/stat samples."""
+
+    def __init__(self):
+        self.names = []
+        self._allocate(0)
+        self._has_baseline = False
+
+    def _allocate(self, rows):
+        self._prev = np.zeros((rows, NUM_FIELDS), dtype=np.int64)
+        self._now = np.zeros((rows, NUM_FIELDS), dtype=np.int64)
+        self._delta = np.zeros((rows, NUM_FIELDS), dtype=np.int64)
+        self._total = np.zeros(rows, dtype=np.int64)
+        self._percent = np.zeros((rows, NUM_FIELDS), dtype=np.float64)
+        self._cores = np.array([name != 'cpu' for name in self.names],
+                               dtype=bool)
+
+    def _load(self, plain_info):
+        """Load [name, values] rows of /proc/stat into the current matrix.
+
+        Returns False when the set of cpus changed (e.g. a core went
+        offline); the matrices are then reallocated and the current sample
+        becomes the new baseline.
+        """
+        names = []
+        values = []
+        for name, value in plain_info:
+            v = value.split()[:NUM_FIELDS]
+            if len(v) < NUM_FIELDS:
+                v = v + ['0'] * (NUM_FIELDS - len(v))  # needed for Linux 2.4
+            try:
+                values.append([int(field) for field in v])
+            except ValueError:
+                # The row is left out, which re-baselines like a cpu that
+                # went offline.
+                LOG.warning(_("Unexpected /proc/stat row: %(name)s "
+                              "%(value)s"), {'name': name, 'value': value})
+                continue
+            names.append(name.strip())
+        if names != self.names:
+            LOG.info(_("cpu layout changed to %d rows, resetting baseline"),
+                     len(names))
+            self.names = names
+            self._allocate(len(names))
+            self._has_baseline = False
+        self._now[:] = np.array(values, dtype=np.int64).reshape(
+            len(names), NUM_FIELDS)
+        return self._has_baseline
+
+    def set_baseline(self, plain_info):
+        self._load(plain_info)
+        self._prev[:] = self._now
+        self._has_baseline = True
+
+    def update(self, plain_info):
+        """Take a new sample and compute the usage since the previous one.
+
+        Returns False when there was no usable baseline yet.
+        """
+        if not self._load(plain_info):
+            self._prev[:] = self._now
+            self._total[:] = 0
+            self._percent[:] = 0.0
+            self._has_baseline = True
+            return False
+        np.subtract(self._now, self._prev, out=self._delta)
+        np.sum(self._delta[:, :NUM_TOTAL_FIELDS], axis=1, out=self._total)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.multiply(self._delta, 100.0, out=self._percent)
+            np.divide(self._percent, self._total[:, np.newaxis],
+                      out=self._percent)
+        self._percent[self._total == 0] = 0.0
+        np.round(self._percent, 2, out=self._percent)
+        self._prev, self._now = self._now, self._prev
+        return True
+
+    def get_cpuinfos(self):
+        """Return {cpu name: {field: percent}} of the last update."""
+        return dict((name, dict(zip(FIELDS, row)))
+                    for name, row in zip(self.names, self._percent.tolist()))
+
+    def get_jiffies_interval(self):
+        """Average jiffies elapsed per core (the "cpu" row is excluded)."""
+        if not self._cores.any():
+            return None
+        return float(self._total[self._cores].mean())
+
+
+class PidCpuSampler(object):
+    """User/system cpu usage of groups of pids.
+
+    Baselines are kept per group and keyed on (pid, starttime), so a pid
+    that is reused by a new process starts over instead of producing a
+    delta against its predecessor.  Every sample replaces the baselines of
+    its group, which evicts the pids that exited or were dropped from the
+    group; memory stays proportional to the pids sampled last time.
+    """
+
+    stat_path = '/proc/%s/stat'
+    # Whether cutime/cstime are counted; only meaningful for processes.
+    child_times = True
+
+    def __init__(self):
+        self._baselines = {}
+
+    def read_stat(self, pid):
+        """Return (comm, fields) of pid, or None if it has exited."""
+        try:
+            content = procfs.read_file(self.stat_path % pid)
+        except (IOError, OSError):
+            return None
+        return parse_pid_stat(content)
+
+    def sample(self, group, pids, jiffies_interval):
+        """Sample all pids of a group in one pass.
+
+        Returns {pid: {'user': %, 'system': %}} for the pids that already
+        had a baseline.  For processes the time of their reaped children
+        (cutime/cstime) is included.  The stat of a thread repeats the
+        child times of the whole process, so they are left out for tasks.
+        """
+        old = self._baselines.get(group, {})
+        new = {}
+        pid_cpu_infos = {}
+        for pid in pids:
+            stat = self.read_stat(pid)
+            if stat is None:
+                continue
+            fields = stat[1]
+            us_now = int(fields[STAT_UTIME])
+            sys_now = int(fields[STAT_STIME])
+            if self.child_times:
+                us_now += int(fields[STAT_CUTIME])
+                sys_now += int(fields[STAT_CSTIME])
+            new[pid] = (fields[STAT_STARTTIME], us_now, sys_now)
+            baseline = old.get(pid)
+            if baseline and baseline[0] == new[pid][0]:
+                pid_cpu_infos[pid] = self.get_pid_cpu_info(
+                    stat, us_now - baseline[1], sys_now - baseline[2],
+                    jiffies_interval)
+        self._baselines[group] = new
+        # A pid dropped from this group may still be read by another.
+        release_unused(self._baselines, set(old) - set(new), self.stat_path)
+        return pid_cpu_infos
+
+    def get_pid_cpu_info(self, stat, us_delta, sys_delta, jiffies_interval):
+        return {
+            "user": get_percent(us_delta, jiffies_interval),
+            "system": get_percent(sys_delta, jiffies_interval)
+        }
+
+    def forget(self, group):
+        release_unused(self._baselines, self._baselines.pop(group, {}),
+                       self.stat_path)
+
+    def get_pid_count(self):
+        return sum(len(b) for b in self._baselines.values())
+
+    @staticmethod
+    def aggregate(pid_cpu_infos):
+        """Sum the usage of several pids, as one group total."""
+        group_cpu_infos = {'user': 0.0, 'system': 0.0}
+        for pid_cpu_info in pid_cpu_infos.values():
+            group_cpu_infos['user'] += pid_cpu_info['user']
+            group_cpu_infos['system'] += pid_cpu_info['system']
+        return group_cpu_infos
+
+
+class TaskCpuSampler(PidCpuSampler):
+    """Per-thread cpu usage of one process, from /proc/<pid>/task/*/stat.
+
+    Besides user/system usage every thread reports the cpu it last ran on
+    (stat field 39), and threads can be summed by name pattern, e.g. all
+    "pmd*" threads of a DPDK ovs-vswitchd.
+    """
+
+    # Every thread reports the child times of the process.
+    child_times = False
+
+    def __init__(self, pid):
+        super(TaskCpuSampler, self).__init__()
+        self.pid = pid
+        self.task_dir = '/proc/%s/task' % pid
+        self.stat_path = self.task_dir + '/%s/stat'
+
+    def get_pid_cpu_info(self, stat, us_delta, sys_delta, jiffies_interval):
+        pid_cpu_info = super(TaskCpuSampler, self).get_pid_cpu_info(
+            stat, us_delta, sys_delta, jiffies_interval)
+        pid_cpu_info['name'] = stat[0]
+        pid_cpu_info['processor'] = int(stat[1][STAT_PROCESSOR])
+        return pid_cpu_info
+
+    def list_tasks(self):
+        try:
+            return os.listdir(self.task_dir)
+        except OSError:
+            return []
+
+    @staticmethod
+    def aggregate_by_name(task_cpu_infos, patterns):
+        """Sum thread usage per name pattern.
+
+        Returns {pattern: {'user', 'system', 'threads'}} for the patterns
+        that matched at least one thread.
+        """
+        group_cpu_infos = {}
+        for task_cpu_info in task_cpu_infos.values():
+            for pattern in patterns:
+                if fnmatch.fnmatchcase(task_cpu_info['name'], pattern):
+                    group = group_cpu_infos.setdefault(
+                        pattern, {'user': 0.0, 'system': 0.0, 'threads': 0})
+                    group['user'] += task_cpu_info['user']
+                    group['system'] += task_cpu_info['system']
+                    group['threads'] += 1
+                    break
+        return group_cpu_infos
+
+
+class SchedStatSampler(object):
+    """Run time and run-queue wait of threads, from their schedstat.
+
+    The kernel accounts both in nanoseconds per thread, so run is the
+    exact share of wall clock time a thread ran, not jiffies scaled by the
+    average jiffies_interval, and wait is the share it was runnable but
+    waiting for a cpu.  Baselines are kept per group and replaced by every
+    sample, like PidCpuSampler does.
+    """
+
+    def __init__(self):
+        self._baselines = {}
+        self._names = {}
+
+    def get_thread_names(self, pid):
+        """Return {tid: name} of the threads of pid.
+
+        Names are read once per thread.  As a thread may be renamed right
+        after it starts, all names of a process are read again whenever
+        its set of threads changes.
+        """
+        try:
+            tids = set(os.listdir('/proc/%s/task' % pid))
+        except OSError:
+            self._names.pop(pid, None)
+            return {}
+        names = self._names.get(pid, {})
+        if set(names) != tids:
+            names = {}
+            for tid in tids:
+                try:
+                    names[tid] = procfs.read_once(
+                        TASK_COMM_PATH % (pid, tid)).strip()
+                except (IOError, OSError):
+                    continue
+            self._names[pid] = names
+        return names
+
+    def forget_names(self, pids):
+        """Drop the thread names of the processes not in pids."""
+        for pid in set(self._names) - set(pids):
+            del self._names[pid]
+
+    def sample(self, group, tasks, now):
+        """Sample the schedstat of (pid, tid) tasks at monotonic time now.
+
+        Returns {(pid, tid): {'run': %, 'wait': %, 'timeslices': per sec,
+        'wait_per_slice': us}} for the tasks that already had a baseline.
+        """
+        old = self._baselines.get(group, {})
+        new = {}
+        sched_infos = {}
+        for task in tasks:
+            try:
+                content = procfs.read_file(SCHEDSTAT_PATH % task)
+            except (IOError, OSError):
+                continue
+            run_ns, wait_ns, slices = [int(x) for x in content.split()[:3]]
+            new[task] = (now, run_ns, wait_ns, slices)
+            baseline = old.get(task)
+            if not baseline or now <= baseline[0] or run_ns < baseline[1]:
+                # New, or a new thread that reuses the tid.
+                continue
+            elapsed_ns = (now - baseline[0]) * 1e9
+            run_delta = run_ns - baseline[1]
+            wait_delta = wait_ns - baseline[2]
+            slices_delta = slices - baseline[3]
+            sched_infos[task] = {
+                'run': get_percent(run_delta, elapsed_ns),
+                'wait': get_percent(wait_delta, elapsed_ns),
+                'timeslices': round(slices_delta * 1e9 / elapsed_ns, 2),
+                'wait_per_slice': (round(wait_delta / 1000.0 / slices_delta,
+                                         2) if slices_delta > 0 else 0.0),
+            }
+        self._baselines[group] = new
+        release_unused(self._baselines, set(old) - set(new), SCHEDSTAT_PATH)
+        return sched_infos
+
+
+class CpuFreq(object):
+    """Per-core frequency in MHz, refreshed every interval seconds.
+
+    scaling_cur_freq of cpufreq is read when the platform provides it;
+    otherwise "cpu MHz" of /proc/cpuinfo is parsed, which is much larger
+    to read and is why the result is cached between refreshes.
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.use_cpufreq = None
+        self.mhz = {}
+        self._refreshed_at = None
+
+    def get_mhz(self, cpu_names):
+        """Return {cpu name: MHz}; "cpu" holds the average of all cores."""
+        now = cutils.monotonic()
+        if (self._refreshed_at is None or
+                now - self._refreshed_at >= self.interval):
+            self._refreshed_at = now
+            self.refresh(cpu_names)
+        return self.mhz
+
+    def refresh(self, cpu_names):
+        cores = [name for name in cpu_names if name != 'cpu']
+        mhz = {}
+        if self.use_cpufreq is not False:
+            mhz = self.read_cpufreq(cores)
+            if self.use_cpufreq is None:
+                self.use_cpufreq = bool(mhz)
+                LOG.info(_("cpufreq is %savailable, reading core frequency "
+                           "from %s"), '' if mhz else 'not ',
+                         'sysfs' if mhz else CPUINFO_PATH)
+        if not self.use_cpufreq:
+            mhz = self.read_cpuinfo(cores)
+        if mhz:
+            mhz['cpu'] = round(sum(mhz.values()) / len(mhz), 2)
+        self.mhz = mhz
+
+    def read_cpufreq(self, cores):
+        mhz = {}
+        for name in cores:
+            try:
+                khz = int(procfs.read_file(CPUFREQ_PATH % name))
+            except (IOError, OSError, ValueError):
+                # Offline or without a cpufreq driver.
+                continue
+            mhz[name] = khz / 1000.0
+        return mhz
+
+    def read_cpuinfo(self, cores):
+        mhz = {}
+        processor = None
+        for line in procfs.read_lines(CPUINFO_PATH):
+            key, _sep, value = line.partition(':')
+            key = key.strip()
+            if key == CPUINFO_PROCESSOR:
+                processor = 'cpu%s' % value.strip()
+            elif key == CPUINFO_SPEED and processor is not None:
+                mhz[processor] = float(value)
+        return dict((name, mhz[name]) for name in cores if name in mhz)
@@ -1,26 +1,33 @@
 # vim: tabstop=4 shiftwidth=4 softtabstop=4
 
+import fnmatch
 import logging
 import os
-import re
 import time
 
+from check_mk_agent.agent.linux import blockdev
+from check_mk_agent.agent.linux import mounts
+from check_mk_agent.agent.linux import netdev
+from check_mk_agent.agent.linux import numa
+from check_mk_agent.agent.linux import perf_event
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.agent.linux import psi
+from check_mk_agent.agent.linux import rtnetlink
 from check_mk_agent.agent.linux import utils
+from check_mk_agent.common import counter
+from check_mk_agent.common import utils as cutils
 from check_mk_agent.devices import abstract_device
+from check_mk_agent.devices import cpustat
+from check_mk_agent.devices import irqstat
 
 LOG = logging.getLogger(__name__)
 
-CPU_SPEED = "cpu MHz"
 CPU_TOP = "Cpu(s)"
 
 STATE_RUNNING = 'running'
 STATE_DOWN = 'down'
 
-def get_percent(num, total):
-    if total == 0:
-        return 0
-    rc = float(num) / float(total) * 100;
-    return round(rc, 2)
+get_percent = cpustat.get_percent
 
 class Memory(abstract_device.AbstractDevice):
     """Memory device data collector.
@@ -31,10 +38,8 @@ class Memory(abstract_device.AbstractDevice):
     name = 'memory'
 
     def get_plain_info(self):
-        cmd = ['cat', '/proc/meminfo']
         plain_info = [line.split()
-                      for line in utils.execute(cmd).split('\n')
-                      if line]
+                      for line in procfs.read_lines('/proc/meminfo')]
         LOG.debug(_("plain_info: %s"), plain_info)
         return plain_info
 
@@ -81,47 +86,43 @@ class Cpu(abstract_device.AbstractDevice):
 
     name = 'cpu'
 
-    def __init__(self, dp_pid=None, qemu_pids=[], ksoftirqd_pids=[], vhost_pids=[]):
+    def __init__(self, dp_pid=None, qemu_pids=[], ksoftirqd_pids=[], vhost_pids=[],
+                 freq_interval=10):
         self.cpuinfos = {}
+        # False while cpuinfos are the zeros of a new baseline, e.g. after
+        # a cpu went on or offline.
+        self.has_baseline = False
+        self.engine = cpustat.CpuStatEngine()
+        self.freq = cpustat.CpuFreq(freq_interval)
+        self.pid_sampler = cpustat.PidCpuSampler()
+        self.task_sampler = None
+        self.softnet = irqstat.SoftnetStatEngine()
+        self.sched_sampler = cpustat.SchedStatSampler()
         self.init_device(None)
         super(Cpu, self).__init__()
 
+        self.dp_pid = dp_pid
         if dp_pid:
-            self.dp_pid = dp_pid
-            pid_plain_info = self.get_pid_plain_info(self.dp_pid)
-            self.parse_pid_plain_info(pid_plain_info, self.dp_pid)
+            self.pid_sampler.sample('dp', [dp_pid], self.jiffies_interval)
 
-        self.qemu_pids = qemu_pids
         LOG.info("Init monitor qemu pids: %s", qemu_pids)
-        for qemu_pid in qemu_pids:
-            qemu_pid_plain_info = self.get_pid_plain_info(qemu_pid)
-            self.parse_pid_plain_info(qemu_pid_plain_info, qemu_pid)
+        self.pid_sampler.sample('qemu', qemu_pids, self.jiffies_interval)
+        self.get_vcpu_sched_now(qemu_pids)
 
-        self.ksoftirqd_pids = ksoftirqd_pids
-        self.vhost_pids = vhost_pids
         LOG.info("Init monitor ksoftirqd_pids: %s, vhost_pids: %s", ksoftirqd_pids, vhost_pids)
-        for ksoftirqd_pid in ksoftirqd_pids:
-            ksoftirqd_pid_plain_info = self.get_pid_plain_info(ksoftirqd_pid)
-            self.parse_pid_plain_info(ksoftirqd_pid_plain_info, ksoftirqd_pid)
-        for vhost_pid in vhost_pids:
-            vhost_pid_plain_info = self.get_pid_plain_info(vhost_pid)
-            self.parse_pid_plain_info(vhost_pid_plain_info, vhost_pid)
+        self.pid_sampler.sample('ksoftirqd', ksoftirqd_pids, self.jiffies_interval)
+        self.pid_sampler.sample('vhost', vhost_pids, self.jiffies_interval)
+        if ksoftirqd_pids:
+            self.get_softnet_now()
 
     def get_plain_info(self):
         """Get plain info of cpu.
         In order of user, nice, system, idle, iowait,
         irq, softirq and steal
         """
-        cmd = ['cat', '/proc/stat']
-        plain_info = [line.split(' ', 1) 
-                      for line in utils.execute(cmd).split('\n')
-                      if line and line.find('cpu') != -1]
-
-        speed_cmd = ['cat', '/proc/cpuinfo']
-        speed_info = [line.split(':')
-                      for line in utils.execute(speed_cmd).split('\n')
-                      if line and line.find(CPU_SPEED) != -1]
-        plain_info.extend(speed_info)
+        plain_info = [line.split(' ', 1)
+                      for line in procfs.read_lines('/proc/stat')
+                      if line.find('cpu') != -1]
 
         #top_cmd = ['top', '-d', '1', '-n', '1', '-b']
         #top_info = [line.split(':')
@@ -130,181 +131,127 @@ class Cpu(abstract_device.AbstractDevice):
         #plain_info.extend(top_info) 
         return plain_info
 
-    def get_pid_plain_info(self, pid):
-        """Get process plain info of cpu.
-
-        In order of user, nice, system, idle, iowait,
-        irq, softirq and steal
-        """
-        stat_file = "/proc/%s/stat" % pid
-        cmd = ['cat', stat_file]
-        plain_info = [line.split(' ') 
-                      for line in utils.execute(cmd).split('\n')]
-
-        LOG.debug("%s pid plain_info: %s", pid, plain_info)
-        return plain_info
+    def split_plain_info(self, plain_info):
+        """Get the /proc/stat cpu rows of plain info."""
+        return [(key.strip(), value) for key, value in plain_info
+                if not key.strip().find('cpu')]
 
-    def parse_pid_plain_info(self, plain_info, pid):
-        cpu_line = plain_info[0]
-        self.pid_us[pid] = float(cpu_line[13])
-        self.pid_sys[pid] = float(cpu_line[14])
-        self.pid_cus[pid] = float(cpu_line[15])
-        self.pid_csys[pid] = float(cpu_line[16])
-
-    def parse_pid_plain_info_now(self, plain_info, pid):
-        cpu_line = plain_info[0]
-        us_now = float(cpu_line[13])
-        sys_now = float(cpu_line[14])
-        cus_now = float(cpu_line[15])
-        csys_now = float(cpu_line[16])
-
-        us_delta = us_now + cus_now - self.pid_us[pid] - self.pid_cus[pid]
-        sys_delta = sys_now + csys_now - self.pid_sys[pid] - self.pid_csys[pid]
-
-        pid_cpu_infos = {
-            "user": get_percent(us_delta, self.jiffies_interval),
-            "system": get_percent(sys_delta, self.jiffies_interval)
-        }
-
-        self.pid_us[pid] = us_now
-        self.pid_sys[pid] = sys_now
-        self.pid_cus[pid] = cus_now
-        self.pid_sys[pid] = sys_now
-
-        return pid_cpu_infos
+    def update_speed(self):
+        """Add the per-core MHz to cpuinfos; speed is their average."""
+        mhz = self.freq.get_mhz(self.engine.names)
+        for key, cpuinfo in self.cpuinfos.items():
+            if key in mhz:
+                cpuinfo['mhz'] = mhz[key]
+        if 'cpu' in mhz:
+            self.speed = mhz['cpu']
 
     def parse_plain_info(self, plain_info):
-        cpuinfo = dict([(i[0].strip(), i[1].strip()) for i in plain_info ])
-        LOG.debug(_("cpu_info: %s"), cpuinfo)
-        self.count = len(cpuinfo) - 1
-        for key, value in cpuinfo.items():
-            if key == CPU_SPEED:
-                self.speed = float(value)
-            elif not key.find('cpu'):
-                v = [float(x) for x in value.split()]
-                if len(v) < 8:
-                    v = v + [0, 0, 0, 0]  # needed for Linux 2.4
-                self.user[key] = v[0]
-                self.nice[key] = v[1]
-                self.system[key] = v[2]
-                self.idle[key] = v[3]
-                self.iowait[key] = v[4]
-                self.irq[key] = v[5]
-                self.softirq[key] = v[6]
-                self.steal[key] = v[7]
-                self.total[key] = sum(v[0:7])
+        LOG.debug(_("cpu_info: %s"), plain_info)
+        stat_info = self.split_plain_info(plain_info)
+        self.count = len(stat_info)
+        self.engine.set_baseline(stat_info)
+        self.update_speed()
 
     def parse_plain_info_now(self, plain_info):
-        cpuinfo = dict([(i[0].strip(), i[1].strip()) for i in plain_info ])
-        LOG.debug(_("now cpu_info: %s"), cpuinfo)
-        self.count = len(cpuinfo) - 1
-        jiff_count = 0;
-        jiff_total = 0;
-        for key, value in cpuinfo.items():
-            if key == CPU_SPEED:
-                self.speed = float(value)
-            elif not key.find('cpu'):
-                v = [float(x) for x in value.split()]
-                if len(v) < 8:
-                    v = v + [0, 0, 0, 0]  # needed for Linux 2.4
-                self.user_now[key] = v[0]
-                self.nice_now[key] = v[1]
-                self.system_now[key] = v[2]
-                self.idle_now[key] = v[3]
-                self.iowait_now[key] = v[4]
-                self.irq_now[key] = v[5]
-                self.softirq_now[key] = v[6]
-                self.steal_now[key] = v[7]
-                self.total_now[key] = sum(v[0:7])
-
-                user_delta = self.user_now[key] - self.user[key]
-                nice_delta = self.nice_now[key] - self.nice[key]
-                system_delta = self.system_now[key] - self.system[key]
-                idle_delta = self.idle_now[key] - self.idle[key]
-                iowait_delta = self.iowait_now[key] - self.iowait[key]
-                irq_delta = self.irq_now[key] - self.irq[key]
-                softirq_delta = self.softirq_now[key] - self.softirq[key]
-                steal_delta = self.steal_now[key] - self.steal[key]
-                total_delta = self.total_now[key] - self.total[key]
-
-                self.cpuinfos[key] = {
-                    'user':    get_percent(user_delta, total_delta),
-                    'system':  get_percent(system_delta, total_delta),
-                    'nice':    get_percent(nice_delta, total_delta),
-                    'idle':    get_percent(idle_delta, total_delta),
-                    'iowait':  get_percent(iowait_delta, total_delta),
-                    'hardirq': get_percent(irq_delta, total_delta),
-                    'softirq': get_percent(softirq_delta, total_delta),
-                    'steal':   get_percent(steal_delta, total_delta),
-                }
-
-                if key != "cpu":
-                    jiff_count += 1
-                    jiff_total += float(total_delta)
-
-                self.user[key] = self.user_now[key]
-                self.nice[key] = self.nice_now[key]
-                self.system[key] = self.system_now[key]
-                self.idle[key] = self.idle_now[key]
-                self.iowait[key] = self.iowait_now[key]
-                self.irq[key] = self.irq_now[key]
-                self.softirq[key] = self.softirq_now[key]
-                self.steal[key] = self.steal_now[key]
-                self.total[key] = self.total_now[key]
-        if jiff_count:
-            self.jiffies_interval = jiff_total / jiff_count
+        LOG.debug(_("now cpu_info: %s"), plain_info)
+        stat_info = self.split_plain_info(plain_info)
+        self.count = len(stat_info)
+        self.has_baseline = self.engine.update(stat_info)
+        self.cpuinfos = self.engine.get_cpuinfos()
+        self.update_speed()
+        jiffies_interval = self.engine.get_jiffies_interval()
+        if jiffies_interval:
+            self.jiffies_interval = jiffies_interval
         return self.cpuinfos
 
     def get_cpu_now(self):
         plain_info = self.get_plain_info()
         return self.parse_plain_info_now(plain_info)
 
+    def update(self):
+        # The first sample was the baseline, the next ones give the usage.
+        self.get_cpu_now()
+
     def get_dp_cpu_now(self):
-        pid_plain_info = self.get_pid_plain_info(self.dp_pid)
+        pid_cpu_infos = self.pid_sampler.sample('dp', [self.dp_pid],
+                                                self.jiffies_interval)
         dp_pid_cpuinfos = {}
-        dp_pid_cpuinfos["dp_process_cpu"] = self.parse_pid_plain_info_now(pid_plain_info, self.dp_pid)
+        if self.dp_pid in pid_cpu_infos:
+            dp_pid_cpuinfos["dp_process_cpu"] = pid_cpu_infos[self.dp_pid]
         return dp_pid_cpuinfos
 
+    def get_dp_thread_cpu_now(self, patterns):
+        """Get cpu usage of every dp thread and of thread name patterns.
+
+        Threads are reported as dp_thread_<name>_<tid> and pattern sums as
+        dp_threads_<pattern>, with the glob characters stripped.  Threads
+        also get the run, wait, timeslices and wait_per_slice of their
+        schedstat.
+        """
+        if self.task_sampler is None:
+            self.task_sampler = cpustat.TaskCpuSampler(self.dp_pid)
+        tids = self.task_sampler.list_tasks()
+        task_cpu_infos = self.task_sampler.sample('tasks', tids,
+                                                  self.jiffies_interval)
+        sched_infos = self.sched_sampler.sample(
+            'dp', [(self.dp_pid, tid) for tid in tids], cutils.monotonic())
+        dp_thread_cpuinfos = {}
+        for tid, task_cpu_info in task_cpu_infos.items():
+            thread_key = "dp_thread_%s_%s" % (task_cpu_info['name'], tid)
+            dp_thread_cpuinfos[thread_key] = {
+                'user': task_cpu_info['user'],
+                'system': task_cpu_info['system'],
+                'processor': task_cpu_info['processor'],
+            }
+            sched_info = sched_infos.get((self.dp_pid, tid))
+            if sched_info:
+                dp_thread_cpuinfos[thread_key].update(sched_info)
+        groups = self.task_sampler.aggregate_by_name(task_cpu_infos, patterns)
+        for pattern, group_cpu_infos in groups.items():
+            group_key = "dp_threads_%s" % pattern.strip('*?')
+            dp_thread_cpuinfos[group_key] = group_cpu_infos
+        return dp_thread_cpuinfos
+
+    def get_group_cpu_now(self, group, pids):
+        """Get the summed cpu usage of a group of pids.
+
+        Pids seen for the first time are baselined and counted from the
+        next call on.
+        """
+        pid_cpu_infos = self.pid_sampler.sample(group, pids,
+                                                self.jiffies_interval)
+        if not pid_cpu_infos:
+            return None
+        return self.pid_sampler.aggregate(pid_cpu_infos)
+
+    def get_softnet_now(self):
+        """Get the NET_RX processed, dropped and time_squeeze rates.
+
+        Returns ({cpu name: {field: rate}}, {field: total rate}), or None
+        if /proc/net/softnet_stat can not be read.
+        """
+        try:
+            lines = procfs.read_lines(irqstat.SOFTNET_STAT_PATH)
+        except (IOError, OSError) as e:
+            LOG.debug(_("Failed to read softnet_stat: %s"), e)
+            return None
+        self.softnet.update(lines, cutils.monotonic())
+        return self.softnet.get_softnet_infos()
+
     def get_ovs_kernel_cpu_now(self, ksoftirqd_pids, vhost_pids):
-        ovs_cpu_infos = {}
+        """Get the ksoftirqd and vhost cpu usage.
 
-        init_ksoftirqd_pids = list(set(ksoftirqd_pids) - set(self.ksoftirqd_pids))
-        monitor_ksoftirqd_pids = list(set(ksoftirqd_pids) - set(init_ksoftirqd_pids))
-        if init_ksoftirqd_pids:
-            LOG.info("Init monitor ksoftirqd pids: %s", init_ksoftirqd_pids)
-            for ksoftirqd_pid in init_ksoftirqd_pids:
-                ksoftirqd_pid_plain_info = self.get_pid_plain_info(ksoftirqd_pid)
-                self.parse_pid_plain_info(ksoftirqd_pid_plain_info, ksoftirqd_pid)
-        if monitor_ksoftirqd_pids:
-            ksoftirqd_cpu_infos = {}
-            ovs_cpu_infos['ksoftirqd'] = {}
-            ovs_cpu_infos['ksoftirqd']['user'] = 0.0
-            ovs_cpu_infos['ksoftirqd']['system'] = 0.0
-            for ksoftirqd_pid in monitor_ksoftirqd_pids:
-                ksoftirqd_pid_plain_info = self.get_pid_plain_info(ksoftirqd_pid)
-                ksoftirqd_cpu_infos[ksoftirqd_pid] = self.parse_pid_plain_info_now(ksoftirqd_pid_plain_info, ksoftirqd_pid)
-            for ksoftirqd_pid in monitor_ksoftirqd_pids:
-                ovs_cpu_infos['ksoftirqd']['user'] += ksoftirqd_cpu_infos[ksoftirqd_pid]['user']
-                ovs_cpu_infos['ksoftirqd']['system'] += ksoftirqd_cpu_infos[ksoftirqd_pid]['system']
-
-        init_vhost_pids = list(set(vhost_pids) - set(self.vhost_pids))
-        monitor_vhost_pids = list(set(vhost_pids) - set(init_vhost_pids))
-        if init_vhost_pids:
-            LOG.info("Init monitor vhost pids: %s", init_vhost_pids)
-            for vhost_pid in init_vhost_pids:
-                vhost_pid_plain_info = self.get_pid_plain_info(vhost_pid)
-                self.parse_pid_plain_info(vhost_pid_plain_info, vhost_pid)
-        if monitor_vhost_pids:
-            vhost_cpu_infos = {}
-            ovs_cpu_infos['vhost'] = {}
-            ovs_cpu_infos['vhost']['user'] = 0.0
-            ovs_cpu_infos['vhost']['system'] = 0.0
-            for vhost_pid in monitor_vhost_pids:
-                vhost_pid_plain_info = self.get_pid_plain_info(vhost_pid)
-                vhost_cpu_infos[vhost_pid] = self.parse_pid_plain_info_now(vhost_pid_plain_info, vhost_pid)
-            for vhost_pid in monitor_vhost_pids:
-                ovs_cpu_infos['vhost']['user'] += vhost_cpu_infos[vhost_pid]['user']
-                ovs_cpu_infos['vhost']['system'] += vhost_cpu_infos[vhost_pid]['system']
+        The NET_RX rates of softnet_stat are added as softnet (all cpus)
+        and softnet_<cpu name>, so drops and time squeezes can be matched
+        with the ksoftirqd usage.
+        """
+        ovs_cpu_infos = {}
+        ksoftirqd_cpu_infos = self.get_group_cpu_now('ksoftirqd', ksoftirqd_pids)
+        if ksoftirqd_cpu_infos:
+            ovs_cpu_infos['ksoftirqd'] = ksoftirqd_cpu_infos
+        vhost_cpu_infos = self.get_group_cpu_now('vhost', vhost_pids)
+        if vhost_cpu_infos:
+            ovs_cpu_infos['vhost'] = vhost_cpu_infos
 
         user_total = 0.0
         system_total = 0.0
@@ -316,24 +263,59 @@ class Cpu(abstract_device.AbstractDevice):
         ovs_cpu_infos['ovs-kernel']['user'] = user_total
         ovs_cpu_infos['ovs-kernel']['system'] = system_total
 
+        softnet_infos = self.get_softnet_now()
+        if softnet_infos:
+            cpu_infos, totals = softnet_infos
+            for cpu, cpu_info in cpu_infos.items():
+                ovs_cpu_infos['softnet_%s' % cpu] = cpu_info
+            ovs_cpu_infos['softnet'] = totals
+
         return ovs_cpu_infos
 
+    def get_vcpu_sched_now(self, qemu_pids):
+        """Get the schedstat of the vCPU threads of qemu processes.
+
+        Returns {(qemu pid, vcpu index): sched info}; wait is the share of
+        time the vCPU was runnable but not running.
+        """
+        vcpus = {}
+        for qemu_pid in qemu_pids:
+            names = self.sched_sampler.get_thread_names(qemu_pid)
+            for tid, name in names.items():
+                if fnmatch.fnmatchcase(name, cpustat.VCPU_THREAD_PATTERN):
+                    vcpus[(qemu_pid, tid)] = name.split()[1].split('/')[0]
+        self.sched_sampler.forget_names(qemu_pids)
+        sched_infos = self.sched_sampler.sample('vcpu', vcpus,
+                                                cutils.monotonic())
+        return dict(((task[0], vcpus[task]), sched_info)
+                    for task, sched_info in sched_infos.items())
+
     def get_qemu_cpu_now(self, qemu_pids):
-        init_qemu_pids = list(set(qemu_pids) - set(self.qemu_pids))
-        monitor_qemu_pids = list(set(qemu_pids) - set(init_qemu_pids))
-        if init_qemu_pids:
-            LOG.info("Init monitor qemu pids: %s", qemu_pids)
-            for qemu_pid in init_qemu_pids:
-                qemu_pid_plain_info = self.get_pid_plain_info(qemu_pid)
-                self.parse_pid_plain_info(qemu_pid_plain_info, qemu_pid)
+        """Get the cpu usage of qemu processes as qemu_<pid> and the
+        schedstat of their vCPU threads as qemu_<pid>_vcpu<index>."""
+        pid_cpu_infos = self.pid_sampler.sample('qemu', qemu_pids,
+                                                self.jiffies_interval)
         qemu_cpu_infos = {}
-        if monitor_qemu_pids:
-            for qemu_pid in monitor_qemu_pids:
-                qemu_pid_plain_info = self.get_pid_plain_info(qemu_pid)
-                qemu_cpu_key = "qemu_%s" % qemu_pid
-                qemu_cpu_infos[qemu_cpu_key] = self.parse_pid_plain_info_now(qemu_pid_plain_info, qemu_pid)
+        for qemu_pid, pid_cpu_info in pid_cpu_infos.items():
+            qemu_cpu_key = "qemu_%s" % qemu_pid
+            qemu_cpu_infos[qemu_cpu_key] = pid_cpu_info
+        vcpu_sched_infos = self.get_vcpu_sched_now(qemu_pids)
+        for (qemu_pid, vcpu), sched_info in vcpu_sched_infos.items():
+            qemu_cpu_infos["qemu_%s_vcpu%s" % (qemu_pid, vcpu)] = sched_info
         return qemu_cpu_infos
 
+    def get_process_cpu_now(self, groups):
+        """Get the cpu usage of extra process groups.
+
+        :param groups: dict of group name to its list of pids
+        """
+        process_cpu_infos = {}
+        for group, pids in groups.items():
+            group_cpu_infos = self.get_group_cpu_now(group, pids)
+            if group_cpu_infos:
+                process_cpu_infos[group] = group_cpu_infos
+        return process_cpu_infos
+
     def get_jiffies_interval(self):
         return self.jiffies_interval
 
@@ -344,41 +326,8 @@ class Cpu(abstract_device.AbstractDevice):
         self.jiffies_interval = 100
 
         self.count = {}
-        self.user = {}
-        self.nice = {}
-        self.system = {}
-        self.idle = {}
-        self.iowait = {}
-        self.irq = {}
-        self.softirq = {}
-        self.steal = {}
-        self.total = {}
-        self.userHz = {}
         self.speed = {}
 
-        self.count_now = {}
-        self.user_now = {}
-        self.nice_now = {}
-        self.system_now = {}
-        self.idle_now = {}
-        self.iowait_now = {}
-        self.irq_now = {}
-        self.softirq_now = {}
-        self.steal_now = {}
-        self.total_now = {}
-        self.userHz_now = {}
-        self.speed_now = {}
-
-        self.pid_us = {}
-        self.pid_sys = {}
-        self.pid_cus = {}
-        self.pid_csys = {}
-
-        self.pid_us_now = {}
-        self.pid_sys_now = {}
-        self.pid_cus_now = {}
-        self.pid_csys_now = {}
-
 
 class System(abstract_device.AbstractDevice):
     """System device data collector."""
@@ -386,10 +335,8 @@ class System(abstract_device.AbstractDevice):
     name = 'system'
     def get_plain_info(self):
         """Get plain info of system."""
-        cmd = ['cat', '/proc/uptime']
-        plain_info = [line.split(' ', 1) 
-                      for line in utils.execute(cmd).split('\n')
-                      if line]
+        plain_info = [line.split(' ', 1)
+                      for line in procfs.read_lines('/proc/uptime')]
         return plain_info
 
     def parse_plain_info(self, plain_info):
@@ -408,56 +355,46 @@ class Disks(abstract_device.AbstractDevice):
     """Disk device data collector.
 
     readTput, writeTput are in units of bytes/sec,
-    latency is in units of milliseconds,
-    total is in units of MB"""
+    readIos, writeIos, iops are in units of IOs/sec,
+    latency is in units of milliseconds spent doing IO per sec,
+    total is in units of MB.  Rates are None on the first sample of a disk.
+    """
 
     name = 'disks'
-    def find_diskstat_value(self, mapping_disk, major, minor):
-        for k, v in mapping_disk.items():
-            if mapping_disk[k][0] == major and mapping_disk[k][1] == minor:
-                return mapping_disk[k]
-        return [0] * 14
+
+    # diskstats counts 512 byte sectors, whatever the device block size.
+    SECTOR_SIZE = 512
+    # reads, sectors read, ms reading, writes, sectors written, ms writing
+    RATE_COLUMNS = (3, 5, 6, 7, 9, 10)
+
+    def __init__(self, device_dict=None, rates=None):
+        self.rates = rates if rates is not None else counter.CounterRate()
+        super(Disks, self).__init__(device_dict)
 
     def get_plain_info(self):
         """Get plain info of system."""
-        # Get df info
-        excludefs="-x smbfs -x tmpfs -x devtmpfs -x cifs -x iso9660 -x udf -x nfsv4 -x nfs -x mvfs -x zfs"
-        df_cmd = ['df', '-PTlm'] + excludefs.split()
-        df_info = [line.split() 
-                   for line in utils.execute(df_cmd).split('\n')
-                   if line]
-        del df_info[0]
-        mapping_df = {}
-        for line in df_info:
-            if os.path.islink(line[0]):
-                realpath = os.path.realpath(line[0])
-                line[0] = os.path.basename(realpath)
-            else:
-                line[0] = os.path.basename(line[0])
-            mapping_df[line[0]] = line
-        LOG.debug(_("mapping_df: %s\n"), mapping_df)
-
-        # Get diskstat info
-        disk_cmd = ['cat', '/proc/diskstats']
-        p = re.compile('x?[shv]d[a-z]*|cciss/c[0-9]+d[0-9]+|emcpower[a-z]+|dm-[0-9]+|VxVM.*')
-        disk_info = [line.split() 
-                     for line in utils.execute(disk_cmd).split('\n')
-                     if line and p.search(line)]
-        mapping_disk = {}
-        for line in disk_info:
-            mapping_disk[line[2]] = map(lambda x: int(x), line[:2]+line[3:14])
-            mapping_disk[line[2]].insert(2, line[2])
-        LOG.debug(_("mapping_disk: %s\n"), mapping_disk)
+        disk_stats = blockdev.get_disk_stats()
+        disk_stats.refresh(procfs.read_lines('/proc/diskstats'))
+        self._rate_time = cutils.monotonic()
 
         mapping_info = {}
-        for k, v in mapping_disk.items():
-            if k in mapping_df.keys():
-                if mapping_disk[k][1] != 0:
-                # Find the Main dev whose minor number is zero
-                    diskstat_value = self.find_diskstat_value(mapping_disk, mapping_disk[k][0], 0)
-                else:
-                    diskstat_value = mapping_disk[k]
-                mapping_info[k] = diskstat_value + mapping_df[k]
+        for mount in mounts.get_mounts():
+            # Partitions are reported with the stats of their main disk.
+            diskstat_value = disk_stats.get_disk_row(mount.major, mount.minor)
+            if diskstat_value is None:
+                continue
+            try:
+                capacity = mounts.get_capacity(mount)
+            except OSError as e:
+                LOG.debug(_("statvfs %(mount)s failed: %(err)s"),
+                          {'mount': mount.mountpoint, 'err': e})
+                continue
+            if capacity is None:
+                continue
+            size, used, avail, percent = capacity
+            df_value = [mount.name, mount.fstype, size, used, avail,
+                        '%d%%' % percent, mount.mountpoint]
+            mapping_info[mount.name] = diskstat_value + df_value
         LOG.debug(_("mapping_info: %s\n"), mapping_info)
         return mapping_info
 
@@ -467,24 +404,35 @@ class Disks(abstract_device.AbstractDevice):
         self.disks = []
         for name, v in plain_info.items():
             disk = {'name': name}
+            rates = self.rates.rates(name, [v[i] for i in self.RATE_COLUMNS],
+                                     self._rate_time)
+            if rates is None:
+                rates = [None] * len(self.RATE_COLUMNS)
+                read_tput = write_tput = iops = io_latency = None
+            else:
+                read_tput = rates[1] * self.SECTOR_SIZE
+                write_tput = rates[4] * self.SECTOR_SIZE
+                iops = rates[0] + rates[3]
+                io_latency = rates[2] + rates[5]
             # bytes per sec
-            disk['readTput'] = v[5] 
-            disk['writeTput'] =  v[9]
+            disk['readTput'] = read_tput
+            disk['writeTput'] = write_tput
             # number per sec
-            disk['readIos'] = v[3]
-            disk['writeIos'] = v[7]
-            disk['iops'] = v[3] + v[7]
+            disk['readIos'] = rates[0]
+            disk['writeIos'] = rates[3]
+            disk['iops'] = iops
             # TODO(belin)right now latency is just like iostat's await
             # IO latency per sec
-            disk['readLatency'] = v[6]
-            disk['writeLatency'] = v[10]
-            disk['ioLatency'] = v[6] + v[10]
+            disk['readLatency'] = rates[2]
+            disk['writeLatency'] = rates[5]
+            disk['ioLatency'] = io_latency
             # the total ticks doing IO operations,if 100% of util would lead
             # to device saturation
             #disk['ioTotalTicks'] = v[12]
             disk['capacity'] = int(v[16])
             disk['usage'] = int(v[19][:-1])
             self.disks.append(disk)
+        self.rates.retain(plain_info)
         
     def get_device_dict(self):
             return {'count': self.count,
@@ -511,50 +459,81 @@ class Disks(abstract_device.AbstractDevice):
 class Nets(abstract_device.AbstractDevice):
     """net devices data collector.
 
-    inOctets, outOctets, tput are in units of Bytes"""
+    inOctets, outOctets, tput are in units of Bytes/sec, the packet rates
+    in packets/sec, None on the first sample of an interface,
+    intfErrs is the cumulative error count,
+    bandwidth is the link speed in Mbits/sec"""
 
     name = 'nets'
 
+    # rx bytes, rx packets, rx multicast, tx bytes, tx packets
+    RATE_COLUMNS = (0, 1, 7, 8, 9)
+
+    def __init__(self, device_dict=None, attr_interval=30, backend='procfs',
+                 rates=None):
+        self.attr_interval = attr_interval
+        self.backend = backend
+        self.rates = rates if rates is not None else counter.CounterRate()
+        super(Nets, self).__init__(device_dict)
+
     def get_plain_info(self):
-        cmd = ['cat', '/proc/net/dev']
-        plain_info = [line.split(':')
-                      for line in utils.execute(cmd).split('\n')
-                      if line]
-        del plain_info[:2]
+        """Get {interface name: link} where link['stats'] holds the
+        /proc/net/dev columns.
+
+        Links from the netlink backend also carry carrier, operstate and
+        mtu.
+        """
+        if self.backend == 'netlink':
+            dumper = rtnetlink.get_link_dumper()
+            if dumper:
+                plain_info = dumper.dump()
+                self._rate_time = cutils.monotonic()
+                LOG.debug(_("plain_info: %s"), plain_info)
+                return plain_info
+        lines = procfs.read_lines('/proc/net/dev')
+        self._rate_time = cutils.monotonic()
+        plain_info = {}
+        for line in lines[2:]:
+            k, v = line.split(':', 1)
+            plain_info[k.strip()] = {'stats': [int(x) for x in v.split()]}
         LOG.debug(_("plain_info: %s"), plain_info)
         return plain_info
 
     def parse_plain_info(self, plain_info):
-        netinfo = {}
-        for line in plain_info:
-            k = line[0].strip()
-            v = line[1]
-            netinfo[k] = map(lambda x: int(x), v.split())
-            netstat = 'cat /sys/class/net/' + k +'/carrier'
-            netcmd = netstat.split(' ')
-            try:
-                output = int(utils.execute(netcmd))
-            except Exception:
-                output = 0
-            if output:
-                netinfo[k].append(1)
-            else:
-                netinfo[k].append(0)
+        # Without IFLA_CARRIER from netlink, carrier is read from sysfs.
+        with_carrier = all(link.get('carrier') is not None
+                           for link in plain_info.values())
+        interface_attrs = netdev.get_interface_attrs(self.attr_interval)
+        attrs = interface_attrs.refresh(list(plain_info),
+                                        read_carrier=not with_carrier)
         self.nets = []
-        for name, v in netinfo.items():
+        for name, link in plain_info.items():
+            v = link['stats']
+            attr = dict(attrs[name])
+            attr.update((key, value) for key, value in link.items()
+                        if value is not None)
+            rates = self.rates.rates(name, [v[i] for i in self.RATE_COLUMNS],
+                                     self._rate_time)
             net = {}
             net['name'] = name
-            net['inOctets'] = v[0]
-            net['outOctets'] = v[8]
+            if rates is None:
+                net['inOctets'] = net['outOctets'] = net['tput'] = None
+                net['pktInRate'] = net['pktOutRate'] = net['pktRate'] = None
+            else:
+                net['inOctets'] = rates[0]
+                net['outOctets'] = rates[3]
+                net['tput'] = rates[0] + rates[3]
+                net['pktInRate'] = rates[1]
+                net['pktOutRate'] = rates[4]
+                net['pktRate'] = rates[1] + rates[2] + rates[4]
             net['intfErrs'] = v[2] + v[10]
-            net['intfState'] = v[16]
-            net['tput'] = v[0] + v[8]
-            net['pktInRate'] = v[1]
-            net['pktOutRate'] = v[9]
-            net['pktRate'] = v[1] + v[7] + v[9]
-            #TODO(berlin): It seems that perf can test the bandwidth
-            net['bandwidth'] = None
+            net['intfState'] = 1 if attr['carrier'] else 0
+            net['operState'] = attr['operstate']
+            net['mtu'] = attr['mtu']
+            # Link speed in Mbits/sec, None when the driver does not know it.
+            net['bandwidth'] = attr['speed'] if attr['speed'] > 0 else None
             self.nets.append(net)
+        self.rates.retain(plain_info)
 
     def get_device_dict(self):
         return {'nets': self.nets}
@@ -574,3 +553,206 @@ class Nets(abstract_device.AbstractDevice):
                 data = _("%(timestamp)d %(value)s\n" % {'timestamp': timestamp,
                                                   'value': v})
                 utils.write_file(file_name, data)  
+
+
+class Interrupts(abstract_device.AbstractDevice):
+    """Per-cpu interrupt data collector.
+
+    Every selected row of /proc/interrupts is reported as
+    {'total': rate, 'cpu0': rate, ...} in interrupts/sec, all 0 on the
+    first sample.
+    """
+
+    name = 'interrupts'
+    path = irqstat.INTERRUPTS_PATH
+
+    def __init__(self, device_dict=None, patterns=None):
+        self.engine = irqstat.IrqStatEngine(patterns)
+        super(Interrupts, self).__init__(device_dict)
+
+    def get_plain_info(self):
+        plain_info = procfs.read_lines(self.path)
+        self._rate_time = cutils.monotonic()
+        return plain_info
+
+    def parse_plain_info(self, plain_info):
+        self.engine.update(plain_info, self._rate_time)
+        self.irqinfos = self.engine.get_irqinfos()
+
+    def get_device_dict(self):
+        return self.irqinfos
+
+    def init_device(self, device_dict):
+        self.irqinfos = device_dict
+
+
+class Softirqs(Interrupts):
+    """Per-cpu softirq data collector, rows of /proc/softirqs such as
+    NET_RX and NET_TX in softirqs/sec."""
+
+    name = 'softirqs'
+    path = irqstat.SOFTIRQS_PATH
+
+
+class Pressure(abstract_device.AbstractDevice):
+    """Pressure stall information collector.
+
+    Host pressure is reported under cpu, memory and io, that of the cgroup
+    of every qemu process under qemu_<pid>_<resource>.  avg10, avg60 are
+    in percents of time stalled, stall is in microseconds stalled since
+    the previous sample, for both some and full.
+    """
+
+    name = 'pressure'
+
+    def __init__(self, device_dict=None, qemu_pids=None):
+        self.reader = psi.PressureReader()
+        self.qemu_pids = list(qemu_pids or [])
+        super(Pressure, self).__init__(device_dict)
+
+    def set_qemu_pids(self, qemu_pids):
+        self.qemu_pids = list(qemu_pids)
+
+    def get_plain_info(self):
+        plain_info = {'host': self.reader.read_host(), 'qemu': {}}
+        for qemu_pid in self.qemu_pids:
+            # Looked up every time, libvirt moves qemu into the machine
+            # scope after it started.
+            cgroup = psi.get_process_cgroup(qemu_pid)
+            if cgroup:
+                plain_info['qemu'][qemu_pid] = self.reader.read_cgroup(cgroup)
+        self.reader.sweep()
+        LOG.debug(_("plain_info: %s"), plain_info)
+        return plain_info
+
+    def parse_plain_info(self, plain_info):
+        self.pressure = dict(plain_info['host'])
+        for qemu_pid, infos in plain_info['qemu'].items():
+            for resource, info in infos.items():
+                self.pressure['qemu_%s_%s' % (qemu_pid, resource)] = info
+
+    def get_device_dict(self):
+        return self.pressure
+
+    def init_device(self, device_dict):
+        self.pressure = device_dict
+
+
+class Numa(abstract_device.AbstractDevice):
+    """NUMA node memory data collector.
+
+    Every online node is reported as node<N>.  Memory is in units of KB,
+    the numastat counters (numa_hit, numa_miss ...) in pages/sec, None on
+    the first sample, and hugepages_<size>_total/free/surplus in pages.
+    """
+
+    name = 'numa'
+
+    # node meminfo key: output name
+    MEMINFO_KEYS = (('MemTotal', 'total'), ('MemFree', 'free'),
+                    ('MemUsed', 'used'), ('Active', 'active'),
+                    ('Inactive', 'inactive'), ('FilePages', 'filePages'),
+                    ('AnonPages', 'anonPages'), ('Slab', 'slab'))
+    NUMASTAT_KEYS = ('numa_hit', 'numa_miss', 'numa_foreign',
+                     'interleave_hit', 'local_node', 'other_node')
+
+    def __init__(self, device_dict=None):
+        self.reader = numa.NodeReader()
+        self.rates = counter.CounterRate()
+        super(Numa, self).__init__(device_dict)
+
+    def get_plain_info(self):
+        """Get {node: (meminfo, numastat, hugepages)}."""
+        plain_info = {}
+        for node in self.reader.get_nodes():
+            try:
+                plain_info[node] = (self.reader.read_meminfo(node),
+                                    self.reader.read_numastat(node),
+                                    self.reader.read_hugepages(node))
+            except (IOError, OSError) as e:
+                LOG.debug(_("Failed to read node%(node)d: %(err)s"),
+                          {'node': node, 'err': e})
+        self._rate_time = cutils.monotonic()
+        LOG.debug(_("plain_info: %s"), plain_info)
+        return plain_info
+
+    def parse_plain_info(self, plain_info):
+        self.nodes = {}
+        for node, (meminfo, numastat, hugepages) in plain_info.items():
+            info = {}
+            for key, name in self.MEMINFO_KEYS:
+                info[name] = meminfo.get(key)
+            rates = self.rates.rates(
+                node, [numastat.get(key, 0) for key in self.NUMASTAT_KEYS],
+                self._rate_time)
+            for index, key in enumerate(self.NUMASTAT_KEYS):
+                info[key] = round(rates[index], 2) if rates else None
+            for size, counters in hugepages.items():
+                prefix = 'hugepages_%s_' % size
+                info[prefix + 'total'] = counters['nr_hugepages']
+                info[prefix + 'free'] = counters['free_hugepages']
+                info[prefix + 'surplus'] = counters['surplus_hugepages']
+            self.nodes['node%d' % node] = info
+        self.rates.retain(plain_info)
+
+    def get_device_dict(self):
+        return self.nodes
+
+    def init_device(self, device_dict):
+        self.nodes = device_dict
+
+
+class Perf(abstract_device.AbstractDevice):
+    """perf counters of the datapath process.
+
+    Counts are in events/sec, summed over all threads and scaled for
+    multiplexing; running is the lowest percentage of time the counters
+    were on the PMU.  With hardware events ipc is instructions/cycles and
+    cache_miss_ratio the percentage of cache references that missed; with
+    software events cpus_utilized is the task clock in cpus.  All are
+    None on the first sample.
+    """
+
+    name = 'perf'
+
+    def __init__(self, dp_pid, device_dict=None, event_set='auto'):
+        self.counters = perf_event.ProcessCounters(dp_pid, event_set)
+        self._rate_time = None
+        super(Perf, self).__init__(device_dict)
+
+    def get_plain_info(self):
+        counts, running = self.counters.sample()
+        now = cutils.monotonic()
+        elapsed = now - self._rate_time if self._rate_time is not None else 0
+        self._rate_time = now
+        return {'counts': counts, 'running': running, 'elapsed': elapsed}
+
+    def parse_plain_info(self, plain_info):
+        counts = plain_info['counts']
+        elapsed = plain_info['elapsed']
+        self.perf = {'running': round(plain_info['running'] * 100, 2),
+                     'threads': len(self.counters.groups)}
+        for name in self.counters.names:
+            self.perf[name] = (round(counts[name] / elapsed, 2)
+                               if counts and elapsed > 0 else None)
+        if 'cycles' in self.perf:
+            self.perf['ipc'] = self.get_ratio('instructions', 'cycles', 1)
+            self.perf['cache_miss_ratio'] = self.get_ratio(
+                'cache_misses', 'cache_references', 100)
+        if 'task_clock' in self.perf:
+            # task_clock counts nanoseconds.
+            self.perf['cpus_utilized'] = self.get_ratio('task_clock', None,
+                                                        1e-9)
+
+    def get_ratio(self, name, total_name, factor):
+        value = self.perf[name]
+        total = self.perf[total_name] if total_name else 1
+        if value is None or not total:
+            return None
+        return round(float(value) / total * factor, 4)
+
+    def get_device_dict(self):
+        return self.perf
+
+    def init_device(self, device_dict):
+        self.perf = device_dict
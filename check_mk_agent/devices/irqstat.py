@@ -0,0 +1,220 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Per-cpu interrupt and softirq rates from /proc/interrupts,
+/proc/softirqs and /proc/net/softnet_stat.
+
+The first two are a table with a row per interrupt source and a column
+per online cpu.  The rows that pass the name filter are parsed into a
+(rows x ncpu) int64 matrix that is allocated once; the rows to parse are
+only worked out again when the table layout changes.  Rates of every row
+and cpu are computed in one NumPy step.  softnet_stat has a hex row per
+cpu and is read the same way.
+"""
+
+import fnmatch
+import logging
+
+import numpy as np
+
+LOG = logging.getLogger(__name__)
+
+INTERRUPTS_PATH = '/proc/interrupts'
+SOFTIRQS_PATH = '/proc/softirqs'
+
+# Rows of /proc/interrupts that hold one system wide count instead of a
+# count per cpu.
+SINGLE_COUNT_ROWS = frozenset(['ERR', 'MIS'])
+
+# The kernel keeps the counts in unsigned ints.
+COUNTER_MASK = 0xffffffff
+
+
+class IrqStatEngine(object):
+    """Per-second rates of the rows of an interrupt table.
+
+    :param patterns: glob patterns; a row is kept when its key (IRQ number,
+        NMI, NET_RX ...) or one of the words of its description (e.g. the
+        action name virtio0-input.0) matches one.  No patterns keep every
+        row.
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = list(patterns or [])
+        self.cpus = []
+        self.names = []
+        self._keys = None
+        self._lines = []
+        self._allocate(0, 0)
+        self._sampled_at = None
+
+    def _allocate(self, rows, ncpu):
+        self._prev = np.zeros((rows, ncpu), dtype=np.int64)
+        self._now = np.zeros((rows, ncpu), dtype=np.int64)
+        self._delta = np.zeros((rows, ncpu), dtype=np.int64)
+        self._rates = np.zeros((rows, ncpu), dtype=np.float64)
+        self._totals = np.zeros(rows, dtype=np.float64)
+
+    def _match(self, key, description):
+        if not self.patterns:
+            return True
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(key, pattern):
+                return True
+            for word in description:
+                if fnmatch.fnmatchcase(word.rstrip(','), pattern):
+                    return True
+        return False
+
+    def _select(self, lines, keys):
+        """Work out the rows to parse and their names for a new layout."""
+        ncpu = len(self.cpus)
+        self._lines = []
+        self.names = []
+        for index, key in enumerate(keys):
+            key = key.strip()
+            if key in SINGLE_COUNT_ROWS:
+                continue
+            line = lines[index + 1]
+            description = line[line.index(':') + 1:].split()[ncpu:]
+            if not self._match(key, description):
+                continue
+            self._lines.append(index + 1)
+            if description and key.isdigit():
+                # e.g. 24:virtio0-input.0, the action name is last.
+                self.names.append('%s:%s' % (key, description[-1]))
+            else:
+                self.names.append(key)
+        self._allocate(len(self._lines), ncpu)
+        LOG.info(_("Interrupt table layout changed, %(rows)d of %(all)d "
+                   "rows on %(cpus)d cpus selected"),
+                 {'rows': len(self._lines), 'all': len(keys), 'cpus': ncpu})
+
+    def update(self, lines, now):
+        """Load a sample of the table taken at monotonic time now.
+
+        Returns False when there was no usable baseline, i.e. on the first
+        sample and when cpus or rows came or went, and when a row could
+        not be parsed.
+        """
+        keys = [line[:line.find(':')] for line in lines[1:]]
+        cpus = lines[0].split()
+        has_baseline = self._sampled_at is not None
+        if keys != self._keys or len(cpus) != len(self.cpus):
+            self._keys = keys
+            self.cpus = [cpu.lower() for cpu in cpus]
+            self._select(lines, keys)
+            self._sampled_at = None
+            has_baseline = False
+        ncpu = len(self.cpus)
+        for row, index in enumerate(self._lines):
+            line = lines[index]
+            counts = line[line.index(':') + 1:].split()[:ncpu]
+            try:
+                if len(counts) != ncpu:
+                    raise ValueError(counts)
+                self._now[row] = [int(count) for count in counts]
+            except ValueError:
+                # A short or garbled row: the sample is dropped, the
+                # previous one stays the baseline.
+                LOG.warn(_("Unexpected %(name)s row, sample skipped: "
+                           "%(line)s"), {'name': self.names[row],
+                                         'line': line})
+                self._rates[:] = 0.0
+                self._totals[:] = 0.0
+                return False
+        elapsed = now - self._sampled_at if has_baseline else 0
+        self._sampled_at = now
+        if elapsed <= 0:
+            self._rates[:] = 0.0
+            self._totals[:] = 0.0
+            self._prev, self._now = self._now, self._prev
+            return False
+        np.subtract(self._now, self._prev, out=self._delta)
+        np.bitwise_and(self._delta, COUNTER_MASK, out=self._delta)
+        np.divide(self._delta, elapsed, out=self._rates)
+        np.sum(self._rates, axis=1, out=self._totals)
+        np.round(self._rates, 2, out=self._rates)
+        np.round(self._totals, 2, out=self._totals)
+        self._prev, self._now = self._now, self._prev
+        return True
+
+    def get_irqinfos(self):
+        """Return {row name: {'total': rate, cpu name: rate}} of the last
+        update, in interrupts per second."""
+        irqinfos = {}
+        for name, total, rates in zip(self.names, self._totals.tolist(),
+                                      self._rates.tolist()):
+            irqinfo = dict(zip(self.cpus, rates))
+            irqinfo['total'] = total
+            irqinfos[name] = irqinfo
+        return irqinfos
+
+
+SOFTNET_STAT_PATH = '/proc/net/softnet_stat'
+
+# Leading hex columns of /proc/net/softnet_stat that are reported: packets
+# processed by NET_RX, dropped because the backlog was full, and NET_RX
+# runs that stopped with work left (budget or time exhausted).
+SOFTNET_FIELDS = ('processed', 'dropped', 'time_squeeze')
+# Since Linux 5.10 the 13th column is the cpu number; older kernels only
+# list the online cpus in order.
+SOFTNET_CPU_COLUMN = 12
+
+
+class SoftnetStatEngine(object):
+    """Per-cpu rates of the NET_RX counters of /proc/net/softnet_stat."""
+
+    def __init__(self):
+        self.cpus = []
+        self._allocate(0)
+        self._sampled_at = None
+
+    def _allocate(self, ncpu):
+        shape = (ncpu, len(SOFTNET_FIELDS))
+        self._prev = np.zeros(shape, dtype=np.int64)
+        self._now = np.zeros(shape, dtype=np.int64)
+        self._delta = np.zeros(shape, dtype=np.int64)
+        self._rates = np.zeros(shape, dtype=np.float64)
+        self._totals = np.zeros(len(SOFTNET_FIELDS), dtype=np.float64)
+
+    def update(self, lines, now):
+        """Load a sample taken at monotonic time now.
+
+        Returns False when there was no usable baseline, i.e. on the first
+        sample and when cpus came or went.
+        """
+        rows = [line.split() for line in lines]
+        cpus = ['cpu%d' % (int(row[SOFTNET_CPU_COLUMN], 16)
+                           if len(row) > SOFTNET_CPU_COLUMN else index)
+                for index, row in enumerate(rows)]
+        has_baseline = self._sampled_at is not None
+        if cpus != self.cpus:
+            self.cpus = cpus
+            self._allocate(len(cpus))
+            has_baseline = False
+        num_fields = len(SOFTNET_FIELDS)
+        self._now.flat[:] = [int(value, 16) for row in rows
+                             for value in row[:num_fields]]
+        elapsed = now - self._sampled_at if has_baseline else 0
+        self._sampled_at = now
+        if elapsed <= 0:
+            self._rates[:] = 0.0
+            self._totals[:] = 0.0
+            self._prev, self._now = self._now, self._prev
+            return False
+        np.subtract(self._now, self._prev, out=self._delta)
+        np.bitwise_and(self._delta, COUNTER_MASK, out=self._delta)
+        np.divide(self._delta, elapsed, out=self._rates)
+        np.sum(self._rates, axis=0, out=self._totals)
+        np.round(self._rates, 2, out=self._rates)
+        np.round(self._totals, 2, out=self._totals)
+        self._prev, self._now = self._now, self._prev
+        return True
+
+    def get_softnet_infos(self):
+        """Return ({cpu name: {field: rate}}, {field: total rate}) of the
+        last update, in events per second."""
+        cpu_infos = dict((cpu, dict(zip(SOFTNET_FIELDS, rates)))
+                         for cpu, rates in zip(self.cpus,
+                                               self._rates.tolist()))
+        return cpu_infos, dict(zip(SOFTNET_FIELDS, self._totals.tolist()))
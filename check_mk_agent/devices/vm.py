@@ -16,6 +16,11 @@ TenMbKBPerSec = float(10 * 1024 / 8)
 TenMbPktsPerSec = float(500000)
 
 
+def _rate(item, key):
+    """Rate of a device item, 0 while it is unknown (first sample)."""
+    return item[key] or 0.0
+
+
 class Vm(object):
     name = 'vm'
 
@@ -73,8 +78,8 @@ class Vm(object):
             for item in disks['disks']:
                 disk = {'name': item['name']}
                 # disk's average IO number
-                disk['commandsAverage'] = item['iops']
-                disk['ioLatency'] = item['ioLatency']
+                disk['commandsAverage'] = _rate(item, 'iops')
+                disk['ioLatency'] = _rate(item, 'ioLatency')
                 #latency of all pakcets per seconds
                 disk['oio'] = disk['commandsAverage'] * disk['ioLatency']
                 maxObservedOIO = "%s-disk-%s-maxObservedOIO" % (self.name, disk['name'])
@@ -86,15 +91,15 @@ class Vm(object):
                 self.disks['freespace'] += item['capacity'] * (100.0 - item['usage']) / 100.0
 
                 # IO number per sec
-                self.disks['readTotalIos'] += item['readIos']
-                self.disks['writeTotalIos'] += item['writeIos']
+                self.disks['readTotalIos'] += _rate(item, 'readIos')
+                self.disks['writeTotalIos'] += _rate(item, 'writeIos')
                 # IO latency per sec
-                self.disks['readTotalLatency'] += item['readLatency']
-                self.disks['writeTotalLatency'] += item['writeLatency']
+                self.disks['readTotalLatency'] += _rate(item, 'readLatency')
+                self.disks['writeTotalLatency'] += _rate(item, 'writeLatency')
 
                 # kB per sec
-                self.disks['readAverage'] += item['readTput'] / 1024.0
-                self.disks['writeAverage'] += item['writeTput'] / 1024.0
+                self.disks['readAverage'] += _rate(item, 'readTput') / 1024.0
+                self.disks['writeAverage'] += _rate(item, 'writeTput') / 1024.0
                 self.disks['usageAverage'] = self.disks['readAverage'] + self.disks['writeAverage']
 
                 self.disks['workload'] = max(self.disks['workload'], disk['demand'])
@@ -129,10 +134,10 @@ class Vm(object):
             self.nets['usageAverage'] = 0.0
             for item in nets['nets']:
                 net = {'name': item['name']}
-                self.nets['packetsRxPerSec'] += item['pktInRate']
-                self.nets['packetsTxPerSec'] += item['pktOutRate']
-                self.nets['tputRxPerSec'] += item['inOctets'] / 1024.0
-                self.nets['tputTxPerSec'] += item['outOctets'] / 1024.0
+                self.nets['packetsRxPerSec'] += _rate(item, 'pktInRate')
+                self.nets['packetsTxPerSec'] += _rate(item, 'pktOutRate')
+                self.nets['tputRxPerSec'] += _rate(item, 'inOctets') / 1024.0
+                self.nets['tputTxPerSec'] += _rate(item, 'outOctets') / 1024.0
 
             self.nets['usageAverage'] = self.nets['tputRxPerSec'] + self.nets['tputTxPerSec']
 
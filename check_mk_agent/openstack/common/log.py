@@ -47,7 +47,8 @@ from check_mk_agent.openstack.common import jsonutils
 from check_mk_agent.openstack.common import local
 
 
-_AVAILABLE_METRICS = ["cpu", "mem", "system", "disks", "nets", "perf"]
+_AVAILABLE_METRICS = ["cpu", "mem", "system", "disks", "nets", "perf",
+                      "softirqs", "interrupts", "pressure", "numa"]
 
 _DEFAULT_LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
@@ -124,6 +125,20 @@ logging_cli_opts = [
     cfg.StrOpt('monitor-metrics',
                default='cpu,mem',
                help='define monitor metrics'),
+    cfg.StrOpt('metric-intervals',
+               default='',
+               help='seconds between two samples of a metric, e.g. '
+                    'cpu:0.1,nets:1,disks:10,system:60; metrics not '
+                    'listed are sampled every sample-interval'),
+    cfg.BoolOpt('concurrent-collectors',
+                default=True,
+                help='run the collectors of a tick in threads, each with '
+                     'a deadline, instead of one after another'),
+    cfg.StrOpt('collector-deadlines',
+               default='',
+               help='seconds a collector may take before its sections are '
+                    'reported stale, e.g. disks:5; collectors not listed '
+                    'get the current tick interval'),
     cfg.StrOpt('monitor-start',
                default='0',
                help='Limit the monitor start timestamp'),
@@ -142,9 +157,100 @@ logging_cli_opts = [
     cfg.StrOpt('dp-pid',
                 default="",
                 help='datapath process pid which is MUST for perf metric'),
+    cfg.StrOpt('perf-backend',
+               default='events',
+               help='how the perf metric counts: events (perf_event_open '
+                    'in the agent, a sample every tick), perf (a '
+                    'background `sudo perf stat` whose report is shown at '
+                    'the end) or interval (`sudo perf stat -I` whose '
+                    'intervals are merged into the samples)'),
+    cfg.IntOpt('perf-stat-interval',
+               default=1000,
+               help='milliseconds between two intervals of the interval '
+                    'perf backend'),
+    cfg.StrOpt('perf-events',
+               default='auto',
+               help='perf events counted by the events backend: hardware '
+                    '(cycles, instructions, cache references/misses), '
+                    'software (task clock, context switches, migrations, '
+                    'page faults) or auto (hardware if the cpu has a PMU)'),
+    cfg.StrOpt('perf-script-file',
+               default='',
+               help='saved `perf script -F comm,tid,period,event,sym,dso` '
+                    'output to summarize into PERF_TOP instead of running '
+                    'perf script on /tmp/perf-record.out'),
+    cfg.IntOpt('perf-top-size',
+               default=20,
+               help='symbols kept in PERF_TOP for every event and thread'),
+    cfg.IntOpt('perf-top-threads',
+               default=32,
+               help='threads kept in PERF_TOP'),
     cfg.StrOpt('cpu-fields',
                 default="system,user,idle",
                 help='datapath process pid which is MUST for perf metric'),
+    cfg.FloatOpt('sample-interval',
+                 default=1.0,
+                 help='seconds between two samples of the agent loop'),
+    cfg.StrOpt('adaptive-metrics',
+               default='',
+               help='metrics sampled every adaptive-interval while a core '
+                    'is less idle than mute-idlecpu or the dp process is '
+                    'above adaptive-dp-cpu, e.g. cpu,softirqs'),
+    cfg.FloatOpt('adaptive-interval',
+                 default=0.1,
+                 help='seconds between two samples of the adaptive metrics '
+                      'while the threshold is crossed'),
+    cfg.FloatOpt('adaptive-dp-cpu',
+                 default=0,
+                 help='user+system cpu (%) of the dp process that raises '
+                      'the rate of the adaptive metrics, 0 to not watch it'),
+    cfg.FloatOpt('adaptive-hold',
+                 default=10.0,
+                 help='seconds the rate stays raised after the threshold '
+                      'was last crossed'),
+    cfg.FloatOpt('adaptive-decay',
+                 default=2.0,
+                 help='factor the interval of the adaptive metrics grows '
+                      'by at every tick after adaptive-hold, until it is '
+                      'back to normal'),
+    cfg.BoolOpt('burst-on-start',
+                default=False,
+                help='take a burst of cpu samples when the agent starts; '
+                     'SIGUSR1 starts a burst, or ends the running one'),
+    cfg.IntOpt('burst-interval',
+               default=10,
+               help='milliseconds between two samples of a burst'),
+    cfg.FloatOpt('burst-duration',
+                 default=10.0,
+                 help='seconds a burst lasts, 0 until the next SIGUSR1'),
+    cfg.IntOpt('burst-samples',
+               default=1000,
+               help='samples kept by a burst, the last ones when it lasts '
+                    'longer'),
+    cfg.StrOpt('burst-dir',
+               default='/tmp',
+               help='directory the burst samples are written to'),
+    cfg.IntOpt('cpu-freq-interval',
+               default=10,
+               help='seconds between two reads of the per-core frequency'),
+    cfg.StrOpt('nets-backend',
+               default='procfs',
+               help='where interface statistics are read from: procfs '
+                    '(/proc/net/dev) or netlink (one RTM_GETLINK dump, '
+                    'falls back to procfs when unavailable)'),
+    cfg.IntOpt('net-attr-interval',
+               default=30,
+               help='seconds between two reads of interface operstate, '
+                    'speed and mtu'),
+    cfg.StrOpt('softirq-names',
+               default='NET_RX,NET_TX',
+               help='softirqs reported by the softirqs metric, as glob '
+                    'patterns separated by comma'),
+    cfg.StrOpt('irq-names',
+               default='virtio*,mlx*',
+               help='interrupts reported by the interrupts metric, as glob '
+                    'patterns of IRQ numbers or action names (e.g. '
+                    'virtio0-input.0) separated by comma; empty for all'),
     cfg.BoolOpt('monitor-qemu',
                 default=False,
                 help='monitor qemu relative processes.'),
@@ -154,6 +260,16 @@ logging_cli_opts = [
     cfg.BoolOpt("show-cpu-details",
                 default=False,
                 help='show cpu details'),
+    cfg.BoolOpt('monitor-dp-threads',
+                default=False,
+                help='monitor every thread of the datapath process.'),
+    cfg.StrOpt('dp-thread-groups',
+                default="pmd*,handler*,revalidator*",
+                help='datapath thread name patterns whose usage is summed'),
+    cfg.StrOpt('process-groups',
+                default="",
+                help='extra process groups to track besides qemu, vhost '
+                     'and ksoftirqd, as name:regex pairs separated by comma'),
 ]
 
 log_opts = [
@@ -273,6 +389,60 @@ def get_supported_metrics():
     return supported_metrics
 
 
+def _parse_metric_seconds(value):
+    """Parse "metric:seconds,..." into {metric: seconds}."""
+    metric_seconds = {}
+    for ele in value.split(","):
+        ele = ele.strip()
+        if not ele:
+            continue
+        metric, sep, seconds = ele.partition(":")
+        metric = metric.strip()
+        if metric not in _AVAILABLE_METRICS:
+            err_msg = "%s is not a supported metric" % metric
+            sys.exit(err_msg)
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            seconds = 0
+        if seconds <= 0:
+            err_msg = "%s is not a valid number of seconds" % ele
+            sys.exit(err_msg)
+        metric_seconds[metric] = seconds
+    return metric_seconds
+
+
+def get_metric_intervals(supported_metrics):
+    """Return {metric: seconds} of every supported metric."""
+    metric_intervals = dict((metric, CONF.sample_interval)
+                            for metric in supported_metrics)
+    for metric, interval in _parse_metric_seconds(
+            CONF.metric_intervals).items():
+        if metric in metric_intervals:
+            metric_intervals[metric] = interval
+    return metric_intervals
+
+
+def get_collector_deadlines():
+    """Return {metric: seconds} of the collectors with their own
+    deadline."""
+    return _parse_metric_seconds(CONF.collector_deadlines)
+
+
+def get_process_groups():
+    process_groups = []
+    for ele in CONF.process_groups.split(","):
+        ele = ele.strip()
+        if not ele:
+            continue
+        name, sep, pattern = ele.partition(":")
+        if not sep or not name.strip() or not pattern.strip():
+            err_msg = "%s is not a valid process group" % ele
+            sys.exit(err_msg)
+        process_groups.append((name.strip(), pattern.strip()))
+    return process_groups
+
+
 def get_monitor_time_range():
     start_time = CONF.monitor_start
     stop_time = CONF.monitor_stop
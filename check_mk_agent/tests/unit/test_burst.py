@@ -0,0 +1,29 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.devices import burst
+
+
+STAT = '''cpu  100 0 50 800 5 0 2 0 0 0
+cpu0 60 0 30 400 3 0 1 0 0 0
+cpu1 40 0 20 400 2 0 1 0 0 0
+intr 12345 0 0
+'''
+
+
+class ParseCpuLinesTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        lines = burst.read_cpu_lines(STAT)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(burst.parse_cpu_lines(lines)[1],
+                         [60, 0, 30, 400, 3, 0, 1, 0])
+
+    def test_short_line(self):
+        self.assertEqual(burst.parse_cpu_lines(['cpu0 60 0 30 400']),
+                         [[60, 0, 30, 400, 0, 0, 0, 0]])
+
+    def test_garbled_line(self):
+        self.assertRaises(ValueError, burst.parse_cpu_lines,
+                          ['cpu0 60 0 x 400 3 0 1 0'])
@@ -0,0 +1,54 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.common import counter
+
+
+class CounterDeltaTestCase(unittest.TestCase):
+
+    def test_increase(self):
+        self.assertEqual(counter.counter_delta(100, 150), 50)
+
+    def test_wrap32(self):
+        self.assertEqual(counter.counter_delta(2 ** 32 - 10, 5), 15)
+
+    def test_wrap64(self):
+        self.assertEqual(counter.counter_delta(2 ** 64 - 10, 5), 15)
+
+    def test_reset(self):
+        # Too far back for a wrap: the counter counted up from 0.
+        self.assertEqual(counter.counter_delta(2 ** 31 - 1000, 200), 200)
+        self.assertEqual(counter.counter_delta(2 ** 40, 200), 200)
+
+
+class CounterRateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(CounterRateTestCase, self).setUp()
+        self.counter_rate = counter.CounterRate()
+
+    def test_first_sample(self):
+        self.assertIsNone(self.counter_rate.rates('eth0', [10, 20], 100.0))
+
+    def test_rates(self):
+        self.counter_rate.rates('eth0', [10, 2 ** 32 - 10], 100.0)
+        self.assertEqual(self.counter_rate.rates('eth0', [30, 10], 102.0),
+                         [10.0, 10.0])
+
+    def test_reset(self):
+        self.counter_rate.rates('eth0', [2 ** 40], 100.0)
+        self.assertEqual(self.counter_rate.rates('eth0', [400], 102.0),
+                         [200.0])
+
+    def test_same_time(self):
+        self.counter_rate.rates('eth0', [10], 100.0)
+        self.assertIsNone(self.counter_rate.rates('eth0', [20], 100.0))
+
+    def test_retain(self):
+        self.counter_rate.rates('eth0', [10], 100.0)
+        self.counter_rate.rates('eth1', [10], 100.0)
+        self.counter_rate.retain(['eth1'])
+        self.assertIsNone(self.counter_rate.rates('eth0', [20], 101.0))
+        self.assertEqual(self.counter_rate.rates('eth1', [20], 101.0),
+                         [10.0])
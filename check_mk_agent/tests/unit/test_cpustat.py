@@ -0,0 +1,127 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.devices import cpustat
+
+
+def _stat(rows):
+    """Rows of /proc/stat as Cpu.split_plain_info gives them, from
+    [(name, (user, system, idle))]."""
+    return [(name, ' %d 0 %d %d 0 0 0 0 0 0' % values)
+            for name, values in rows]
+
+
+class CpuStatEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(CpuStatEngineTestCase, self).setUp()
+        self.engine = cpustat.CpuStatEngine()
+        self.engine.set_baseline(_stat([('cpu', (100, 100, 800)),
+                                        ('cpu0', (50, 50, 400)),
+                                        ('cpu1', (50, 50, 400))]))
+
+    def test_update(self):
+        self.assertTrue(self.engine.update(_stat([
+            ('cpu', (160, 120, 920)), ('cpu0', (100, 60, 440)),
+            ('cpu1', (60, 60, 480))])))
+        cpuinfos = self.engine.get_cpuinfos()
+        self.assertEqual(cpuinfos['cpu0']['user'], 50.0)
+        self.assertEqual(cpuinfos['cpu0']['system'], 10.0)
+        self.assertEqual(cpuinfos['cpu0']['idle'], 40.0)
+        self.assertEqual(cpuinfos['cpu1']['idle'], 80.0)
+        self.assertEqual(cpuinfos['cpu']['user'], 30.0)
+        # Jiffies per core, the "cpu" row left out.
+        self.assertEqual(self.engine.get_jiffies_interval(), 100.0)
+
+    def test_idle_core(self):
+        self.engine.update(_stat([('cpu', (100, 100, 800)),
+                                  ('cpu0', (50, 50, 400)),
+                                  ('cpu1', (50, 50, 400))]))
+        self.assertEqual(self.engine.get_cpuinfos()['cpu0']['idle'], 0)
+
+    def test_cpu_offline(self):
+        # cpu1 went offline: the sample is the new baseline.
+        self.assertFalse(self.engine.update(_stat([
+            ('cpu', (150, 110, 840)), ('cpu0', (100, 60, 440))])))
+        self.assertEqual(self.engine.names, ['cpu', 'cpu0'])
+        self.assertEqual(self.engine.get_cpuinfos()['cpu0']['idle'], 0.0)
+        self.assertTrue(self.engine.update(_stat([
+            ('cpu', (200, 120, 880)), ('cpu0', (150, 70, 480))])))
+        self.assertEqual(self.engine.get_cpuinfos()['cpu0']['user'], 50.0)
+
+    def test_short_row(self):
+        # Linux 2.4 has no steal column and fewer fields.
+        self.engine.update([('cpu', ' 160 0 120 920'),
+                            ('cpu0', ' 100 0 60 440'),
+                            ('cpu1', ' 60 0 60 480')])
+        self.assertEqual(self.engine.get_cpuinfos()['cpu0']['user'], 50.0)
+
+    def test_garbled_row(self):
+        self.assertFalse(self.engine.update(_stat([
+            ('cpu', (160, 120, 920)), ('cpu0', (100, 60, 440))]) +
+            [('cpu1', ' 60 0 x 480')]))
+        self.assertEqual(self.engine.names, ['cpu', 'cpu0'])
+
+
+PID_STAT = ('%(pid)s (%(comm)s) S 1 1 1 0 -1 4194560 100 0 0 0 '
+            '%(utime)d %(stime)d %(cutime)d 0 20 0 1 0 %(starttime)d 1000 '
+            '100 0\n')
+
+
+class FakePidCpuSampler(cpustat.PidCpuSampler):
+    """Reads the stat of pids from self.stats instead of procfs."""
+
+    def __init__(self):
+        super(FakePidCpuSampler, self).__init__()
+        self.stats = {}
+
+    def set_stat(self, pid, utime, stime, starttime=100, cutime=0):
+        self.stats[pid] = PID_STAT % {
+            'pid': pid, 'comm': 'qemu-kvm', 'utime': utime, 'stime': stime,
+            'cutime': cutime, 'starttime': starttime}
+
+    def read_stat(self, pid):
+        if pid not in self.stats:
+            return None
+        return cpustat.parse_pid_stat(self.stats[pid])
+
+
+class PidCpuSamplerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(PidCpuSamplerTestCase, self).setUp()
+        self.sampler = FakePidCpuSampler()
+        self.released = []
+        real_release = cpustat.procfs.release
+        cpustat.procfs.release = self.released.append
+        self.addCleanup(setattr, cpustat.procfs, 'release', real_release)
+
+    def test_sample(self):
+        self.sampler.set_stat('10', 100, 50, cutime=10)
+        self.assertEqual(self.sampler.sample('qemu', ['10'], 100), {})
+        self.sampler.set_stat('10', 130, 60, cutime=20)
+        # Reaped children count for processes.
+        self.assertEqual(self.sampler.sample('qemu', ['10'], 100),
+                         {'10': {'user': 40.0, 'system': 10.0}})
+
+    def test_pid_reuse(self):
+        self.sampler.set_stat('10', 100, 50)
+        self.sampler.sample('qemu', ['10'], 100)
+        # pid 10 was reused by a process that started later.
+        self.sampler.set_stat('10', 5, 5, starttime=200)
+        self.assertEqual(self.sampler.sample('qemu', ['10'], 100), {})
+        self.sampler.set_stat('10', 25, 15, starttime=200)
+        self.assertEqual(self.sampler.sample('qemu', ['10'], 100),
+                         {'10': {'user': 20.0, 'system': 10.0}})
+
+    def test_release(self):
+        self.sampler.set_stat('10', 100, 50)
+        self.sampler.set_stat('11', 100, 50)
+        self.sampler.sample('qemu', ['10', '11'], 100)
+        self.sampler.sample('process', ['10'], 100)
+        # 10 is still sampled by the process group, its file stays open.
+        self.sampler.sample('qemu', [], 100)
+        self.assertEqual(self.released, ['/proc/11/stat'])
+        self.sampler.forget('process')
+        self.assertEqual(self.released, ['/proc/11/stat', '/proc/10/stat'])
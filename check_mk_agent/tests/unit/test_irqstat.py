@@ -0,0 +1,37 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.devices import irqstat
+
+
+def _interrupts(counts):
+    return ['           CPU0       CPU1',
+            '  24:  %10d %10d   PCI-MSI 49152-edge      virtio0-input.0'
+            % counts,
+            'NMI:          0          0   Non-maskable interrupts']
+
+
+class IrqStatEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(IrqStatEngineTestCase, self).setUp()
+        self.engine = irqstat.IrqStatEngine()
+
+    def test_rates(self):
+        self.assertFalse(self.engine.update(_interrupts((10, 20)), 100.0))
+        self.assertTrue(self.engine.update(_interrupts((30, 60)), 102.0))
+        self.assertEqual(self.engine.get_irqinfos()['24:virtio0-input.0'],
+                         {'cpu0': 10.0, 'cpu1': 20.0, 'total': 30.0})
+
+    def test_short_row(self):
+        self.engine.update(_interrupts((10, 20)), 100.0)
+        lines = _interrupts((30, 60))
+        lines[1] = '  24:         30'
+        self.assertFalse(self.engine.update(lines, 102.0))
+        self.assertEqual(self.engine.get_irqinfos()['24:virtio0-input.0'],
+                         {'cpu0': 0.0, 'cpu1': 0.0, 'total': 0.0})
+        # The rates are since the last complete sample.
+        self.assertTrue(self.engine.update(_interrupts((50, 100)), 104.0))
+        self.assertEqual(self.engine.get_irqinfos()['24:virtio0-input.0'],
+                         {'cpu0': 10.0, 'cpu1': 20.0, 'total': 30.0})
@@ -0,0 +1,48 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.agent.linux import mounts
+
+
+MOUNTINFO = r'''22 1 253:0 / / rw,relatime shared:1 - ext4 /dev/mapper/vg-root rw
+23 22 0:5 / /dev rw,nosuid shared:2 - devtmpfs devtmpfs rw,size=4096k
+24 22 0:21 / /proc rw,nosuid,nodev,noexec shared:3 - proc proc rw
+25 22 253:1 / /var/lib/my\040data rw,relatime shared:4 master:1 - xfs /dev/mapper/vg-data rw
+26 22 253:1 /images /srv/images rw,relatime shared:5 - xfs /dev/mapper/vg-data rw
+27 22 0:45 / /mnt/nfs rw,relatime shared:6 - nfs4 server:/export rw
+28 22 0:46 / /mnt/share rw,relatime shared:7 - fuse.sshfs user@host:/home rw
+29 22 8:17 / /boot rw,relatime - ext2 /dev/sdb1 rw
+'''
+
+
+class ParseMountinfoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ParseMountinfoTestCase, self).setUp()
+        # Device names come from the source, not from the sysfs of the
+        # machine running the tests.
+        real_path = mounts.SYS_DEV_BLOCK
+        mounts.SYS_DEV_BLOCK = '/nonexistent/%d:%d'
+        self.addCleanup(setattr, mounts, 'SYS_DEV_BLOCK', real_path)
+
+    def test_parse(self):
+        parsed = mounts.parse_mountinfo(MOUNTINFO.splitlines())
+        self.assertEqual(
+            [(m.major, m.minor, m.mountpoint, m.fstype, m.source, m.name)
+             for m in parsed],
+            [(253, 0, '/', 'ext4', '/dev/mapper/vg-root', 'vg-root'),
+             # \040 is a space; a second optional field (master:1) does
+             # not shift the fields after the separator.
+             (253, 1, '/var/lib/my data', 'xfs', '/dev/mapper/vg-data',
+              'vg-data'),
+             (8, 17, '/boot', 'ext2', '/dev/sdb1', 'sdb1')])
+
+    def test_unescape(self):
+        # The kernel escapes space, tab, newline and backslash.
+        self.assertEqual(mounts._unescape(r'/mnt/a\040b\011c\134d'),
+                         '/mnt/a b\tc\\d')
+        self.assertEqual(mounts._unescape('/mnt/plain'), '/mnt/plain')
+
+    def test_garbled_line(self):
+        self.assertEqual(mounts.parse_mountinfo(['22 1 253:0 / /']), [])
@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.agent.linux import perf_script
+
+
+class ParseSampleTestCase(unittest.TestCase):
+
+    def test_sample(self):
+        self.assertEqual(perf_script.parse_sample(
+            'ovs-vswitchd  1234     250000 cycles:  dp_netdev_input__ '
+            '(/usr/sbin/ovs-vswitchd)'),
+            ('ovs-vswitchd', 1234, 250000, 'cycles', 'dp_netdev_input__'))
+
+    def test_comm_with_spaces(self):
+        self.assertEqual(perf_script.parse_sample(
+            '       CPU 0/KVM  4321      10000 cycles:  vmx_vmexit '
+            '([kernel.kallsyms])'),
+            ('CPU 0/KVM', 4321, 10000, 'cycles', 'vmx_vmexit'))
+
+    def test_unknown_symbol(self):
+        self.assertEqual(perf_script.parse_sample(
+            'qemu-kvm  4321  5000 cycles:  [unknown] '
+            '(/usr/lib64/libc.so.6)'),
+            ('qemu-kvm', 4321, 5000, 'cycles',
+             '[unknown] /usr/lib64/libc.so.6'))
+
+    def test_event_modifier(self):
+        self.assertEqual(perf_script.parse_sample(
+            'pmd-c03/id:7  2001  777 cycles:ppp:  miniflow_extract '
+            '(/usr/sbin/ovs-vswitchd)'),
+            ('pmd-c03/id:7', 2001, 777, 'cycles', 'miniflow_extract'))
+
+    def test_not_a_sample(self):
+        self.assertIsNone(perf_script.parse_sample(''))
+        self.assertIsNone(perf_script.parse_sample('# ========'))
+
+
+class SpaceSavingTestCase(unittest.TestCase):
+
+    def test_exact_below_capacity(self):
+        top = perf_script.SpaceSaving(3)
+        for key, weight in [('a', 5), ('b', 3), ('a', 1), ('c', 2)]:
+            self.assertIsNone(top.add(key, weight))
+        self.assertEqual(top.top(), [('a', 6, 0), ('b', 3, 0),
+                                     ('c', 2, 0)])
+        self.assertEqual(top.total, 11)
+
+    def test_eviction(self):
+        top = perf_script.SpaceSaving(2)
+        top.add('a', 5)
+        top.add('b', 2)
+        # d takes over the counter of b: it is counted 2 + 1 with an
+        # error of at most 2.
+        self.assertEqual(top.add('d', 1), 'b')
+        self.assertEqual(top.top(), [('a', 5, 0), ('d', 3, 2)])
+
+    def test_error_bound(self):
+        stream = [('a', 10), ('b', 1), ('c', 1), ('d', 1), ('e', 4),
+                  ('b', 2), ('a', 3), ('f', 1), ('e', 1), ('c', 5)]
+        exact = {}
+        top = perf_script.SpaceSaving(3)
+        for key, weight in stream:
+            exact[key] = exact.get(key, 0) + weight
+            top.add(key, weight)
+        for key, count, error in top.top():
+            # The count never underestimates and overestimates by error
+            # at most, which is bounded by total / capacity.
+            self.assertTrue(count - error <= exact[key] <= count)
+            self.assertTrue(error <= top.total / 3.0)
+        # The heaviest key is never evicted.
+        self.assertEqual(top.top(1)[0][0], 'a')
+
+
+class PerfTopTestCase(unittest.TestCase):
+
+    def test_summary(self):
+        lines = [
+            'CPU 0/KVM  11  300 cycles:ppp:  vmx_vmexit ([kernel.kallsyms])',
+            'CPU 0/KVM  11  100 cycles:ppp:  [unknown] (/usr/bin/qemu)',
+            'ovs  12  100 instructions:  main (/usr/sbin/ovs)',
+        ]
+        summary = perf_script.PerfTop().feed(lines).get_summary()
+        self.assertEqual(summary['samples'], 3)
+        self.assertEqual(summary['events']['cycles'], [
+            {'symbol': 'vmx_vmexit', 'period': 300, 'percent': 75.0},
+            {'symbol': '[unknown] /usr/bin/qemu', 'period': 100,
+             'percent': 25.0}])
+        self.assertEqual(summary['threads']['CPU 0/KVM-11']['period'], 400)
+        self.assertEqual(sorted(summary['threads']), ['CPU 0/KVM-11',
+                                                      'ovs-12'])
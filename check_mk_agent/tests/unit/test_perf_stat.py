@@ -0,0 +1,75 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import unittest
+
+from check_mk_agent.agent.linux import perf_stat
+
+
+OUTPUT = '''# started on Sat Oct 17 10:00:00 2026
+
+     1.000305237,2061424,,cycles,1000223041,100.00,,
+     1.000305237,1030712,,instructions,1000223041,100.00,0.50,insn per cycle
+     2.000612100,<not counted>,,cycles,0,0.00,,
+     2.000612100,<not supported>,,instructions,0,0.00,,
+     3.000901332,3000000,,cycles,1000201003,50.00,,
+     3.000901332,1500000,,instructions,1000201003,75.00,0.50,insn per cycle
+'''
+
+
+class ParseIntervalLineTestCase(unittest.TestCase):
+
+    def test_count(self):
+        self.assertEqual(perf_stat.parse_interval_line(
+            '     1.000305237,2061424,,cycles,1000223041,100.00,,'),
+            (1.000305237, 'cycles', 2061424.0, 100.0))
+
+    def test_not_counted(self):
+        self.assertEqual(perf_stat.parse_interval_line(
+            '2.000612100,<not counted>,,cycles,0,0.00,,'),
+            (2.0006121, 'cycles', None, 0.0))
+        self.assertEqual(perf_stat.parse_interval_line(
+            '2.000612100,<not supported>,,instructions,,,,'),
+            (2.0006121, 'instructions', None, None))
+
+    def test_not_a_count(self):
+        for line in ['', '# started on Sat Oct 17 10:00:00 2026',
+                     'Performance counter stats', 'x,1,,cycles']:
+            self.assertIsNone(perf_stat.parse_interval_line(line))
+
+
+class PerfStatStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(PerfStatStreamTestCase, self).setUp()
+        self.stream = perf_stat.PerfStatStream(1234,
+                                               ['cycles', 'instructions'])
+        self.stream.started_at = 1000.0
+
+    def test_feed(self):
+        for line in OUTPUT.splitlines():
+            self.stream.feed(line)
+        self.assertEqual(self.stream.pop_intervals(), {
+            '1001.000': {'cycles': 2061424.0, 'instructions': 1030712.0,
+                         'running': 100.0},
+            '1002.001': {'cycles': None, 'instructions': None,
+                         'running': 0.0},
+            # running is the lowest share of the events.
+            '1003.001': {'cycles': 3000000.0, 'instructions': 1500000.0,
+                         'running': 50.0},
+        })
+        self.assertEqual(self.stream.pop_intervals(), {})
+
+    def test_incomplete_interval(self):
+        # An event missing from an interval: it ends at the next one.
+        self.stream.feed('1.000305237,2061424,,cycles,1000223041,100.00,,')
+        self.assertEqual(self.stream.pop_intervals(), {})
+        self.stream.feed('2.000612100,2000000,,cycles,1000223041,100.00,,')
+        self.assertEqual(self.stream.pop_intervals(), {
+            '1001.000': {'cycles': 2061424.0, 'running': 100.0}})
+
+    def test_pop_until(self):
+        for line in OUTPUT.splitlines():
+            self.stream.feed(line)
+        self.assertEqual(sorted(self.stream.pop_intervals(1002.5)),
+                         ['1001.000', '1002.001'])
+        self.assertEqual(sorted(self.stream.pop_intervals()), ['1003.001'])
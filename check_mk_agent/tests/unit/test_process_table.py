@@ -0,0 +1,61 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from check_mk_agent.agent.linux import process_table
+
+
+STAT = ('%(pid)s (%(comm)s) S 1 %(pid)s %(pid)s 0 -1 4194560 100 0 0 0 '
+        '10 5 0 0 20 0 1 0 %(starttime)d 1000 100 0\n')
+
+
+class ProcessTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ProcessTableTestCase, self).setUp()
+        self.proc_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.proc_dir)
+        self.table = process_table.ProcessTable(
+            [('kvm', 'CPU .*/KVM')], proc_dir=self.proc_dir)
+
+    def _start(self, pid, comm, starttime=100):
+        pid_dir = os.path.join(self.proc_dir, pid)
+        if not os.path.isdir(pid_dir):
+            os.mkdir(pid_dir)
+        with open(os.path.join(pid_dir, 'stat'), 'w') as f:
+            f.write(STAT % {'pid': pid, 'comm': comm, 'starttime': starttime})
+
+    def _exit(self, pid):
+        shutil.rmtree(os.path.join(self.proc_dir, pid))
+
+    def test_groups(self):
+        self._start('10', 'qemu-system-x86')
+        self._start('11', 'vhost-10')
+        self._start('12', 'CPU 0/KVM')
+        self._start('13', 'bash')
+        added, removed = self.table.refresh()
+        self.assertEqual(added['qemu'], set(['10']))
+        self.assertEqual(self.table.get_pids('vhost'), ['11'])
+        self.assertEqual(self.table.get_pids('kvm'), ['12'])
+
+        self._exit('11')
+        added, removed = self.table.refresh()
+        self.assertEqual(removed['vhost'], set(['11']))
+        self.assertEqual(self.table.get_pids('vhost'), [])
+
+    def test_pid_reuse(self):
+        self._start('11', 'vhost-10')
+        self.table.refresh()
+        # pid 11 exited and was reused between two scans.
+        self._start('11', 'bash', starttime=200)
+        added, removed = self.table.refresh()
+        self.assertEqual(removed['vhost'], set(['11']))
+        self.assertEqual(self.table.get_pids('vhost'), [])
+
+        self._start('11', 'vhost-12', starttime=300)
+        added, removed = self.table.refresh()
+        self.assertEqual(added['vhost'], set(['11']))
+        self.assertEqual(self.table.get_pids('vhost'), ['11'])
@@ -0,0 +1,74 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from check_mk_agent.agent.linux import procfs
+
+
+class ProcReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ProcReaderTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.reader = procfs.ProcReader(max_files=2, files_limit=4)
+        self.addCleanup(self.reader.close)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_reread(self):
+        path = self._write('stat', 'one\n')
+        self.assertEqual(self.reader.read(path), 'one\n')
+        self._write('stat', 'two\nlines\n')
+        self.assertEqual(self.reader.read_lines(path), ['two', 'lines'])
+        self.assertEqual(len(self.reader), 1)
+
+    def test_lru_grows(self):
+        paths = [self._write('f%d' % i, str(i)) for i in range(3)]
+        for path in paths:
+            self.reader.read(path)
+        self.assertEqual(len(self.reader), 2)
+        # f0 was closed to make room and is read again: the bound grows.
+        self.reader.read(paths[0])
+        self.assertEqual(self.reader.max_files, 4)
+
+    def test_blocked_read(self):
+        slow = self._write('slow', 'slow')
+        fast = self._write('fast', 'fast')
+        self.reader.read(slow)
+        reading = threading.Event()
+        unblock = threading.Event()
+        slow_file = self.reader._files[slow]
+        read = slow_file._read
+
+        def blocking_read():
+            reading.set()
+            unblock.wait(5)
+            return read()
+
+        slow_file._read = blocking_read
+        results = []
+        slow_reader = threading.Thread(
+            target=lambda: results.append(self.reader.read(slow)))
+        slow_reader.start()
+        self.assertTrue(reading.wait(5))
+        try:
+            # Other files are read while slow is stuck.
+            self.assertEqual(self.reader.read(fast), 'fast')
+            # Released while read: closed only once the read returns.
+            self.reader.release(slow)
+            self.assertFalse(slow_file._closed)
+        finally:
+            unblock.set()
+            slow_reader.join(5)
+        self.assertEqual(results, ['slow'])
+        self.assertTrue(slow_file._closed)
+        self.assertEqual(self.reader.read(slow), 'slow')
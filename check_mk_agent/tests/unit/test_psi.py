@@ -0,0 +1,66 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.agent.linux import psi
+
+
+MEMORY = '''some avg10=1.50 avg60=0.75 avg300=0.10 total=120000
+full avg10=0.50 avg60=0.25 avg300=0.05 total=40000
+'''
+# Before Linux 5.13 the cpu file has no full line.
+CPU_WITHOUT_FULL = 'some avg10=12.00 avg60=8.50 avg300=2.00 total=900000\n'
+
+
+class ParsePressureTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(psi.parse_pressure(MEMORY.splitlines()),
+                         {'some': (1.5, 0.75, 120000),
+                          'full': (0.5, 0.25, 40000)})
+
+    def test_without_full(self):
+        self.assertEqual(psi.parse_pressure(CPU_WITHOUT_FULL.splitlines()),
+                         {'some': (12.0, 8.5, 900000)})
+
+
+class PressureReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(PressureReaderTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.reader = psi.PressureReader()
+        self.path = os.path.join(self.tmp_dir, 'cpu.pressure')
+        self.addCleanup(procfs.release, self.path)
+
+    def _write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_stall(self):
+        self._write(CPU_WITHOUT_FULL)
+        self.assertEqual(self.reader.read(self.path),
+                         {'some_avg10': 12.0, 'some_avg60': 8.5,
+                          'some_stall': 0})
+        self._write('some avg10=12.00 avg60=8.50 avg300=2.00 '
+                    'total=950000\n')
+        self.assertEqual(self.reader.read(self.path)['some_stall'], 50000)
+
+    def test_unreadable(self):
+        self.assertIsNone(self.reader.read(self.path + '.missing'))
+        self._write('some avg10=1.00\n')
+        self.assertIsNone(self.reader.read(self.path))
+
+    def test_sweep(self):
+        self._write(MEMORY)
+        self.reader.read(self.path)
+        self.reader.sweep()
+        self.assertEqual(len(self.reader._totals), 2)
+        # Not read since the previous sweep, e.g. the cgroup went away.
+        self.reader.sweep()
+        self.assertEqual(self.reader._totals, {})
@@ -0,0 +1,186 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import errno
+import socket
+import struct
+import unittest
+
+from check_mk_agent.agent.linux import rtnetlink
+
+
+def _rtattr(rta_type, data):
+    rta_len = rtnetlink.RTATTR.size + len(data)
+    padding = b'\0' * (rtnetlink._align(rta_len) - rta_len)
+    return rtnetlink.RTATTR.pack(rta_len, rta_type) + data + padding
+
+
+def _message(msg_type, seq, body):
+    return rtnetlink.NLMSGHDR.pack(rtnetlink.NLMSGHDR.size + len(body),
+                                   msg_type, 0, seq, 0) + body
+
+
+def _link_message(seq, ifindex, name, stats, flags=rtnetlink.IFF_UP,
+                  carrier=None):
+    body = rtnetlink.IFINFOMSG.pack(socket.AF_UNSPEC, 0, ifindex, flags, 0)
+    body += _rtattr(rtnetlink.IFLA_IFNAME, name.encode('ascii') + b'\0')
+    body += _rtattr(rtnetlink.IFLA_MTU, rtnetlink.U32.pack(1500))
+    body += _rtattr(rtnetlink.IFLA_OPERSTATE, rtnetlink.U8.pack(6))
+    body += _rtattr(rtnetlink.IFLA_STATS64, rtnetlink.STATS64.pack(*stats))
+    if carrier is not None:
+        body += _rtattr(rtnetlink.IFLA_CARRIER, rtnetlink.U8.pack(carrier))
+    return _message(rtnetlink.RTM_NEWLINK, seq, body)
+
+
+def _stats_message(seq, ifindex, stats):
+    body = rtnetlink.IF_STATS_MSG.pack(socket.AF_UNSPEC, 0, 0, ifindex,
+                                       rtnetlink.IFLA_STATS_FILTER_LINK_64)
+    body += _rtattr(rtnetlink.IFLA_STATS_LINK_64,
+                    rtnetlink.STATS64.pack(*stats))
+    return _message(rtnetlink.RTM_NEWSTATS, seq, body)
+
+
+def _error_message(seq, error):
+    return _message(rtnetlink.NLMSG_ERROR, seq,
+                    rtnetlink.NLMSGERR.pack(-error) + b'\0' * 16)
+
+
+def _done_message(seq):
+    return _message(rtnetlink.NLMSG_DONE, seq, struct.pack('=i', 0))
+
+
+# rtnl_link_stats64 counters 0..22 set to 1, 2, 4, ... so that every sum
+# of counters is unique.
+STATS = [1 << i for i in range(23)]
+
+
+class FakeNetlinkSocket(object):
+    """Replies to dump requests with canned messages.
+
+    :param replies: {request type: function(seq) returning the messages}.
+    """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.requests = []
+        self.pending = []
+
+    def bind(self, address):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, request):
+        _len, msg_type, _flags, seq, _pid = rtnetlink.NLMSGHDR.unpack_from(
+            bytes(request))
+        self.requests.append(msg_type)
+        self.pending.append(self.replies[msg_type](seq))
+        return len(request)
+
+    def recv_into(self, buf):
+        if not self.pending:
+            raise socket.error(errno.EAGAIN, 'no notification')
+        data = self.pending.pop(0)
+        buf[:len(data)] = data
+        return len(data)
+
+
+class RtnetlinkTestCase(unittest.TestCase):
+
+    def test_stats64_to_net_dev(self):
+        # The /proc/net/dev columns, as dev_seq_printf_stats sums them.
+        self.assertEqual(rtnetlink.stats64_to_net_dev(STATS), [
+            1 << 2, 1 << 0, 1 << 4, (1 << 6) + (1 << 15), 1 << 14,
+            (1 << 10) + (1 << 11) + (1 << 12) + (1 << 13), 1 << 21, 1 << 8,
+            1 << 3, 1 << 1, 1 << 5, 1 << 7, 1 << 18, 1 << 9,
+            (1 << 16) + (1 << 17) + (1 << 19) + (1 << 20), 1 << 22])
+
+    def test_parse_link(self):
+        msg = bytearray(_link_message(1, 7, 'eth0', STATS, carrier=1))
+        ifindex, name, link = rtnetlink.parse_link(msg, 0, len(msg))
+        self.assertEqual((ifindex, name), (7, 'eth0'))
+        self.assertEqual(link, {
+            'stats': rtnetlink.stats64_to_net_dev(STATS), 'carrier': 1,
+            'operstate': 'up', 'mtu': 1500})
+
+    def test_parse_link_admin_down(self):
+        # IFLA_CARRIER is 1 for links that are down as long as the device
+        # has a carrier.
+        msg = bytearray(_link_message(1, 7, 'eth0', STATS, flags=0,
+                                      carrier=1))
+        self.assertEqual(rtnetlink.parse_link(msg, 0, len(msg))[2]['carrier'],
+                         0)
+
+    def test_parse_link_without_carrier(self):
+        msg = bytearray(_link_message(1, 7, 'eth0', STATS))
+        self.assertIsNone(rtnetlink.parse_link(msg, 0, len(msg))[2]['carrier'])
+
+    def test_parse_stats(self):
+        msg = bytearray(_stats_message(1, 7, STATS))
+        self.assertEqual(rtnetlink.parse_stats(msg, 0),
+                         (7, rtnetlink.stats64_to_net_dev(STATS)))
+
+
+class LinkDumperTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(LinkDumperTestCase, self).setUp()
+        self.stats = list(STATS)
+        self.getstats_error = None
+        self.sockets = []
+
+        def get_links(seq):
+            return (_link_message(seq, 1, 'lo', self.stats, carrier=1) +
+                    _link_message(seq, 2, 'eth0', self.stats, carrier=1) +
+                    _done_message(seq))
+
+        def get_stats(seq):
+            if self.getstats_error:
+                return _error_message(seq, self.getstats_error)
+            return (_stats_message(seq, 1, self.stats) +
+                    _stats_message(seq, 2, self.stats) + _done_message(seq))
+
+        replies = {rtnetlink.RTM_GETLINK: get_links,
+                   rtnetlink.RTM_GETSTATS: get_stats}
+
+        def fake_socket(*args):
+            sock = FakeNetlinkSocket(replies)
+            self.sockets.append(sock)
+            return sock
+
+        real_socket = rtnetlink.socket.socket
+        rtnetlink.socket.socket = fake_socket
+        self.addCleanup(setattr, rtnetlink.socket, 'socket', real_socket)
+        self.dumper = rtnetlink.LinkDumper()
+        self.sock = self.sockets[0]
+
+    def test_getstats(self):
+        links = self.dumper.dump()
+        self.stats[0] += 10
+        links = self.dumper.dump()
+        self.assertEqual(self.sock.requests,
+                         [rtnetlink.RTM_GETLINK, rtnetlink.RTM_GETSTATS])
+        self.assertEqual(sorted(links), ['eth0', 'lo'])
+        self.assertEqual(links['eth0']['stats'][1], 11)
+        self.assertEqual(links['eth0']['carrier'], 1)
+
+    def test_getstats_not_supported(self):
+        # Kernels before 4.7 answer RTM_GETSTATS with EOPNOTSUPP.
+        self.getstats_error = errno.EOPNOTSUPP
+        self.dumper.dump()
+        self.stats[0] += 10
+        links = self.dumper.dump()
+        links = self.dumper.dump()
+        self.assertFalse(self.dumper.use_getstats)
+        self.assertEqual(self.sock.requests,
+                         [rtnetlink.RTM_GETLINK, rtnetlink.RTM_GETSTATS,
+                          rtnetlink.RTM_GETLINK, rtnetlink.RTM_GETLINK])
+        self.assertEqual(links['eth0']['stats'][1], 11)
+
+    def test_getstats_error(self):
+        self.getstats_error = errno.EPERM
+        self.dumper.dump()
+        self.assertRaises(OSError, self.dumper.dump)
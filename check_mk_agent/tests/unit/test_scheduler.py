@@ -0,0 +1,159 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+import time
+import unittest
+
+from eventlet import greenthread
+
+from check_mk_agent.common import scheduler
+from check_mk_agent.common import utils as cutils
+from check_mk_agent.openstack.common import loopingcall
+
+
+class FakeClock(object):
+    """A monotonic clock that only moves when it is told or slept on."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(SchedulerTestCase, self).setUp()
+        self.clock = FakeClock()
+        for module, name, fake in [(cutils, 'monotonic', self.clock.monotonic),
+                                   (greenthread, 'sleep', self.clock.sleep)]:
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, fake)
+
+
+class FixedRateLoopingCallTestCase(SchedulerTestCase):
+
+    def test_next_deadline(self):
+        call = scheduler.FixedRateLoopingCall()
+        self.assertEqual(call._next_deadline(10.0, 1.0, 10.5), 11.0)
+        self.assertEqual(call.stats['overruns'], 0)
+
+    def test_next_deadline_overrun(self):
+        call = scheduler.FixedRateLoopingCall()
+        # Ticks at 11 and 12 were missed, the next one is at 13.
+        self.assertEqual(call._next_deadline(10.0, 1.0, 12.5), 13.0)
+        self.assertEqual(call.stats['overruns'], 1)
+        self.assertEqual(call.stats['skipped'], 2)
+
+    def test_fixed_rate(self):
+        starts = []
+        run_times = [0.2, 0.7, 1.5, 0.1, 0.1]
+
+        def tick():
+            starts.append(self.clock.now)
+            self.clock.now += run_times[len(starts) - 1]
+            if len(starts) == len(run_times):
+                raise loopingcall.LoopingCallDone()
+
+        call = scheduler.FixedRateLoopingCall(tick)
+        call.start(1.0, initial_delay=0.5).wait()
+        # The 1.5 sec run of the tick at 1002.5 skips the one at 1003.5,
+        # the deadlines do not drift with the run times.
+        self.assertEqual(starts, [1000.5, 1001.5, 1002.5, 1004.5, 1005.5])
+        self.assertEqual(call.stats['ticks'], 5)
+        self.assertEqual(call.stats['overruns'], 1)
+        self.assertEqual(call.stats['skipped'], 1)
+
+
+class MetricScheduleTestCase(SchedulerTestCase):
+
+    def test_due(self):
+        schedule = scheduler.MetricSchedule({'cpu': 1.0, 'disk': 5.0})
+        due = [sorted(schedule.due(1000.0 + tick)) for tick in range(11)]
+        self.assertEqual(due, [['cpu', 'disk']] + [['cpu']] * 4 +
+                         [['cpu', 'disk']] + [['cpu']] * 4 +
+                         [['cpu', 'disk']])
+
+    def test_due_slack(self):
+        # 0.1 sec ticks, summed up as floats, still meet the 0.3 sec
+        # deadlines of the slow metric.
+        schedule = scheduler.MetricSchedule({'cpu': 0.1, 'disk': 0.3})
+        now = 0.0
+        disk_ticks = []
+        for tick in range(10):
+            if 'disk' in schedule.due(now):
+                disk_ticks.append(tick)
+            now += 0.1
+        self.assertEqual(disk_ticks, [0, 3, 6, 9])
+
+    def test_due_late(self):
+        schedule = scheduler.MetricSchedule({'cpu': 1.0})
+        schedule.due(1000.0)
+        self.assertEqual(schedule.due(1003.7), ['cpu'])
+        # Missed deadlines are skipped; 1004 is within half a tick, this
+        # sample stands for it.
+        self.assertEqual(schedule.deadlines['cpu'], 1005.0)
+
+    def test_set_interval(self):
+        schedule = scheduler.MetricSchedule({'cpu': 1.0, 'disk': 10.0})
+        schedule.due(1000.0)
+        schedule.set_interval('disk', 2.0, 1001.0)
+        self.assertEqual(schedule.tick_interval, 1.0)
+        # Sped up, disk is due within its new interval.
+        self.assertEqual(schedule.deadlines['disk'], 1003.0)
+        schedule.set_interval('cpu', 0.5, 1001.0)
+        self.assertEqual(schedule.tick_interval, 0.5)
+        schedule.set_interval('disk', 10.0, 1001.0)
+        self.assertEqual(schedule.deadlines['disk'], 1003.0)
+
+
+class CollectorRunnerTestCase(unittest.TestCase):
+
+    def test_default_deadline(self):
+        runner = scheduler.CollectorRunner({'disks': 1.0})
+
+        def collect():
+            time.sleep(0.1)
+            return 'sample'
+
+        # The collectors without a deadline of their own get the one of
+        # the run, e.g. the current tick interval.
+        results, stale = runner.run([('cpu', collect), ('disks', collect)],
+                                    0.01)
+        self.assertEqual(results, {'disks': 'sample'})
+        self.assertEqual(stale, {'cpu': 'timeout'})
+        results, stale = runner.run([('cpu', collect)], 1.0)
+        self.assertEqual(results, {'cpu': 'sample'})
+
+    def test_error(self):
+        runner = scheduler.CollectorRunner({})
+        results, stale = runner.run([('cpu', lambda: 1 // 0)], 1.0)
+        self.assertEqual((results, stale), ({}, {'cpu': 'error'}))
+
+
+class AdaptiveRateTestCase(SchedulerTestCase):
+
+    def test_update(self):
+        schedule = scheduler.MetricSchedule({'cpu': 1.0, 'disk': 5.0})
+        schedule.due(1000.0)
+        adaptive = scheduler.AdaptiveRate(schedule, ['cpu'], 0.1, hold=2.0,
+                                          decay=2.0)
+        self.assertEqual(adaptive.update(False, 1000.0), {'cpu': 1.0})
+        self.assertFalse(adaptive.is_active())
+
+        self.assertEqual(adaptive.update(True, 1001.0), {'cpu': 0.1})
+        self.assertTrue(adaptive.is_active())
+        self.assertEqual(schedule.tick_interval, 0.1)
+        # Held at the fast rate for hold seconds.
+        self.assertEqual(adaptive.update(False, 1002.9), {'cpu': 0.1})
+
+        intervals = [adaptive.update(False, 1003.0 + tick)['cpu']
+                     for tick in range(5)]
+        self.assertEqual(intervals, [0.2, 0.4, 0.8, 1.0, 1.0])
+        self.assertFalse(adaptive.is_active())
+        self.assertEqual(schedule.intervals, {'cpu': 1.0, 'disk': 5.0})
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Compare the Nets backends on a namespace with many veth pairs.
+
+  sudo tools/bench_nets.py --pairs 1000   # create the namespace and run
+  sudo tools/bench_nets.py --cleanup      # delete the namespace
+
+The benchmark re-executes itself inside the namespace through
+`ip netns exec`, so both backends only see the veth devices.
+"""
+
+from __future__ import print_function
+
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import check_mk_agent  # noqa (installs the _ builtin)
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.agent.linux import rtnetlink
+
+NETNS = 'cmk-bench-nets'
+
+
+def run_ip(*args):
+    subprocess.check_call(('ip',) + args)
+
+
+def setup(pairs):
+    run_ip('netns', 'add', NETNS)
+    commands = []
+    for i in range(pairs):
+        commands.append('link add bva%d type veth peer name bvb%d' % (i, i))
+        commands.append('link set bva%d up' % i)
+        commands.append('link set bvb%d up' % i)
+    ip = subprocess.Popen(['ip', '-n', NETNS, '-batch', '-'],
+                          stdin=subprocess.PIPE)
+    ip.communicate('\n'.join(commands).encode('ascii'))
+    if ip.returncode:
+        raise RuntimeError("creating the veth pairs failed")
+
+
+def cleanup():
+    run_ip('netns', 'delete', NETNS)
+
+
+def read_procfs():
+    stats = {}
+    for line in procfs.read_lines('/proc/net/dev')[2:]:
+        name, values = line.split(':', 1)
+        stats[name.strip()] = [int(x) for x in values.split()]
+    return stats
+
+
+def read_netlink(dumper):
+    return dict((name, link['stats'])
+                for name, link in dumper.dump().items())
+
+
+def timeit(func, ticks):
+    samples = []
+    for _tick in range(ticks):
+        start = time.time()
+        result = func()
+        samples.append(time.time() - start)
+    samples.sort()
+    return samples, len(result)
+
+
+def report(name, samples, links):
+    print("%-8s %5d links  median %8.3f ms  p95 %8.3f ms" % (
+        name, links, samples[len(samples) // 2] * 1000,
+        samples[int(len(samples) * 0.95)] * 1000))
+
+
+def run(ticks):
+    dumper = rtnetlink.LinkDumper()
+    procfs_stats = read_procfs()
+    netlink_stats = read_netlink(dumper)
+    if set(procfs_stats) != set(netlink_stats):
+        print("WARNING: backends see different interfaces")
+    report('procfs', *timeit(read_procfs, ticks))
+    report('netlink', *timeit(lambda: read_netlink(dumper), ticks))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--pairs', type='int', default=500,
+                      help='number of veth pairs to create')
+    parser.add_option('--ticks', type='int', default=50,
+                      help='number of samples taken with each backend')
+    parser.add_option('--cleanup', action='store_true',
+                      help='delete the benchmark namespace and exit')
+    parser.add_option('--run', action='store_true',
+                      help='run in the current namespace (internal)')
+    options, _args = parser.parse_args()
+
+    if options.cleanup:
+        cleanup()
+    elif options.run:
+        run(options.ticks)
+    else:
+        setup(options.pairs)
+        try:
+            subprocess.check_call(['ip', 'netns', 'exec', NETNS,
+                                   sys.executable, os.path.abspath(__file__),
+                                   '--run', '--ticks', str(options.ticks)])
+        finally:
+            cleanup()
+
+
+if __name__ == '__main__':
+    main()
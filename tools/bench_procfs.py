@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Compare the per-tick cost of the collector file reads.
+
+The "cat" variant is how the collectors read procfs before the in-process
+reader existed: one fork/exec through agent.linux.utils.execute per file.
+The "procfs" variant uses the cached descriptors of agent.linux.procfs.
+
+Usage: tools/bench_procfs.py [--ticks N] [--pids N]
+"""
+
+from __future__ import print_function
+
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import check_mk_agent  # noqa (installs the _ builtin)
+from check_mk_agent.agent.linux import procfs
+from check_mk_agent.agent.linux import utils
+
+
+def tick_files(pid_count):
+    """The files one agent_loop tick reads with every metric enabled."""
+    files = ['/proc/meminfo', '/proc/stat', '/proc/cpuinfo', '/proc/uptime',
+             '/proc/diskstats', '/proc/net/dev']
+    files.extend('/sys/class/net/%s/carrier' % name
+                 for name in sorted(os.listdir('/sys/class/net')))
+    pids = sorted(int(p) for p in os.listdir('/proc') if p.isdigit())
+    files.extend('/proc/%d/stat' % pid for pid in pids[:pid_count])
+    return files
+
+
+def read_with_cat(path):
+    try:
+        utils.execute(['cat', path])
+    except RuntimeError:
+        pass
+
+
+def read_with_procfs(path):
+    try:
+        procfs.read_file(path)
+    except (IOError, OSError):
+        pass
+
+
+def run(read, files, ticks):
+    samples = []
+    for _tick in range(ticks):
+        start = time.time()
+        for path in files:
+            read(path)
+        samples.append(time.time() - start)
+    samples.sort()
+    return samples
+
+
+def report(name, samples):
+    print("%-8s median %8.3f ms  p95 %8.3f ms  max %8.3f ms" % (
+        name,
+        samples[len(samples) // 2] * 1000,
+        samples[int(len(samples) * 0.95)] * 1000,
+        samples[-1] * 1000))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--ticks', type='int', default=20,
+                      help='number of simulated ticks')
+    parser.add_option('--pids', type='int', default=60,
+                      help='number of /proc/<pid>/stat files read per tick')
+    options, _args = parser.parse_args()
+
+    files = tick_files(options.pids)
+    print("%d files per tick, %d ticks" % (len(files), options.ticks))
+    report('cat', run(read_with_cat, files, options.ticks))
+    report('procfs', run(read_with_procfs, files, options.ticks))
+
+
+if __name__ == '__main__':
+    main()